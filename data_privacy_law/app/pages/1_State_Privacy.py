@@ -9,7 +9,6 @@ This module creates and generates the state privacy law app for the streamlit ap
 import base64
 import os
 import sys
-import time
 
 import pandas as pd
 import streamlit as st
@@ -24,9 +23,16 @@ sys.path.append(root_dir)
 # from outside the root directory causing import pylint errors that are suppressed
 # pylint: disable=wrong-import-position, import-error
 from db_manager.faiss_db_manager import (
+    get_faiss_index_version,
+    get_snapshot_folder,
     load_faiss_index,
     map_chunk_to_metadata,
 )
+from db_manager.answer_cache import AnswerCache
+from db_manager.context_assembly import assemble_context
+from db_manager.bm25_index import load_bm25_index
+from db_manager.faiss_shards import FaissShardRouter
+from db_manager.metadata_index import get_bills_of_state, load_metadata_index
 
 # Streamlit requires pages be in the page directory so these apps have to be run
 # from outside the root directory causing import pylint errors that are suppressed
@@ -36,6 +42,7 @@ from llm_manager.llm_manager import (
     get_confirmation_result_chain,
     get_conversational_chain,
 )
+from llm_manager.context_packer import pack_chain_context
 
 # List of US states.
 us_states = [
@@ -220,33 +227,15 @@ def display_selected_state_bills(selected_state):
         st.dataframe of title and topics for the selected state
 
     """
-    # I tried using as_retriever() with a filter, but it didn't work and
-    # this is the only way I could get it to work.
-    # pylint: disable=protected-access
     if selected_state is not None:
-        all_docs = list(st.session_state.index.docstore._dict.values())
-        # Filter for documents that have metadata "State" matching selected_state.
-        state_docs = [
-            doc for doc in all_docs if doc.metadata.get("State") == selected_state
-        ]
-        if not state_docs:
+        # The bills of every state are kept in the metadata index, so no chunk
+        # is read from the docstore.
+        bills = get_bills_of_state(st.session_state.metadata_index, selected_state)
+        if not bills:
             st.write("No bills found for this state.")
             return None
 
-        # Deduplicate bills based on Title and convert date format.
-        bills = {}
-        for doc in state_docs:
-            title = doc.metadata.get("Title", "No Title")
-            topics = doc.metadata.get("Topics", "No Topics")
-            file_path = doc.metadata.get("Path", "No Path")
-
-            if file_path not in bills:
-
-                bills[title] = {
-                    "Title": title,
-                    "Topics": topics,
-                }
-        df_bills = pd.DataFrame(list(bills.values()))
+        df_bills = pd.DataFrame(bills)
         st.session_state.df_bills = df_bills
         st.dataframe(st.session_state.df_bills, width=1400, hide_index=True)
         return st.session_state.df_bills
@@ -265,8 +254,8 @@ def generate_llm_response(user_question):
         None
 
     Output:
-        if question has already been asked:
-            st.write of the LLM response
+        if the question, or a near duplicate, was answered before for the state:
+            st.write of the cached response, with its page summaries
         if no relevant documents are found:
             st.html of the LLM response
         if new question and relevant documents are found:
@@ -278,10 +267,24 @@ def generate_llm_response(user_question):
     if "selected_state" not in st.session_state:
         raise ValueError("Selected state not found in session state")
 
+    # Questions answered before for this state and index are not sent to the LLM.
+    selected_state = st.session_state.selected_state
+    embed_query = st.session_state.index.embeddings.embed_query
+    cached_answer = st.session_state.answer_cache.lookup(
+        selected_state, st.session_state.index_version, user_question, embed_query
+    )
+    if cached_answer is not None:
+        st.write(cached_answer["Answer"])
+        st.write("---")
+        st.session_state.llm_result = cached_answer["Answer"]
+        if cached_answer["Records"]:
+            show_page_summary_records(cached_answer["Records"])
+        return
+
     filtered_results = st.session_state.index.similarity_search_with_relevance_scores(
         query=user_question,
         k=10,
-        filter={"State": st.session_state.selected_state},
+        filter={"State": selected_state},
         score_threshold=0.2,
     )
 
@@ -294,27 +297,40 @@ def generate_llm_response(user_question):
         )
 
     else:
-        # Prepare documents for the conversational chain.
-        docs_for_chain, chunk_ids_w_metadata = map_chunk_to_metadata(filtered_results)
+        # Prepare documents for the conversational chain. Overlapping chunks of
+        # the same page are merged so their shared text is only sent once.
+        _, chunk_ids_w_metadata = map_chunk_to_metadata(filtered_results)
+        docs_for_chain = assemble_context(filtered_results)
+        # Each chain gets as much of the context as fits its token budget. What
+        # was cut is kept in the session state.
+        context, conversational_report = pack_chain_context(
+            "conversational", docs_for_chain, user_question
+        )
         # Gen summary from llm of relevant context
         chain = get_conversational_chain()
         firstresult = chain.invoke(
-            {"context": docs_for_chain, "question": user_question}
+            {"context": context, "question": user_question}
+        )
+        # Verify if the first LLM response was coherent or not, and stream
+        # the final answer to the screen as the tokens arrive.
+        context, confirmation_report = pack_chain_context(
+            "confirmation", docs_for_chain, user_question, firstresult
         )
-        # Verify if the first LLM response was coherent or not.
+        st.session_state.context_reports = {
+            "conversational": conversational_report,
+            "confirmation": confirmation_report,
+        }
         chain = get_confirmation_result_chain()
-        result = chain.invoke(
-            {
-                "context": docs_for_chain,
-                "question": user_question,
-                "answer": firstresult,
-            }
+        result = st.write_stream(
+            chain.stream(
+                {
+                    "context": context,
+                    "question": user_question,
+                    "answer": firstresult,
+                }
+            )
         )
-        if result != st.session_state.llm_result:
-            st.write_stream(stream_data(result))
-            st.write("---")
-        else:
-            st.write(result)
+        st.write("---")
         st.session_state.llm_result = result
 
         if (
@@ -325,27 +341,31 @@ def generate_llm_response(user_question):
             not in result
         ):
             records = generate_page_summary(chunk_ids_w_metadata, user_question)
-            st.session_state.df = pd.DataFrame(records)
-            st.session_state.relevant_df = st.session_state.df[
-                ["Document", "Page", "Relevant Information"]
-            ]
-        else:
-            records = False
+            show_page_summary_records(records)
+            # Only good answers with every page summarized are cached, so a
+            # failed answer or summary is retried the next time it is asked.
+            if not any(record["Failed"] for record in records):
+                st.session_state.answer_cache.store(
+                    selected_state,
+                    st.session_state.index_version,
+                    user_question,
+                    result,
+                    records,
+                    embed_query,
+                )
 
 
-def stream_data(result_of_llm):
+def show_page_summary_records(records):
     """
-    This function streams the LLM result to the screen.
+    Stores the page summary records in the session state for display_pdf_section.
 
     Args:
-        result_of_llm (str): The result of the LLM
-
-    Returns:
-        None
+        records (list[dict]): The records returned by generate_page_summary
     """
-    for word in result_of_llm.split(" "):
-        yield word + " "
-        time.sleep(0.02)
+    st.session_state.df = pd.DataFrame(records)
+    st.session_state.relevant_df = st.session_state.df[
+        ["Document", "Page", "Relevant Information"]
+    ]
 
 
 def show_pdf(file_path):
@@ -414,12 +434,96 @@ def display_pdf_section():
             show_pdf(pdf_path)
 
 
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_shared_faiss_index(index_version):  # pylint: disable=unused-argument
+    """
+    Loads the FAISS index once for the whole process and shares it, read-only,
+    between all sessions. index_version is only the cache key: when the index
+    on disk is saved again the version changes and the index is reloaded.
+
+    Args:
+        index_version (tuple): The value of get_faiss_index_version()
+
+    Returns:
+        FAISS: The loaded FAISS index
+    """
+    return load_faiss_index()
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_shared_metadata_index(index_version):
+    """
+    Loads the metadata index of the shared FAISS index, once per index version.
+
+    Args:
+        index_version (tuple): The value of get_faiss_index_version()
+
+    Returns:
+        dict: The metadata index, see db_manager.metadata_index
+    """
+    faiss_store = load_shared_faiss_index(index_version)
+    return load_metadata_index(faiss_store, get_snapshot_folder(faiss_store))
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_shared_bm25_index(index_version):
+    """
+    Loads the BM25 index of the shared FAISS index, once per index version.
+
+    Args:
+        index_version (tuple): The value of get_faiss_index_version()
+
+    Returns:
+        SQLiteBM25Index or dict: The BM25 index, see db_manager.bm25_index
+    """
+    return load_bm25_index(load_shared_faiss_index(index_version))
+
+
+@st.cache_resource(show_spinner=False)
+def load_shared_answer_cache():
+    """
+    Opens the answer cache once for the whole process, so every session
+    reuses the answers given to the others.
+
+    Returns:
+        AnswerCache: The answer cache, see db_manager.answer_cache
+    """
+    return AnswerCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_shared_shard_router(index_version):
+    """
+    Wraps the shared FAISS index in a router, so a question about one state only
+    searches the shard of that state when the index has been split into shards.
+    Vector hits are fused with BM25 hits, and questions that only name a bill
+    or section, e.g. "HB 1426", are looked up without embedding them.
+
+    Args:
+        index_version (tuple): The value of get_faiss_index_version()
+
+    Returns:
+        FaissShardRouter: The router, used in place of the FAISS index
+    """
+    faiss_store = load_shared_faiss_index(index_version)
+    return FaissShardRouter(
+        faiss_store,
+        get_snapshot_folder(faiss_store),
+        metadata_index=load_shared_metadata_index(index_version),
+        bm25_index=load_shared_bm25_index(index_version),
+    )
+
+
 def initialize_session_state():
     """
     This function initializes the session state variables.
     """
-    if "index" not in st.session_state or st.session_state.reset_state_page is True:
-        st.session_state.index = load_faiss_index()
+    # Every session points to the same process-wide index
+    index_version = get_faiss_index_version()
+    st.session_state.index = load_shared_shard_router(index_version)
+    st.session_state.metadata_index = load_shared_metadata_index(index_version)
+    st.session_state.index_version = index_version
+    st.session_state.answer_cache = load_shared_answer_cache()
     if "df" not in st.session_state or st.session_state.reset_state_page is True:
         st.session_state.df = pd.DataFrame()
     if (
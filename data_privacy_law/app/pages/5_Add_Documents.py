@@ -23,6 +23,8 @@ from db_manager.faiss_db_manager import (
     add_chunk_to_faiss_index,
     create_folder_for_added_files
 )
+from db_manager.ingest_queue import QUEUED
+from db_manager.page_store import open_page_store
 from db_manager.pdf_parser import (
     extract_uploaded_pdf_pages,
     chunk_text_while_adding_docs,
@@ -34,6 +36,8 @@ from llm_manager.llm_manager import (
 
 
 
+# Seconds an upload waits while another writer, e.g. parse_bills.py, holds the index
+ADD_DOCUMENT_TIMEOUT = 60
 
 # List of US states for the dropdown
 us_states = [
@@ -255,14 +259,27 @@ def main():
                         Your files have been saved to our database.
                         </p>""")
 
-                # Add the document to FAISS database
-                add_chunk_to_faiss_index(chunk_texts, chunk_metadatas)
-                st.html("""<p style = "font-weight:bold;
-                        text-align:center;
-                        font-size:1.3rem;
-                        ">
-                        Your files have been added to the FAISS database.
-                        </p>""")
+                # Add the document to FAISS database, and its pages to the page
+                # store so the State page can summarize them without the PDF
+                add_result = add_chunk_to_faiss_index(chunk_texts, chunk_metadatas,
+                                                      timeout=ADD_DOCUMENT_TIMEOUT)
+                if chunk_metadatas:
+                    open_page_store().put_pages(chunk_metadatas[0]["Path"], list_of_pages)
+                if add_result == QUEUED:
+                    st.html("""<p style = "font-weight:bold;
+                            text-align:center;
+                            font-size:1.3rem;
+                            ">
+                            The FAISS database is being updated. Your files are queued
+                            and will be searchable once the update finishes.
+                            </p>""")
+                else:
+                    st.html("""<p style = "font-weight:bold;
+                            text-align:center;
+                            font-size:1.3rem;
+                            ">
+                            Your files have been added to the FAISS database.
+                            </p>""")
 
             else:
                 st.write("All inputs have not been filled!")
@@ -0,0 +1,84 @@
+"""
+Benchmark retrieval on the PDFs in pdfs/ and on synthetic corpora made of
+copies of them, with no network. Chunks are embedded with a deterministic
+local embedder, so runs can be compared with each other. Reports the index
+build time, the memory used and the p50/p95/p99 latency of a search with and
+without a State filter, for the plain FAISS store as the reference and for the
+shard router the State Privacy page uses.
+Usage: python benchmark_retrieval.py [-p <folder>] [-s <scale> ...] [-k <k>] [-r <rounds>] [-e <provider>] [--no-bm25]
+-p <folder>: Folder of the PDFs. Default is ./pdfs.
+-s <scale>: Size of a corpus in multiples of the PDF corpus. Default is 1 and 10.
+    A scale of 100 or 1000 needs several GB of memory.
+-k <k>: Number of documents searched per question. Default is 10.
+-r <rounds>: How often every benchmark question is searched. Default is 5.
+-e <provider>: Local embedding provider, local-hashing or local-fake. Default is local-hashing.
+--no-bm25: The router only searches the FAISS index, without fusing BM25 hits.
+"""
+import logging
+import argparse
+import warnings
+
+from db_manager.embedding_providers import EMBEDDING_PROVIDERS, create_embeddings
+from db_manager.retrieval_benchmark import load_pdf_corpus, run_retrieval_benchmark
+
+
+def get_args():
+    """
+    Parse command-line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--pdfs", default="./pdfs", help="Folder of the PDFs.")
+    parser.add_argument("-s", "--scales", action="append", type=int,
+                        help="Size of a corpus in multiples of the PDF corpus.")
+    parser.add_argument("-k", default=10, type=int,
+                        help="Number of documents searched per question.")
+    parser.add_argument("-r", "--rounds", default=5, type=int,
+                        help="How often every benchmark question is searched.")
+    parser.add_argument("-e", "--embedding-provider", default="local-hashing",
+                        choices=[name for name, provider in EMBEDDING_PROVIDERS.items()
+                                 if provider["Local"]],
+                        help="Local embedding provider.")
+    parser.add_argument("--no-bm25", action="store_true",
+                        help="The router only searches the FAISS index, without fusing BM25 hits.")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main execution function.
+    """
+    args = get_args()
+    # The local vectors of unrelated texts are far apart, so their relevance
+    # scores fall below the page's threshold or below 0, and LangChain warns
+    # about every such search.
+    logging.getLogger("langchain_core.vectorstores.base").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+    texts, metadatas = load_pdf_corpus(args.pdfs)
+    if not texts:
+        print(f"No PDF text found under {args.pdfs}.")
+        return
+    print(f"PDF corpus: {len(texts)} chunks\n")
+
+    report = run_retrieval_benchmark(texts, metadatas, args.scales or (1, 10), k=args.k,
+                                     rounds=args.rounds, bm25=not args.no_bm25,
+                                     embeddings=create_embeddings(args.embedding_provider))
+    print(f"{'Scale':>6}{'Chunks':>10}{'Build s':>9}{'Vectors MB':>12}{'Memory MB':>11}")
+    for row in report:
+        print(f"{row['Scale']:>6}{row['Chunks']:>10}{row['Build s']:>9.2f}"
+              f"{row['Vectors MB']:>12.1f}{row['Memory MB']:>11.1f}")
+
+    # The FAISS store filters after the search, as LangChain does, and is the
+    # reference for the router's pre-filtered, BM25 fused searches.
+    for title, prefix in (("FAISS store", ""), ("Router", "Router ")):
+        print(f"\n{title} latency")
+        print(f"{'Scale':>6}{'P50 ms':>9}{'P95 ms':>9}{'P99 ms':>9}"
+              f"{'State P50':>11}{'State P95':>11}{'State P99':>11}")
+        for row in report:
+            print(f"{row['Scale']:>6}{row[prefix + 'P50 ms']:>9.2f}"
+                  f"{row[prefix + 'P95 ms']:>9.2f}{row[prefix + 'P99 ms']:>9.2f}"
+                  f"{row[prefix + 'State P50 ms']:>11.2f}{row[prefix + 'State P95 ms']:>11.2f}"
+                  f"{row[prefix + 'State P99 ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Rebuild the vectors of the FAISS index under each index type and report the
+recall@k against Flat, the p50/p99 latency of a single query and the bytes
+per vector, to choose the index type of a deployment.
+Usage: python compare_index_types.py [-t <type> ...] [-k <k>] [-q <queries>] [--synthetic <n>]
+-t <type>: Index type to compare, Flat, IVF, HNSW or IVF-PQ. Default is all of them.
+-k <k>: Number of neighbours searched per query. Default is 10.
+-q <queries>: Number of chunks held out of the corpus and used as queries. Default is 200.
+--synthetic <n>: Use n random 768 dimension vectors instead of the FAISS index,
+    to estimate a larger corpus.
+"""
+import os
+import argparse
+
+import faiss
+import numpy as np
+
+from db_manager.index_snapshots import resolve_snapshot_folder
+from db_manager.index_types import INDEX_TYPES, compare_index_types, get_index_vectors
+
+
+def get_args():
+    """
+    Parse command-line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--types", action="append", choices=INDEX_TYPES,
+                        help="Index type to compare. Default is all of them.")
+    parser.add_argument("-k", default=10, type=int,
+                        help="Number of neighbours searched per query.")
+    parser.add_argument("-q", "--queries", default=200, type=int,
+                        help="Number of chunks held out and used as queries.")
+    parser.add_argument("--synthetic", default=None, type=int,
+                        help="Number of random vectors to use instead of the FAISS index.")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main execution function.
+    """
+    args = get_args()
+    rng = np.random.default_rng(0)
+    metric = faiss.METRIC_L2
+
+    if args.synthetic:
+        vectors = rng.standard_normal((args.synthetic, 768)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+    else:
+        index_path = os.path.join(resolve_snapshot_folder(), "index.faiss")
+        if not os.path.exists(index_path):
+            print(f"No FAISS index at {index_path}. Run parse_bills.py or use --synthetic.")
+            return
+        index = faiss.read_index(index_path)
+        metric = index.metric_type
+        vectors = get_index_vectors(index)
+
+    # Held out chunks stand in for questions about the corpus.
+    order = rng.permutation(len(vectors))
+    query_count = min(args.queries, len(vectors) // 10)
+    query_vectors = vectors[order[:query_count]]
+    corpus = vectors[order[query_count:]]
+    print(f"Corpus: {len(corpus)} vectors of dimension {corpus.shape[1]}, "
+          f"{query_count} queries\n")
+
+    report = compare_index_types(corpus, query_vectors, args.types or INDEX_TYPES,
+                                 k=args.k, metric=metric)
+    print(f"{'Type':<8}{f'Recall@{args.k}':>12}{'P50 ms':>10}{'P99 ms':>10}"
+          f"{'Bytes/vector':>14}{'Build s':>10}")
+    for row in report:
+        print(f"{row['Type']:<8}{row[f'Recall@{args.k}']:>12.3f}{row['P50 ms']:>10.3f}"
+              f"{row['P99 ms']:>10.3f}{row['Bytes/vector']:>14.1f}{row['Build s']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
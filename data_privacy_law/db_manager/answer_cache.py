@@ -0,0 +1,250 @@
+"""
+Persistent cache of the answers given on the State Privacy page.
+An answer and its page summary records are stored in SQLite keyed by the
+state, the version of the FAISS index and the question. A question is a hit
+if the same question, or one whose embedding has a cosine similarity above
+`similarity_threshold`, was answered before for the same state and index.
+Answers expire after `ttl_seconds`, the least recently used answers are
+evicted once the cache holds more than `max_entries`, and answers for an older
+index version are dropped when an answer for a newer one is stored. Answers
+for a newer index version, stored by a process that loaded the index later,
+are kept.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+from db_manager.bm25_index import is_identifier_query
+from db_manager.embedding_cache import normalize_query
+
+ANSWER_CACHE_PATH = "./db_manager/data/answer_cache.sqlite"
+
+
+def get_index_version_key(index_version):
+    """
+    Return the text stored for an index version, e.g. of get_faiss_index_version().
+    """
+    return json.dumps(index_version)
+
+
+def get_index_version_time(index_version):
+    """
+    Return the latest modification time in an index version of
+    get_faiss_index_version(), which holds a (size, modification time) pair
+    per file, or 0 if it has none. A newer index has a later time.
+    """
+    return max(
+        (entry[-1] for entry in index_version or ()
+         if isinstance(entry, (list, tuple)) and entry and isinstance(entry[-1], (int, float))),
+        default=0,
+    )
+
+
+class AnswerCache:
+    """
+    SQLite backed cache of answers. Safe to share between threads.
+
+    Args:
+        db_path (str): The path to the SQLite file.
+        ttl_seconds (float): How long an answer is served after it was stored.
+        max_entries (int): The maximum number of answers kept in the cache.
+        similarity_threshold (float): The cosine similarity above which two
+            questions are treated as the same question.
+    """
+
+    def __init__(self, db_path=ANSWER_CACHE_PATH, ttl_seconds=7 * 24 * 3600,
+                 max_entries=5000, similarity_threshold=0.95):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        """
+        Open the SQLite file and create the table the first time it is needed.
+        """
+        if self.connection is None:
+            folder = os.path.dirname(self.db_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS answers (
+                    state TEXT NOT NULL,
+                    index_version TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    vector BLOB,
+                    answer TEXT NOT NULL,
+                    records TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    index_time INTEGER,
+                    PRIMARY KEY (state, index_version, question)
+                )"""
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(answers)")]
+            if "index_time" not in columns:
+                # Caches written before answers recorded the time of their index.
+                self.connection.execute("ALTER TABLE answers ADD COLUMN index_time INTEGER")
+            self.connection.commit()
+        return self.connection
+
+    def get_question_vector(self, question, embed_query):
+        """
+        Return the normalized embedding of a question, or None for questions
+        that only name identifiers, which are only matched exactly.
+        """
+        if embed_query is None or is_identifier_query(question):
+            return None
+        vector = np.asarray(embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, state, index_version, question, embed_query=None):
+        """
+        Return the cached answer to a question, or None.
+
+        Args:
+            state (str): The selected state.
+            index_version (tuple): The version of the FAISS index.
+            question (str): The question.
+            embed_query (callable): Optional, returns the embedding of a text.
+                Only called if the exact question is not cached.
+
+        Returns:
+            dict: {"Question", "Answer", "Records"}, the question as it was
+                asked first and the page summary records, or None on a miss.
+        """
+        version_key = get_index_version_key(index_version)
+        oldest = time.time() - self.ttl_seconds
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute(
+                "SELECT question, answer, records FROM answers "
+                "WHERE state = ? AND index_version = ? AND question = ? AND created >= ?",
+                (state, version_key, normalize_query(question), oldest),
+            ).fetchone()
+        if row is None:
+            question_vector = self.get_question_vector(question, embed_query)
+            if question_vector is not None:
+                with self.lock:
+                    rows = self.connect().execute(
+                        "SELECT question, answer, records, vector FROM answers "
+                        "WHERE state = ? AND index_version = ? AND created >= ? "
+                        "AND vector IS NOT NULL",
+                        (state, version_key, oldest),
+                    ).fetchall()
+                rows = [cached for cached in rows if len(cached[3]) == question_vector.nbytes]
+                if rows:
+                    vectors = np.stack([np.frombuffer(cached[3], dtype=np.float32)
+                                        for cached in rows])
+                    similarities = vectors @ question_vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        row = rows[best][:3]
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            connection = self.connect()
+            connection.execute(
+                "UPDATE answers SET last_used = ? "
+                "WHERE state = ? AND index_version = ? AND question = ?",
+                (time.time(), state, version_key, row[0]),
+            )
+            connection.commit()
+        return {"Question": row[0], "Answer": row[1], "Records": json.loads(row[2])}
+
+    def store(self, state, index_version, question, answer, records, embed_query=None):
+        """
+        Store the answer to a question. Expired answers and answers for older
+        index versions, see get_index_version_time, are removed, and the least
+        recently used answers are evicted if the cache is over its size.
+
+        Args:
+            state (str): The selected state.
+            index_version (tuple): The version of the FAISS index.
+            question (str): The question.
+            answer (str): The answer shown to the user.
+            records (list[dict]): The page summary records, see generate_page_summary.
+            embed_query (callable): Optional, returns the embedding of a text.
+        """
+        question_vector = self.get_question_vector(question, embed_query)
+        now = time.time()
+        version_key = get_index_version_key(index_version)
+        index_time = get_index_version_time(index_version)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(state, index_version, question, vector, answer, records, created, last_used, "
+                "index_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    state,
+                    version_key,
+                    normalize_query(question),
+                    None if question_vector is None else question_vector.tobytes(),
+                    answer,
+                    json.dumps(records),
+                    now,
+                    now,
+                    index_time,
+                ),
+            )
+            connection.execute(
+                "DELETE FROM answers WHERE created < ? OR (index_version != ? "
+                "AND (index_time IS NULL OR index_time < ?))",
+                (now - self.ttl_seconds, version_key, index_time),
+            )
+            (entry_count,) = connection.execute("SELECT COUNT(*) FROM answers").fetchone()
+            if entry_count > self.max_entries:
+                connection.execute(
+                    "DELETE FROM answers WHERE rowid IN "
+                    "(SELECT rowid FROM answers ORDER BY last_used LIMIT ?)",
+                    (entry_count - self.max_entries,),
+                )
+            connection.commit()
+
+    def invalidate(self, index_version=None):
+        """
+        Remove every answer, or only the answers for other index versions.
+        """
+        with self.lock:
+            connection = self.connect()
+            if index_version is None:
+                connection.execute("DELETE FROM answers")
+            else:
+                connection.execute("DELETE FROM answers WHERE index_version != ?",
+                                   (get_index_version_key(index_version),))
+            connection.commit()
+
+    def stats(self):
+        """
+        Return the hit and miss counters of this cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """
+        Close the SQLite connection.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,327 @@
+"""
+Functions for the BM25 lexical index of the chunk texts.
+Embedding search handles exact identifiers such as "HB 1426" or
+"Sec. 541.051" poorly, so chunk texts are also kept in an inverted index that
+is scored with BM25. Stopwords are left out of the index and of queries, and
+chunks below BM25_MIN_SCORE are not returned, so a query only matches chunks
+that share a meaningful term with it. Results of both searches are combined
+with reciprocal rank fusion. The postings and chunk lengths are saved in
+tables of the docstore.sqlite of the index, see db_manager.sqlite_docstore,
+and a search only reads the postings of its terms, so nothing is loaded at
+startup. Stores without these tables, e.g. ones saved before them, get an
+index built in memory.
+"""
+
+import re
+import math
+from collections import Counter
+
+BM25_POSTINGS_TABLE = "bm25_postings"
+BM25_LENGTHS_TABLE = "bm25_lengths"
+# Saved indexes of another version were tokenized differently and are rebuilt.
+BM25_INDEX_VERSION = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+BM25_MIN_SCORE = 1.0
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*|§")
+IDENTIFIER_PREFIXES = (
+    r"h\.?\s?b\.?|s\.?\s?b\.?|h\.?\s?f\.?|s\.?\s?f\.?|a\.?\s?b\.?|l\.?\s?d\.?|"
+    r"h\.?\s?r\.?|s\.?\s?r\.?|sec(?:tion|s)?\.?|§+|art(?:icle)?\.?|ch(?:apter)?\.?|"
+    r"title|part|rule"
+)
+# A number alone, e.g. the year in "2023", is not an identifier, and the
+# prefix has to start a word, so "March 2023" is not chapter 2023.
+IDENTIFIER_PATTERN = re.compile(
+    rf"(?<![a-z0-9])(?:{IDENTIFIER_PREFIXES})\s*\d+(?:[.\-]\d+)*[a-z]?(?:\(\w+\))*",
+    re.IGNORECASE,
+)
+SECTION_WORDS = {"§": "sec", "section": "sec", "sections": "sec", "secs": "sec"}
+STOPWORDS = frozenset((
+    "a", "about", "all", "also", "am", "an", "and", "any", "are", "as", "at", "be",
+    "been", "being", "but", "by", "can", "could", "did", "do", "does", "for", "from",
+    "had", "has", "have", "he", "her", "his", "how", "i", "if", "in", "into", "is",
+    "it", "its", "me", "my", "no", "not", "of", "on", "or", "our", "she", "so",
+    "some", "such", "than", "that", "the", "their", "them", "then", "there",
+    "these", "they", "this", "those", "to", "us", "was", "we", "were", "what",
+    "when", "where", "which", "who", "whom", "why", "will", "with", "would",
+    "you", "your",
+))
+
+
+def tokenize(text):
+    """
+    Split a text into lowercase terms. Section numbers such as "541.051" are one
+    term, and a short prefix followed by a number also gives the joined term, so
+    "HB 1426", "H.B. 1426" and "HB1426" all contain the term "hb1426", and
+    "Section 541.051" and "§ 541.051" both contain "sec541.051".
+    Stopwords are left out, but still join a prefix, e.g. the "A" of "A.B. 5".
+    """
+    words = TOKEN_PATTERN.findall(text.lower())
+    terms = [word for word in words if word not in STOPWORDS]
+    prefix = ""
+    for word in words:
+        word = SECTION_WORDS.get(word, word)
+        if word[0].isdigit():
+            if prefix:
+                terms.append(prefix + word)
+            prefix = ""
+        elif word.isalpha() and len(word) <= 4:
+            # Initials such as "H.B." are joined into "hb".
+            prefix = prefix + word if len(word) == 1 and len(prefix) == 1 else word
+        else:
+            prefix = ""
+    return terms
+
+
+def is_identifier_query(query):
+    """
+    Return True if the query only names bill or section identifiers, e.g.
+    "HB 1426", "SB 5708, HB 1834" or "Sec. 541.051". Such queries are answered
+    from the BM25 index alone, without embedding the query.
+    """
+    parts = [part for part in re.split(r",|;|\band\b|\bor\b", query, flags=re.IGNORECASE)
+             if part.strip()]
+    return bool(parts) and all(
+        IDENTIFIER_PATTERN.fullmatch(part.strip()) for part in parts
+    )
+
+
+def has_identifier(query):
+    """
+    Return True if the query names a bill or section identifier anywhere,
+    e.g. "What does HB 1426 say?".
+    """
+    return IDENTIFIER_PATTERN.search(query) is not None
+
+
+def create_bm25_index():
+    """
+    Return an empty BM25 index.
+    """
+    return {"Version": BM25_INDEX_VERSION, "Count": 0, "Doc_ids": [], "Doc_lengths": [],
+            "Total_length": 0, "Postings": {}}
+
+
+def add_to_bm25_index(bm25_index, doc_id, text):
+    """
+    Add the text of one chunk to the BM25 index.
+    """
+    position = len(bm25_index["Doc_ids"])
+    term_counts = Counter(tokenize(text))
+    for term, count in term_counts.items():
+        bm25_index["Postings"].setdefault(term, []).append([position, count])
+    doc_length = sum(term_counts.values())
+    bm25_index["Doc_ids"].append(doc_id)
+    bm25_index["Doc_lengths"].append(doc_length)
+    bm25_index["Total_length"] += doc_length
+    bm25_index["Count"] += 1
+
+
+def build_bm25_index(faiss_store):
+    """
+    Build the BM25 index of every chunk in a loaded FAISS store.
+    """
+    bm25_index = create_bm25_index()
+    # pylint: disable=protected-access
+    for doc_id, doc in faiss_store.docstore._dict.items():
+        add_to_bm25_index(bm25_index, doc_id, getattr(doc, "page_content", ""))
+    return bm25_index
+
+
+def create_bm25_tables(connection):
+    """
+    Create the postings and chunk length tables in a docstore.sqlite.
+    """
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS {BM25_POSTINGS_TABLE} (
+            term TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (term, position)
+        ) WITHOUT ROWID"""
+    )
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS {BM25_LENGTHS_TABLE} (
+            position INTEGER PRIMARY KEY,
+            length INTEGER NOT NULL
+        )"""
+    )
+
+
+def drop_bm25_tables(connection):
+    """
+    Drop the postings and chunk length tables, e.g. of another BM25_INDEX_VERSION.
+    """
+    for table in (BM25_POSTINGS_TABLE, BM25_LENGTHS_TABLE):
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def add_bm25_rows(connection, rows):
+    """
+    Write the postings and lengths of chunks to the tables of a docstore.sqlite.
+
+    Args:
+        connection (sqlite3.Connection): The open docstore.sqlite.
+        rows (list[tuple]): (index position, text) of each chunk.
+    """
+    postings = []
+    lengths = []
+    for position, text in rows:
+        term_counts = Counter(tokenize(text))
+        postings.extend((term, position, count) for term, count in term_counts.items())
+        lengths.append((position, sum(term_counts.values())))
+    connection.executemany(f"INSERT INTO {BM25_POSTINGS_TABLE} VALUES (?, ?, ?)", postings)
+    connection.executemany(f"INSERT INTO {BM25_LENGTHS_TABLE} VALUES (?, ?)", lengths)
+
+
+def get_total_length(connection):
+    """
+    Return the summed length of the chunks in the tables of a docstore.sqlite.
+    """
+    return connection.execute(f"SELECT SUM(length) FROM {BM25_LENGTHS_TABLE}").fetchone()[0] or 0
+
+
+class SQLiteBM25Index:
+    """
+    BM25 index of a store whose postings are saved in its docstore.sqlite.
+    Each search reads the postings of the query terms only. Chunks added to
+    the store since it was loaded are not searched.
+
+    Args:
+        docstore (SQLiteDocstore): The docstore of the loaded store.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+        self.total_length = docstore.get_property("bm25_total_length") or 0
+
+    def search(self, query, k=10, allowed_doc_ids=None, min_score=BM25_MIN_SCORE):
+        """
+        Same as search_bm25_index.
+        """
+        doc_count = self.docstore.count_saved()
+        terms = sorted(set(tokenize(query)))
+        if doc_count == 0 or not terms:
+            return []
+        rows = self.docstore.query(
+            f"SELECT postings.term, postings.count, lengths.length, documents.id "
+            f"FROM {BM25_POSTINGS_TABLE} AS postings "
+            f"JOIN {BM25_LENGTHS_TABLE} AS lengths ON lengths.position = postings.position "
+            "JOIN documents ON documents.position = postings.position "
+            f"WHERE postings.term IN ({', '.join('?' * len(terms))}) "
+            "ORDER BY postings.position",
+            terms,
+        )
+        doc_frequencies = Counter(row[0] for row in rows)
+        average_length = self.total_length / doc_count
+
+        scores = {}
+        for term, count, doc_length, doc_id in rows:
+            if allowed_doc_ids is not None and doc_id not in allowed_doc_ids:
+                continue
+            idf = get_idf(doc_count, doc_frequencies[term])
+            scores[doc_id] = scores.get(doc_id, 0.0) + get_term_score(
+                idf, count, doc_length, average_length
+            )
+        return get_best_scores(scores, k, min_score)
+
+
+def load_bm25_index(faiss_store):
+    """
+    Return the BM25 index of a loaded FAISS store: a SQLiteBM25Index if its
+    docstore.sqlite has the tables of this BM25_INDEX_VERSION, otherwise an
+    index built from the docstore.
+
+    Args:
+        faiss_store (FAISS): The loaded FAISS store the index belongs to.
+    """
+    docstore = faiss_store.docstore
+    # A SQLiteDocstore, whose class is not imported as db_manager.sqlite_docstore
+    # imports this module.
+    if (callable(getattr(type(docstore), "has_table", None))
+            and docstore.has_table(BM25_POSTINGS_TABLE)
+            and docstore.get_property("bm25_version") == BM25_INDEX_VERSION):
+        return SQLiteBM25Index(docstore)
+    return build_bm25_index(faiss_store)
+
+
+def get_idf(doc_count, doc_frequency):
+    """
+    Return the BM25 inverse document frequency of a term.
+    """
+    return math.log(1 + (doc_count - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+
+def get_term_score(idf, count, doc_length, average_length):
+    """
+    Return the BM25 score one term adds to a chunk it occurs `count` times in.
+    """
+    length_norm = 1 - BM25_B + BM25_B * doc_length / average_length
+    return idf * (count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm))
+
+
+def get_best_scores(scores, k, min_score):
+    """
+    Return the best k (key, score) pairs of at least min_score, best first.
+    """
+    return sorted(
+        (item for item in scores.items() if item[1] >= min_score),
+        key=lambda item: item[1], reverse=True,
+    )[:k]
+
+
+def search_bm25_index(bm25_index, query, k=10, allowed_doc_ids=None,
+                      min_score=BM25_MIN_SCORE):
+    """
+    Return the chunks that best match the terms of the query, scored with BM25.
+
+    Args:
+        bm25_index (dict): The BM25 index, or a SQLiteBM25Index.
+        query (str): The query text.
+        k (int): The maximum number of chunks returned.
+        allowed_doc_ids (set): Optional, only these docstore ids are returned.
+        min_score (float): Chunks that score lower are not returned.
+
+    Returns:
+        list[tuple[str, float]]: (docstore id, BM25 score), best first.
+    """
+    if isinstance(bm25_index, SQLiteBM25Index):
+        return bm25_index.search(query, k, allowed_doc_ids, min_score)
+    doc_count = bm25_index["Count"]
+    if doc_count == 0:
+        return []
+    average_length = bm25_index["Total_length"] / doc_count
+    doc_ids = bm25_index["Doc_ids"]
+    doc_lengths = bm25_index["Doc_lengths"]
+
+    scores = {}
+    for term in set(tokenize(query)):
+        postings = bm25_index["Postings"].get(term)
+        if not postings:
+            continue
+        idf = get_idf(doc_count, len(postings))
+        for position, count in postings:
+            if allowed_doc_ids is not None and doc_ids[position] not in allowed_doc_ids:
+                continue
+            scores[position] = scores.get(position, 0.0) + get_term_score(
+                idf, count, doc_lengths[position], average_length
+            )
+    return [(doc_ids[position], score)
+            for position, score in get_best_scores(scores, k, min_score)]
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    Combine ranked lists of ids into one ranking. Each id scores
+    sum(1 / (k + rank)) over the lists it appears in, with ranks starting at 1.
+
+    Returns:
+        list[tuple]: (id, fused score), best first.
+    """
+    fused = {}
+    for ranked_ids in ranked_lists:
+        for rank, item_id in enumerate(ranked_ids, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
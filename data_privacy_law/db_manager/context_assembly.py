@@ -0,0 +1,110 @@
+"""
+Functions for assembling the context given to the LLM chains.
+Pages are split into chunks of 800 characters that overlap by up to 200, so
+neighbouring chunks of the same page that are both retrieved repeat part of
+their text. Before the chunks are sent to the LLM, the chunks of each
+(Path, Page) are merged into spans: neighbouring chunks are joined where their
+texts overlap and repeated texts are dropped. Spans are ordered by the best
+score of their chunks, so no retrieved text is lost but fewer prompt tokens
+are sent.
+"""
+
+import re
+
+from langchain_core.documents import Document
+
+CHUNK_NO_PATTERN = re.compile(r"_ChunkNo_(\d+)$")
+# Shorter overlaps are taken as chance matches and the texts are kept whole.
+MIN_OVERLAP = 10
+
+
+def get_chunk_number(doc):
+    """
+    Return the position of a chunk on its page from its Chunk_id, or None.
+    """
+    match = CHUNK_NO_PATTERN.search(doc.metadata.get("Chunk_id") or "")
+    return int(match.group(1)) if match else None
+
+
+def get_text_overlap(first, second, min_overlap=MIN_OVERLAP):
+    """
+    Return the length of the longest end of `first` that is also the start of
+    `second`, or 0 if it is shorter than `min_overlap`.
+    """
+    for length in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if length and first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def merge_texts(first, second):
+    """
+    Join the texts of two neighbouring chunks, keeping their overlap once.
+    """
+    overlap = get_text_overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    return first + "\n" + second
+
+
+def assemble_context(filtered_results):
+    """
+    Merge retrieved chunks of the same (Path, Page) into spans for the LLM.
+
+    Chunks of a page are taken in page order. A chunk that follows the
+    previous chunk on the page, or whose text overlaps the end of the span, is
+    merged into the span; a chunk whose text is already in the span is
+    dropped; any other chunk starts a new span.
+
+    Args:
+        filtered_results (List[Tuple[Document, float]]): The retrieved documents
+            and relevance scores, as returned by similarity_search_with_relevance_scores.
+
+    Returns:
+        List[Document]: One document per span, best scoring span first. The
+            metadata is that of the first chunk of the span, with "Chunk_ids"
+            listing every chunk merged into it.
+    """
+    if not isinstance(filtered_results, list):
+        raise TypeError("filtered_results must be a list")
+
+    pages = {}
+    for rank, (doc, score) in enumerate(filtered_results):
+        page_key = (doc.metadata.get("Path"), doc.metadata.get("Page"))
+        pages.setdefault(page_key, []).append((rank, doc, score))
+
+    spans = []
+    for page_hits in pages.values():
+        # Chunks without a number keep their rank order after the numbered ones.
+        page_hits.sort(key=lambda hit: (get_chunk_number(hit[1]) is None,
+                                        get_chunk_number(hit[1]) or 0, hit[0]))
+        span = None
+        for rank, doc, score in page_hits:
+            text = doc.page_content
+            chunk_number = get_chunk_number(doc)
+            follows_span = span is not None and (
+                text in span["Text"]
+                or (chunk_number is not None and span["Last"] is not None
+                    and chunk_number == span["Last"] + 1)
+                or get_text_overlap(span["Text"], text) > 0
+            )
+            if not follows_span:
+                span = {"Text": text, "Doc": doc, "Chunk_ids": [], "Score": score,
+                        "Rank": rank, "Last": chunk_number}
+                spans.append(span)
+            elif text not in span["Text"]:
+                span["Text"] = merge_texts(span["Text"], text)
+                if chunk_number is not None:
+                    span["Last"] = chunk_number
+            span["Chunk_ids"].append(doc.metadata.get("Chunk_id"))
+            if (score, -rank) > (span["Score"], -span["Rank"]):
+                span["Score"], span["Rank"] = score, rank
+
+    spans.sort(key=lambda span: (-span["Score"], span["Rank"]))
+    return [
+        Document(
+            page_content=span["Text"],
+            metadata={**span["Doc"].metadata, "Chunk_ids": span["Chunk_ids"]},
+        )
+        for span in spans
+    ]
@@ -0,0 +1,255 @@
+"""
+On-disk cache of chunk embeddings.
+Vectors are stored in SQLite keyed by (model name, sha256 of the chunk text),
+so re-chunking the same bill or rebuilding the index does not pay for the same
+embeddings again. The least recently used vectors are evicted once the cache
+holds more than `max_entries` vectors.
+
+CachedQueryEmbeddings wraps the embeddings used to search the index, so the
+embedding of a question that was asked before is served from memory or from
+this cache instead of the embedding API.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = "./db_manager/data/embedding_cache.sqlite"
+
+
+def hash_chunk_text(text):
+    """
+    Return the SHA-256 hex digest of a chunk text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_embedding_model_name(embeddings):
+    """
+    Return the model name used to key the cache, or None if the embeddings
+    do not name their model, in which case they are not cached.
+    """
+    model_name = getattr(embeddings, "model", None)
+    if isinstance(model_name, str):
+        return model_name
+    return None
+
+
+class EmbeddingCache:
+    """
+    SQLite backed LRU cache of embeddings. Safe to share between threads.
+
+    Args:
+        db_path (str): The path to the SQLite file.
+        max_entries (int): The maximum number of vectors kept in the cache.
+    """
+
+    def __init__(self, db_path=EMBEDDING_CACHE_PATH, max_entries=200_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        """
+        Open the SQLite file and create the table the first time it is needed.
+        """
+        if self.connection is None:
+            folder = os.path.dirname(self.db_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    def get_many(self, model_name, texts):
+        """
+        Look up the vectors of many texts.
+
+        Returns:
+            list: One vector (list[float]) per text, None where it is not cached.
+        """
+        text_hashes = [hash_chunk_text(text) for text in texts]
+        found = {}
+        with self.lock:
+            connection = self.connect()
+            unique_hashes = list(set(text_hashes))
+            # Stay below SQLite's limit on the number of query parameters.
+            for start in range(0, len(unique_hashes), 500):
+                hash_batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(hash_batch))
+                rows = connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_name, *hash_batch],
+                )
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+            now = time.time_ns()
+            connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model_name, text_hash) for text_hash in found],
+            )
+            connection.commit()
+
+            vectors = [found.get(text_hash) for text_hash in text_hashes]
+            hit_count = sum(vector is not None for vector in vectors)
+            self.hits += hit_count
+            self.misses += len(vectors) - hit_count
+        return vectors
+
+    def put_many(self, model_name, texts, vectors):
+        """
+        Store the vectors of many texts and evict the least recently used
+        vectors if the cache is over its size.
+        """
+        now = time.time_ns()
+        rows = [
+            (model_name, hash_chunk_text(text),
+             np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            (entry_count,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if entry_count > self.max_entries:
+                connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (entry_count - self.max_entries,),
+                )
+            connection.commit()
+
+    def stats(self):
+        """
+        Return the hit and miss counters of this cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """
+        Close the SQLite connection.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def normalize_query(query):
+    """
+    Return the key of a query: case folded with whitespace collapsed, so
+    questions that only differ in case or spacing share an embedding.
+    """
+    return " ".join(query.casefold().split())
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings that cache query embeddings in a LRU in memory and in an
+    EmbeddingCache on disk, keyed by the normalized query and the model.
+    A query seen before by the process costs no request at all, and one seen
+    by an earlier process costs one SQLite lookup. Documents are embedded by
+    the wrapped embeddings as before.
+
+    Args:
+        embeddings (Embeddings): The embeddings to wrap, e.g. Gemini.
+        cache (EmbeddingCache): Optional on-disk cache. Query vectors are kept
+            apart from document vectors, because Gemini embeds them differently.
+        max_memory_entries (int): The number of query vectors kept in memory.
+    """
+
+    def __init__(self, embeddings, cache=None, max_memory_entries=1024):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def model(self):
+        """
+        The model name of the wrapped embeddings.
+        """
+        return getattr(self.embeddings, "model", None)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return list(self.memory[key])
+
+        model_name = get_embedding_model_name(self.embeddings)
+        cache_key = f"{model_name}:query"
+        vector = None
+        if self.cache is not None and model_name is not None:
+            vector = self.cache.get_many(cache_key, [key])[0]
+        with self.lock:
+            if vector is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            if self.cache is not None and model_name is not None:
+                self.cache.put_many(cache_key, [key], [vector])
+
+        with self.lock:
+            self.memory[key] = list(vector)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+        return list(vector)
+
+    def stats(self):
+        """
+        Return the hit and miss counters of the query cache.
+        """
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,171 @@
+"""
+Functions for embedding many chunks at once.
+- embed_texts_in_batches: Embeds texts in fixed-size batches on a bounded
+    thread pool and retries with backoff when the embedding quota is exhausted.
+    Texts found in the embedding cache are not sent to the embedder.
+- is_quota_error: Checks whether an error was caused by an exhausted quota.
+- LocalFakeEmbeddings: Deterministic local embedder that can stand in for
+    Gemini so ingest throughput can be measured offline.
+"""
+
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from google.api_core.exceptions import ResourceExhausted
+from langchain_core.embeddings import Embeddings
+
+from db_manager.embedding_cache import get_embedding_model_name
+
+
+def get_status_code(error):
+    """
+    Return the HTTP status code of an API error, or None if it has none.
+    """
+    code = getattr(error, "code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_quota_error(error):
+    """
+    Return True if the error, or any error it was raised from, means the
+    embedding API rejected the request because the quota or rate limit was hit:
+    a ResourceExhausted error or an HTTP 429 status code.
+    langchain_google_genai wraps the original error, so the chain is followed.
+    """
+    while error is not None:
+        if isinstance(error, ResourceExhausted) or get_status_code(error) == 429:
+            return True
+        error = error.__cause__
+    return False
+
+
+def embed_batch_with_retry(embeddings, batch, max_retries=5, initial_backoff=1.0):
+    """
+    Embed one batch of texts, retrying with exponential backoff on quota errors.
+    Any other error is raised straight away.
+    """
+    backoff = initial_backoff
+    attempt = 0
+    while True:
+        try:
+            return embeddings.embed_documents(batch)
+        except Exception as embed_error:  # pylint: disable=broad-exception-caught
+            if attempt == max_retries or not is_quota_error(embed_error):
+                raise
+            print(f"Embedding quota exhausted; retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+            backoff *= 2
+            attempt += 1
+
+
+def embed_texts_in_batches(
+    texts,
+    embeddings,
+    batch_size=100,
+    max_concurrency=4,
+    max_retries=5,
+    initial_backoff=1.0,
+    cache=None,
+):
+    """
+    Embed texts in fixed-size batches with at most `max_concurrency` requests
+    in flight at a time.
+
+    Args:
+        texts (list[str]): The texts to embed.
+        embeddings (Embeddings): The langchain embeddings used for each batch.
+        batch_size (int): Number of texts per request. Gemini accepts up to 100.
+        max_concurrency (int): Maximum number of batches embedded at once.
+        max_retries (int): Number of retries for a batch that hits the quota.
+        initial_backoff (float): Seconds to wait before the first retry,
+            doubled after every retry.
+        cache (EmbeddingCache): Optional cache checked before any request is
+            sent. New vectors are stored in it.
+
+    Returns:
+        list[list[float]]: One vector per text, in the same order as `texts`.
+    """
+    if not texts:
+        return []
+
+    model_name = get_embedding_model_name(embeddings)
+    if cache is not None and model_name is not None:
+        vectors = cache.get_many(model_name, texts)
+        missing = [ind for ind, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[ind] for ind in missing]
+            missing_vectors = embed_texts_in_batches(
+                missing_texts, embeddings, batch_size, max_concurrency,
+                max_retries, initial_backoff,
+            )
+            cache.put_many(model_name, missing_texts, missing_vectors)
+            for ind, vector in zip(missing, missing_vectors):
+                vectors[ind] = vector
+        return vectors
+
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    if max_concurrency <= 1 or len(batches) == 1:
+        batch_vectors = [
+            embed_batch_with_retry(embeddings, batch, max_retries, initial_backoff)
+            for batch in batches
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+            batch_vectors = list(executor.map(
+                lambda batch: embed_batch_with_retry(
+                    embeddings, batch, max_retries, initial_backoff
+                ),
+                batches,
+            ))
+
+    vectors = [vector for batch in batch_vectors for vector in batch]
+    if len(vectors) != len(texts):
+        raise ValueError(
+            f"Expected {len(texts)} embeddings but the embedder returned {len(vectors)}"
+        )
+    return vectors
+
+
+class LocalFakeEmbeddings(Embeddings):
+    """
+    Deterministic embedder that runs locally. The same text always gets the
+    same unit vector, seeded from its SHA-256. A fixed latency per request can
+    be added to imitate the round trip to the embedding API.
+
+    Args:
+        size (int): Dimension of the vectors. text-embedding-004 uses 768.
+        latency (float): Seconds to sleep for every embed call.
+    """
+
+    def __init__(self, size=768, latency=0.0):
+        self.model = f"local-fake-{size}"
+        self.size = size
+        self.latency = latency
+        self.call_count = 0
+        self.lock = threading.Lock()
+
+    def embed_text(self, text):
+        """
+        Return the vector of a single text.
+        """
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.call_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,237 @@
+"""
+Registry of the embedding providers the FAISS index can be built with.
+- gemini: Gemini text-embedding-004 through the API. The default.
+- local-hashing: Character n-grams of the text hashed into a signed vector
+    with NumPy, without the network. Texts that share words and word parts get
+    similar vectors, so searches return related chunks, unlike local-fake.
+- local-fake: embedding_pipeline.LocalFakeEmbeddings, a random vector per text.
+The provider is chosen with the EMBEDDING_PROVIDER environment variable, or
+passed by name. The provider, model and dimension that built an index are
+saved next to it as embedding_provider.json, and loading the index with
+another provider raises a ValueError instead of returning meaningless results.
+Indexes saved before the provider was recorded were built with Gemini.
+"""
+
+import os
+import json
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from db_manager.embedding_cache import get_embedding_model_name
+from db_manager.embedding_pipeline import LocalFakeEmbeddings
+
+EMBEDDING_PROVIDER_ENV = "EMBEDDING_PROVIDER"
+DEFAULT_EMBEDDING_PROVIDER = "gemini"
+EMBEDDING_PROVIDER_FILE = "embedding_provider.json"
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local embedder that hashes the character n-grams of a text into a vector.
+    Each n-gram of the lowercased text adds +1 or -1, chosen by its hash, to
+    the dimension its hash selects. Counts are damped with log(1 + count) and
+    the vector is normalized. A batch of texts is encoded with a few NumPy
+    operations over all of their bytes at once.
+
+    Args:
+        size (int): Dimension of the vectors. text-embedding-004 uses 768.
+        ngram_sizes (tuple[int]): Lengths of the n-grams, in bytes.
+    """
+
+    def __init__(self, size=768, ngram_sizes=(3, 4, 5)):
+        self.model = f"local-hashing-{size}"
+        self.size = size
+        self.ngram_sizes = ngram_sizes
+
+    def encode(self, texts):
+        """
+        Return the vectors of a batch of texts as an array of shape (len(texts), size).
+        """
+        encoded = [f" {' '.join(text.lower().split())} ".encode("utf-8") for text in texts]
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        row_ids = np.repeat(np.arange(len(texts)), [len(text) for text in encoded])
+
+        counts = np.zeros(len(texts) * self.size, dtype=np.float64)
+        for ngram_size in self.ngram_sizes:
+            ngram_count = len(data) - ngram_size + 1
+            if ngram_count <= 0:
+                continue
+            # FNV-1a over the bytes of every n-gram, for all texts at once.
+            hashes = np.full(ngram_count, FNV_OFFSET, dtype=np.uint64)
+            for offset in range(ngram_size):
+                hashes = (hashes ^ data[offset:offset + ngram_count]) * FNV_PRIME
+            # N-grams that run across two texts are left out.
+            inside_text = row_ids[:ngram_count] == row_ids[ngram_size - 1:]
+            hashes = hashes[inside_text]
+            rows = row_ids[:ngram_count][inside_text]
+            buckets = (hashes % np.uint64(self.size)).astype(np.int64)
+            signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+            counts += np.bincount(rows * self.size + buckets, weights=signs,
+                                  minlength=len(counts))
+
+        vectors = counts.reshape(len(texts), self.size)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+# name -> factory of the embeddings, the model they use, their dimension, and
+# whether they run locally, in which case their queries are not cached.
+EMBEDDING_PROVIDERS = {
+    "gemini": {
+        "Factory": lambda: GoogleGenerativeAIEmbeddings(model="models/text-embedding-004"),
+        "Model": "models/text-embedding-004",
+        "Dimension": 768,
+        "Local": False,
+    },
+    "local-hashing": {
+        "Factory": HashingEmbeddings,
+        "Model": "local-hashing-768",
+        "Dimension": 768,
+        "Local": True,
+    },
+    "local-fake": {
+        "Factory": LocalFakeEmbeddings,
+        "Model": "local-fake-768",
+        "Dimension": 768,
+        "Local": True,
+    },
+}
+
+
+def register_embedding_provider(name, factory, model, dimension, local=False):
+    """
+    Add an embedding provider to the registry, or replace the one of that name.
+    `factory` is called without arguments and returns the embeddings.
+    """
+    EMBEDDING_PROVIDERS[name] = {
+        "Factory": factory, "Model": model, "Dimension": dimension, "Local": local
+    }
+
+
+def get_embedding_provider_name(provider=None):
+    """
+    Return the provider to use: `provider` if given, otherwise the
+    EMBEDDING_PROVIDER environment variable, otherwise Gemini.
+    """
+    provider = provider or os.getenv(EMBEDDING_PROVIDER_ENV) or DEFAULT_EMBEDDING_PROVIDER
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(
+            f"Unknown embedding provider {provider}, choose one of {list(EMBEDDING_PROVIDERS)}"
+        )
+    return provider
+
+
+def create_embeddings(provider=None):
+    """
+    Return the embeddings of a provider, see get_embedding_provider_name.
+    """
+    return EMBEDDING_PROVIDERS[get_embedding_provider_name(provider)]["Factory"]()
+
+
+def is_local_provider(provider=None):
+    """
+    Return True if the provider embeds texts without the network.
+    """
+    return EMBEDDING_PROVIDERS[get_embedding_provider_name(provider)]["Local"]
+
+
+def get_provider_of_model(model_name):
+    """
+    Return the name of the first registered provider that embeds with a model,
+    or None if none does.
+    """
+    for name, provider in EMBEDDING_PROVIDERS.items():
+        if provider["Model"] == model_name:
+            return name
+    return None
+
+
+def get_embedding_provider_info(provider=None, embeddings=None):
+    """
+    Return the record of a provider saved next to an index: its "Provider"
+    name, "Model" and "Dimension". Embeddings that were passed in directly,
+    without a provider name, are recorded under the registered provider of
+    their model, or under their model name if no provider has it.
+    """
+    if embeddings is not None and provider is None:
+        model_name = get_embedding_model_name(embeddings) or type(embeddings).__name__
+        provider = get_provider_of_model(model_name)
+        if provider is None:
+            return {"Provider": model_name, "Model": model_name,
+                    "Dimension": getattr(embeddings, "size", None)}
+    provider = get_embedding_provider_name(provider)
+    return {"Provider": provider,
+            "Model": EMBEDDING_PROVIDERS[provider]["Model"],
+            "Dimension": EMBEDDING_PROVIDERS[provider]["Dimension"]}
+
+
+def load_embedding_provider_info(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the provider record saved next to an index. Indexes without one
+    were built before it was recorded, with Gemini.
+    """
+    info_path = os.path.join(faiss_folder, EMBEDDING_PROVIDER_FILE)
+    if not os.path.isfile(info_path):
+        return get_embedding_provider_info("gemini")
+    with open(info_path, "r", encoding="utf-8") as info_file:
+        return json.load(info_file)
+
+
+def save_embedding_provider_info(provider_info, faiss_folder="./db_manager/faiss_index"):
+    """
+    Write the provider record next to the index.
+    """
+    info_path = os.path.join(faiss_folder, EMBEDDING_PROVIDER_FILE)
+    temp_path = info_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as info_file:
+        json.dump(provider_info, info_file)
+    os.replace(temp_path, info_path)
+
+
+def check_embedding_provider(provider_info, faiss_folder="./db_manager/faiss_index",
+                             dimension=None):
+    """
+    Raise a ValueError if the index in the folder was built by another
+    provider or model, or if its vectors do not have the provider's dimension.
+
+    Args:
+        provider_info (dict): The record of the provider used to load the index.
+        faiss_folder (str): The folder of the FAISS index.
+        dimension (int): Optional dimension of the vectors of the loaded index.
+    """
+    recorded = dict(load_embedding_provider_info(faiss_folder))
+    if recorded.get("Provider") == recorded.get("Model"):
+        # Indexes built with embeddings passed in directly were once recorded
+        # under their model name even when a provider has that model.
+        recorded["Provider"] = get_provider_of_model(recorded.get("Model")) or recorded.get("Model")
+    if (recorded.get("Provider"), recorded.get("Model")) != (
+        provider_info["Provider"], provider_info["Model"]
+    ):
+        raise ValueError(
+            f"The index in {faiss_folder} was built with the {recorded.get('Provider')} "
+            f"embedding provider ({recorded.get('Model')}), not "
+            f"{provider_info['Provider']} ({provider_info['Model']}). Set "
+            f"{EMBEDDING_PROVIDER_ENV} to the provider of the index, or build a new index."
+        )
+    expected = provider_info.get("Dimension")
+    for found in (recorded.get("Dimension"), dimension):
+        if isinstance(found, int) and isinstance(expected, int) and found != expected:
+            raise ValueError(
+                f"The index in {faiss_folder} holds vectors of dimension {found}, but "
+                f"{provider_info['Provider']} embeds into dimension {expected}."
+            )
@@ -4,15 +4,81 @@ Functions for managing FAISS database and chunks
 
 import os
 import csv
-import re
+import shutil
+import sqlite3
+import weakref
 
 from dotenv import load_dotenv
 import google.generativeai as genai
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
 from llm_manager.llm_manager import parse_bill_info
-from db_manager.pdf_parser import extract_text_from_pdf, chunk_pdf_pages
+from db_manager.embedding_cache import (
+    CachedQueryEmbeddings,
+    EmbeddingCache,
+    EMBEDDING_CACHE_PATH,
+)
+from db_manager.embedding_pipeline import embed_texts_in_batches
+from db_manager.embedding_providers import (
+    check_embedding_provider,
+    create_embeddings,
+    get_embedding_provider_info,
+    get_embedding_provider_name,
+    is_local_provider,
+    save_embedding_provider_info,
+)
+from db_manager.faiss_shards import (
+    get_partition_key,
+    get_shard_folder,
+    has_faiss_shards,
+    load_faiss_shard,
+    load_shard_partitions,
+    save_shard_partitions,
+    split_faiss_shards,
+)
+from db_manager.index_types import convert_faiss_index
+from db_manager.index_snapshots import (
+    begin_snapshot,
+    copy_snapshot_folder,
+    migrate_legacy_index,
+    pin_snapshot,
+    publish_snapshot,
+    resolve_snapshot_folder,
+)
+from db_manager.ingest_queue import (
+    IndexWriteLock,
+    list_queued_batches,
+    load_batch,
+    remove_batches,
+    set_batch_aside,
+    submit_chunks,
+)
+from db_manager.page_store import PageStore
+from db_manager.sqlite_docstore import (
+    DOCSTORE_FILE,
+    SQLiteDocstore,
+    get_documents,
+    load_faiss_store,
+    save_faiss_store,
+)
+from db_manager.metadata_index import (
+    add_bill_to_metadata_index,
+    create_metadata_index,
+    get_doc_id_for_chunk,
+    load_metadata_index,
+    save_metadata_index,
+)
+from db_manager.ingest_manifest import (
+    get_unchanged_bill_info,
+    record_bill_in_manifest,
+)
+from db_manager.pdf_parser import (
+    extract_text_from_pdf,
+    extract_texts_in_parallel,
+    chunk_pdf_pages,
+    sanitize_filename,
+    yield_in_input_order,
+)
 
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -45,114 +111,543 @@ def calculate_updated_chunk_ids(chunk_metadatas):
     return chunk_metadatas
 
 
+class FaissIngestSession:
+    """
+    Context manager that loads the FAISS index once, adds the chunks of many
+    documents to it and saves it once when the session ends, instead of loading
+    and saving the whole index for every document.
+
+    The session also holds the page store and keeps the bills of the metadata
+    index up to date, see db_manager.page_store and db_manager.metadata_index.
+    The facet and BM25 postings of the chunks are written with the docstore,
+    see db_manager.sqlite_docstore.
+    With `write_shards` it also keeps the per-partition shards up to date, see
+    FaissShardRouter.
+
+    The index is loaded from the current snapshot of the folder, which stays
+    pinned while the session runs, and every save writes a new snapshot that
+    replaces it in one step, see db_manager.index_snapshots. Readers that
+    loaded the index before are not affected by a save. An index saved before
+    snapshots is first copied into a snapshot, and its files are left in place.
+    The session holds the write lock of the folder while it runs, and every
+    save also adds the batches other writers queued meanwhile, see
+    db_manager.ingest_queue.
+
+    Chunks are queued and embedded together in fixed-size batches, with a
+    bounded number of embedding requests in flight, and the vectors are added
+    with add_embeddings. The queue is flushed when it reaches `pending_limit`
+    chunks, at every checkpoint and when the session ends.
+    While the session runs it holds the write lock of the folder, so other
+    writers queue their batches, see db_manager.ingest_queue. add_chunks
+    saves as soon as a batch is waiting, so they wait for one document of a
+    long ingest, not for all of it.
+
+    Usage:
+        with FaissIngestSession() as session:
+            session.add_chunks(chunk_texts, chunk_metadatas)
+
+    Args:
+        faiss_folder (str): The folder of the FAISS index.
+        index_name (str): The file name of the FAISS index.
+        checkpoint_every (int): Optional, save the index after this many
+            add_chunks calls so a long ingest does not lose all of its work
+            if it is interrupted. None only saves at the end.
+        embeddings (Embeddings): Optional embeddings to use instead of the
+            provider's, e.g. embedding_pipeline.LocalFakeEmbeddings for offline runs.
+        batch_size (int): Number of chunks per embedding request.
+        max_concurrency (int): Maximum number of embedding requests in flight.
+        pending_limit (int): Number of queued chunks that triggers a flush.
+        cache_path (str): The embedding cache checked before any embedding
+            request, see db_manager.embedding_cache. None disables the cache.
+        write_shards (bool): Also add the chunks to the FAISS index of their
+            partition in the shards folder. Missing shards of an existing
+            index are built from it first. None, the default, only keeps the
+            shards up to date if the loaded index already has them.
+        index_type (str): Optional, one of index_types.INDEX_TYPES. The index is
+            rebuilt as this type, trained on its vectors, when it is saved and
+            has another type. None keeps the type of the loaded index, and new
+            indexes are Flat.
+        embedding_provider (str): Optional name of the embedding provider, see
+            db_manager.embedding_providers. None uses the EMBEDDING_PROVIDER
+            environment variable, or Gemini. A ValueError is raised if the
+            existing index was built by another provider.
+        write_lock (IndexWriteLock): Optional write lock of the folder that the
+            caller already holds, released when the session ends. None waits
+            for the lock of the folder.
+    """
+
+    def __init__(
+        self,
+        faiss_folder="./db_manager/faiss_index",
+        index_name="index.faiss",
+        checkpoint_every=None,
+        embeddings=None,
+        batch_size=100,
+        max_concurrency=4,
+        pending_limit=2000,
+        cache_path=EMBEDDING_CACHE_PATH,
+        write_shards=None,
+        index_type=None,
+        embedding_provider=None,
+        write_lock=None,
+    ):
+        self.faiss_folder = faiss_folder
+        self.index_name = index_name
+        self.checkpoint_every = checkpoint_every
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.pending_limit = pending_limit
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.page_store = PageStore(os.path.join(faiss_folder, "pages.sqlite"))
+        self.faiss_store = None
+        self.metadata_index = create_metadata_index()
+        # Ids added in this session. Saved ids are looked up, see find_saved_ids.
+        self.existing_ids = set()
+        self.pending = {
+            "texts": [],
+            "metadatas": [],
+            "ids": []
+        }
+        self.adds_since_save = 0
+        self.has_unsaved_changes = False
+        self.write_shards = write_shards
+        self.index_type = index_type
+        self.embedding_provider = embedding_provider
+        self.provider_info = None
+        self.shard_stores = {}
+        self.changed_partitions = set()
+        self.snapshot_pin = None
+        # The snapshot the shards of the index are read from, None without shards.
+        self.shards_folder = None
+        self.write_lock = write_lock or IndexWriteLock(faiss_folder)
+        # Queued batch files added since the last save.
+        self.applied_batches = []
+
+    def __enter__(self):
+        if not self.write_lock.is_held and not self.write_lock.acquire(blocking=False):
+            print("Waiting for another writer of the FAISS index to finish...")
+            self.write_lock.acquire()
+        try:
+            if self.embeddings is None:
+                self.embedding_provider = get_embedding_provider_name(self.embedding_provider)
+                self.embeddings = create_embeddings(self.embedding_provider)
+            self.provider_info = get_embedding_provider_info(self.embedding_provider,
+                                                             self.embeddings)
+            migrate_legacy_index(self.faiss_folder)
+            self.snapshot_pin = pin_snapshot(self.faiss_folder)
+            try:
+                self.load(self.snapshot_pin.folder)
+            except BaseException:
+                self.snapshot_pin.release()
+                raise
+        except BaseException:
+            self.write_lock.release()
+            raise
+        return self
+
+    def load(self, snapshot_folder):
+        """
+        Load the index, its metadata and BM25 indexes and its shards from a snapshot.
+        """
+        index_file = os.path.join(snapshot_folder, self.index_name)
+
+        if os.path.exists(index_file):
+            try:
+                self.faiss_store = load_faiss_store(snapshot_folder, self.embeddings)
+            except (OSError, ValueError, sqlite3.Error) as load_error:
+                print(
+                    "Error loading existing FAISS index; creating new one. Error:",
+                    load_error,
+                )
+                self.faiss_store = None
+
+        if self.faiss_store is not None:
+            check_embedding_provider(self.provider_info, snapshot_folder,
+                                     self.faiss_store.index.d)
+            self.metadata_index = load_metadata_index(self.faiss_store, snapshot_folder)
+            if not isinstance(self.faiss_store.docstore, SQLiteDocstore):
+                # Older indexes use random docstore ids, so the Chunk_ids are checked too.
+                self.existing_ids = set(getattr(self.faiss_store.docstore, "_dict").keys())
+                self.existing_ids.update(self.metadata_index["Chunk_ids"])
+            if has_faiss_shards(snapshot_folder):
+                self.shards_folder = snapshot_folder
+
+        if self.write_shards is None:
+            self.write_shards = self.shards_folder is not None
+        if self.write_shards and self.faiss_store is not None and self.shards_folder is None:
+            # Build the missing shards of an existing index, saved with the next snapshot.
+            self.shard_stores = split_faiss_shards(self.faiss_store)
+            self.changed_partitions = set(self.shard_stores)
+            self.has_unsaved_changes = True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Save even when an error is raised, so the chunks that were added
+        # before the error are kept. Batches queued during a save are saved
+        # before the lock is released, so their writers are not left waiting.
+        try:
+            self.save()
+            while self.has_queued_batches():
+                self.save()
+        finally:
+            self.snapshot_pin.release()
+            self.write_lock.release()
+            self.page_store.close()
+            if self.cache is not None:
+                self.cache.close()
+        return False
+
+    def add_chunks(self, chunk_texts, chunk_metadatas):
+        """
+        Queue the chunks of one document to be embedded and added to the index.
+        Chunks whose chunk_id is already in the index are skipped. The index
+        is saved at a checkpoint, or if other writers have queued batches.
+        """
+        self.queue_chunks(chunk_texts, chunk_metadatas)
+        self.adds_since_save += 1
+        if (self.checkpoint_every and self.adds_since_save >= self.checkpoint_every) \
+                or self.has_queued_batches():
+            self.save()
+
+    def queue_chunks(self, chunk_texts, chunk_metadatas):
+        """
+        Queue chunks to be embedded, see add_chunks, without a checkpoint.
+        """
+        chunk_metadatas = calculate_updated_chunk_ids(chunk_metadatas)
+        # Code for testing what the new chunk_ids are. These are the key to explabaility
+        # for items in chunk_metadatas:
+        #     print(f"\nThese are the updated chunk ID's\n: {items.get("Chunk_id")}")
+
+        saved_ids = self.find_saved_ids([meta.get("Chunk_id") for meta in chunk_metadatas])
+        for text, meta in zip(chunk_texts, chunk_metadatas):
+            this_id = meta.get("Chunk_id")
+            if this_id and this_id not in self.existing_ids and this_id not in saved_ids:
+                self.pending["texts"].append(text)
+                self.pending["metadatas"].append(meta)
+                self.pending["ids"].append(this_id)
+                self.existing_ids.add(this_id)
+
+        if len(self.pending["texts"]) >= self.pending_limit:
+            self.flush()
+
+    def find_saved_ids(self, chunk_ids):
+        """
+        Return the chunk ids that are already in the docstore.sqlite the
+        session loaded, as docstore id or Chunk_id.
+        """
+        docstore = getattr(self.faiss_store, "docstore", None)
+        if isinstance(docstore, SQLiteDocstore):
+            return docstore.find_saved_ids(chunk_ids)
+        return set()
+
+    def has_queued_batches(self):
+        """
+        Return True if other writers have queued batches not yet added.
+        """
+        return any(batch_path not in self.applied_batches
+                   for batch_path in list_queued_batches(self.faiss_folder))
+
+    def add_queued_batches(self):
+        """
+        Queue the chunks of the batches other writers queued, oldest first.
+        """
+        for batch_path in list_queued_batches(self.faiss_folder):
+            if batch_path in self.applied_batches:
+                continue
+            try:
+                chunk_texts, chunk_metadatas = load_batch(batch_path)
+            except (OSError, ValueError, KeyError) as load_error:
+                print(f"Error loading queued batch {batch_path}; setting it aside. Error:",
+                      load_error)
+                set_batch_aside(batch_path)
+                continue
+            self.queue_chunks(chunk_texts, chunk_metadatas)
+            self.applied_batches.append(batch_path)
+
+    def flush(self):
+        """
+        Embed the queued chunks in batches and add the vectors to the index in memory.
+        """
+        if len(self.pending["texts"]) == 0:
+            return
+
+        vectors = embed_texts_in_batches(
+            self.pending["texts"],
+            self.embeddings,
+            batch_size=self.batch_size,
+            max_concurrency=self.max_concurrency,
+            cache=self.cache,
+        )
+        text_embeddings = list(zip(self.pending["texts"], vectors))
+
+        if self.faiss_store is None:
+            self.faiss_store = FAISS.from_embeddings(
+                text_embeddings=text_embeddings,
+                embedding=self.embeddings,
+                metadatas=self.pending["metadatas"],
+                ids=self.pending["ids"],
+            )
+        else:
+            self.faiss_store.add_embeddings(text_embeddings=text_embeddings,
+                                            metadatas=self.pending["metadatas"],
+                                            ids=self.pending["ids"])
+        for metadata in self.pending["metadatas"]:
+            add_bill_to_metadata_index(self.metadata_index, metadata)
+        if self.write_shards:
+            self.add_to_shards(text_embeddings, self.pending["metadatas"], self.pending["ids"])
+        self.pending = {
+            "texts": [],
+            "metadatas": [],
+            "ids": []
+        }
+        self.has_unsaved_changes = True
+
+    def save(self):
+        """
+        Flush the queued chunks, with the batches other writers queued, and
+        write the index to disk as a new snapshot if anything was added since
+        the last save.
+        """
+        self.add_queued_batches()
+        self.flush()
+        if self.faiss_store is not None and self.index_type is not None:
+            index = convert_faiss_index(self.faiss_store.index, self.index_type)
+            if index is not self.faiss_store.index:
+                self.faiss_store.index = index
+                self.has_unsaved_changes = True
+        if self.faiss_store is not None and self.has_unsaved_changes:
+            snapshot_folder = begin_snapshot(self.faiss_folder)
+            try:
+                save_faiss_store(self.faiss_store, snapshot_folder)
+                save_metadata_index(self.metadata_index, snapshot_folder)
+                save_embedding_provider_info(self.get_provider_record(), snapshot_folder)
+                if self.write_shards:
+                    self.save_shards(snapshot_folder)
+                snapshot_pin = publish_snapshot(self.faiss_folder, snapshot_folder)
+            except BaseException:
+                shutil.rmtree(snapshot_folder, ignore_errors=True)
+                raise
+            self.snapshot_pin.release()
+            self.snapshot_pin = snapshot_pin
+            if self.write_shards:
+                self.shards_folder = snapshot_pin.folder
+        remove_batches(self.applied_batches)
+        self.applied_batches = []
+        self.changed_partitions = set()
+        self.has_unsaved_changes = False
+        self.adds_since_save = 0
+
+    def get_provider_record(self):
+        """
+        Return the provider record saved with the index, with the dimension of
+        the vectors actually in it.
+        """
+        provider_record = dict(self.provider_info)
+        if isinstance(self.faiss_store.index.d, int):
+            provider_record["Dimension"] = self.faiss_store.index.d
+        return provider_record
+
+    def save_shards(self, snapshot_folder):
+        """
+        Write the shards into a new snapshot: the changed ones from memory, the
+        others linked from the snapshot the session read them from.
+        """
+        partitions = set(self.changed_partitions)
+        if self.shards_folder is not None:
+            for partition in load_shard_partitions(self.shards_folder):
+                partitions.add(partition)
+                shard_folder = get_shard_folder(self.shards_folder, partition)
+                if partition not in self.changed_partitions and os.path.isdir(shard_folder):
+                    copy_snapshot_folder(shard_folder, get_shard_folder(snapshot_folder, partition))
+        for partition in self.changed_partitions:
+            save_faiss_store(self.shard_stores[partition],
+                             get_shard_folder(snapshot_folder, partition),
+                             with_search_tables=False)
+        save_shard_partitions(snapshot_folder, partitions)
+
+    def add_to_shards(self, text_embeddings, metadatas, ids):
+        """
+        Add already embedded chunks to the shard of their partition in memory.
+        """
+        by_partition = {}
+        for text_embedding, metadata, doc_id in zip(text_embeddings, metadatas, ids):
+            rows = by_partition.setdefault(get_partition_key(metadata), ([], [], []))
+            rows[0].append(text_embedding)
+            rows[1].append(metadata)
+            rows[2].append(doc_id)
+
+        for partition, (part_embeddings, part_metadatas, part_ids) in by_partition.items():
+            shard = self.shard_stores.get(partition)
+            if shard is None and self.shards_folder is not None:
+                shard = load_faiss_shard(self.shards_folder, partition, self.embeddings)
+            if shard is None:
+                shard = FAISS.from_embeddings(
+                    text_embeddings=part_embeddings,
+                    embedding=self.embeddings,
+                    metadatas=part_metadatas,
+                    ids=part_ids,
+                )
+            else:
+                shard.add_embeddings(text_embeddings=part_embeddings,
+                                     metadatas=part_metadatas,
+                                     ids=part_ids)
+            self.shard_stores[partition] = shard
+            self.changed_partitions.add(partition)
+
+
 def add_chunk_to_faiss_index(
     chunk_texts,
     chunk_metadatas,
     faiss_folder="./db_manager/faiss_index",
     index_name="index.faiss",
+    index_type=None,
+    embedding_provider=None,
+    timeout=None,
 ):
     """
     Create or load an existing FAISS index and add new document chunks.
+    The chunks are queued and the call returns once they are saved. Chunks
+    submitted by other processes at the same time are saved together with
+    them, and while another writer holds the index it saves them, see
+    db_manager.ingest_queue.
+    To add many documents, use a FaissIngestSession so the index is only
+    loaded and saved once. index_type optionally rebuilds the index as one of
+    index_types.INDEX_TYPES, and embedding_provider names the provider of the
+    index, see FaissIngestSession. timeout optionally limits the seconds to
+    wait while another writer holds the index.
+
+    Returns:
+        str: ingest_queue.SAVED, or ingest_queue.QUEUED if the timeout passed
+            first and the writer holding the index will save the chunks.
     """
-    chunk_metadatas = calculate_updated_chunk_ids(chunk_metadatas)
-    # Code for testing what the new chunk_ids are. These are the key to explabaility
-    # for items in chunk_metadatas:
-    #     print(f"\nThese are the updated chunk ID's\n: {items.get("Chunk_id")}")
+    return submit_chunks(
+        faiss_folder,
+        chunk_texts,
+        chunk_metadatas,
+        lambda write_lock: FaissIngestSession(faiss_folder, index_name, index_type=index_type,
+                                              embedding_provider=embedding_provider,
+                                              write_lock=write_lock),
+        timeout=timeout,
+    )
+
+
+def load_faiss_index(faiss_folder="./db_manager/faiss_index", index_type=None,
+                     embedding_provider=None):
+    """
+    Loads the FAISS index if it exists, from the current snapshot of the folder.
+    The snapshot stays pinned, so it is not deleted while the store is in use,
+    and faiss_store.snapshot_folder holds its folder, where the files saved
+    next to the index are read from.
+    index_type optionally converts the loaded index, in memory only, to one of
+    index_types.INDEX_TYPES, trained on its vectors.
+    embedding_provider names the provider that embeds the queries, see
+    db_manager.embedding_providers; a ValueError is raised if the index was
+    built by another one.
+    Query embeddings of remote providers are cached, see
+    embedding_cache.CachedQueryEmbeddings; faiss_store.embeddings.stats()
+    returns the hit rate of the cache.
+    """
+    embedding_provider = get_embedding_provider_name(embedding_provider)
+    embeddings = create_embeddings(embedding_provider)
+    if not is_local_provider(embedding_provider):
+        embeddings = CachedQueryEmbeddings(
+            embeddings, cache=EmbeddingCache(EMBEDDING_CACHE_PATH)
+        )
+    snapshot_pin = pin_snapshot(faiss_folder)
+    try:
+        faiss_store = load_faiss_store(snapshot_pin.folder, embeddings)
+        check_embedding_provider(get_embedding_provider_info(embedding_provider),
+                                 snapshot_pin.folder, faiss_store.index.d)
+    except BaseException:
+        snapshot_pin.release()
+        raise
+    faiss_store.snapshot_folder = snapshot_pin.folder
+    # The pin is released when the store is garbage collected.
+    weakref.finalize(faiss_store, snapshot_pin.release)
+    if index_type is not None:
+        faiss_store.index = convert_faiss_index(faiss_store.index, index_type)
+    return faiss_store
 
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-    index_file = os.path.join(faiss_folder, index_name)
-    index_exists = os.path.exists(index_file)
 
-    if index_exists:
+def get_faiss_index_version(faiss_folder="./db_manager/faiss_index"):
+    """
+    Returns a value that changes whenever the FAISS index on disk is saved again,
+    built from the size and modification time of index.faiss and of its
+    docstore, docstore.sqlite or index.pkl, in the current snapshot. Used to
+    decide when a shared, already loaded index has to be reloaded.
+    """
+    snapshot_folder = resolve_snapshot_folder(faiss_folder)
+    docstore_file = DOCSTORE_FILE
+    if not os.path.isfile(os.path.join(snapshot_folder, DOCSTORE_FILE)):
+        docstore_file = "index.pkl"
+    version = []
+    for file_name in ("index.faiss", docstore_file):
         try:
-            faiss_store = FAISS.load_local(
-                folder_path=faiss_folder,
-                embeddings=embeddings,
-                allow_dangerous_deserialization=True,
-            )
-        except (OSError, ValueError) as load_error:
-            print(
-                "Error loading existing FAISS index; creating new one. Error:",
-                load_error,
-            )
-            faiss_store = None
-    else:
-        faiss_store = None
+            file_stat = os.stat(os.path.join(snapshot_folder, file_name))
+            version.append((file_stat.st_size, file_stat.st_mtime_ns))
+        except OSError:
+            version.append(None)
+    return tuple(version)
 
-    if faiss_store is None:
-        if chunk_texts:
-            faiss_store = FAISS.from_texts(
-                texts=chunk_texts, embedding=embeddings, metadatas=chunk_metadatas
-            )
-            faiss_store.save_local(faiss_folder)
-        return
-
-    # Add only new chunks to the existing index.
-    existing_ids = set(getattr(faiss_store.docstore, "_dict").keys())
-    # print(f"Existing ID's are {existing_ids}")
-
-    new_doc_dict = {
-        "new_texts":[],
-        "new_metadatas":[],
-        "new_ids":[]
-    }
-
-    for text, meta in zip(chunk_texts, chunk_metadatas):
-        this_id = meta.get("Chunk_id")
-        if this_id and this_id not in existing_ids:
-            new_doc_dict["new_texts"].append(text)
-            new_doc_dict["new_metadatas"].append(meta)
-            new_doc_dict["new_ids"].append(this_id)
-
-    if len(new_doc_dict["new_texts"]) != 0:
-        faiss_store.add_texts(texts=new_doc_dict["new_texts"],
-                              metadatas=new_doc_dict["new_metadatas"],
-                              ids=new_doc_dict["new_ids"])
-        faiss_store.save_local(faiss_folder)
-
-
-def load_faiss_index(faiss_folder="./db_manager/faiss_index"):
+
+def get_snapshot_folder(faiss_store, faiss_folder="./db_manager/faiss_index"):
     """
-    Loads the FAISS index if it exists.
+    Returns the snapshot folder a store was loaded from by load_faiss_index, or
+    the current snapshot of faiss_folder for a store loaded in another way.
     """
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-    faiss_store = FAISS.load_local(
-        folder_path=faiss_folder,
-        embeddings=embeddings,
-        allow_dangerous_deserialization=True,
-    )
-    return faiss_store
+    snapshot_folder = getattr(faiss_store, "snapshot_folder", None)
+    if isinstance(snapshot_folder, str):
+        return snapshot_folder
+    return resolve_snapshot_folder(faiss_folder)
 
-def obtain_text_of_chunk(chunk_id):
+
+def get_text_of_doc(doc):
+    """
+    Return the text of a docstore entry.
     """
-    This function takes a chunk id, and then searches the whole FAISS dataset for that chunkid
-    When that chunkid is found, the associated text of that chunk is returned.
+    if isinstance(doc, tuple):
+        return doc[0]
+    return doc.page_content if hasattr(doc, "page_content") else ""
+
+
+def obtain_texts_of_chunks(chunk_ids, faiss_store=None, metadata_index=None):
     """
-    faiss_store = load_faiss_index()
-    all_docs = list(getattr(faiss_store.docstore, "_dict").values())
-    text_to_send_to_llm = None
+    This function takes many chunk ids and returns the text of each of them.
+    Each chunk id is resolved with the Chunk_id map of the metadata index, so a
+    lookup does not scan the docstore.
 
-    for _, content in enumerate(all_docs):
-        # print("\nProcessing document index:", idx)
+    Args:
+        chunk_ids (list[str]): The chunk ids to look up.
+        faiss_store (FAISS): Optional already loaded FAISS store. If it is not
+            given, the index is loaded from disk.
+        metadata_index (dict): Optional metadata index of the store. If it is not
+            given, it is loaded from next to the index, or built from the store.
 
-        metadata = content.metadata if hasattr(content, "metadata") else {}
+    Returns:
+        dict: chunk_id -> text of the chunk, None for chunk ids not in the index.
+    """
+    if faiss_store is None:
+        faiss_store = load_faiss_index()
+    if metadata_index is None:
+        metadata_index = load_metadata_index(faiss_store, get_snapshot_folder(faiss_store))
+    doc_ids = {chunk_id: get_doc_id_for_chunk(metadata_index, chunk_id) for chunk_id in chunk_ids}
+    docs = get_documents(faiss_store.docstore,
+                         [doc_id for doc_id in doc_ids.values() if doc_id is not None])
 
-        current_chunk_id = metadata.get("Chunk_id")
+    texts_of_chunks = {}
+    for chunk_id, doc_id in doc_ids.items():
+        doc = docs.get(doc_id)
+        texts_of_chunks[chunk_id] = None if doc is None else get_text_of_doc(doc)
+    return texts_of_chunks
 
-        # Only extract page content if the chunk IDs match.
-        if current_chunk_id == chunk_id:
-            # print("DEBUG: Found matching chunk_id:", chunk_id)
-            if isinstance(content, tuple):
-                page_text = content[0]
-            else:
-                page_text = (
-                    content.page_content if hasattr(content, "page_content") else ""
-                )
-            # print("DEBUG: Extracted page text for chunk_id", chunk_id, ":\n", page_text)
-            text_to_send_to_llm = page_text
-            break
 
-    return text_to_send_to_llm
+def obtain_text_of_chunk(chunk_id, faiss_store=None, metadata_index=None):
+    """
+    This function takes a chunk id and returns the text of that chunk, or None
+    if no chunk has that id. Pass an already loaded store and its metadata index
+    to look the chunk up in constant time, see obtain_texts_of_chunks.
+    """
+    return obtain_texts_of_chunks([chunk_id], faiss_store, metadata_index)[chunk_id]
 
 
 def map_chunk_to_metadata(filtered_results):
@@ -183,26 +678,59 @@ def map_chunk_to_metadata(filtered_results):
     return docs_for_chain, unique_path_page_tuples
 
 
-def add_bills_to_faiss_index(pdf_paths):
+def add_bills_to_faiss_index(pdf_paths, workers=1, manifest=None, session=None):
     """
     Add all of the bills in the `pdf_paths` into faiss DB.
     Args:
         pdf_paths: List[pdf_path:str]
+        workers: int, number of processes used to extract the PDF texts.
+            With more than one worker the PDFs are parsed in parallel, and
+            their chunks are still added in the order of `pdf_paths`, so the
+            index is the same as after a serial run.
+        manifest: Dict, optional ingest manifest, see db_manager.ingest_manifest.
+            PDFs that are unchanged since they were recorded in it are not
+            parsed, sent to the LLM or embedded again; their stored bill info
+            is returned instead. Newly added PDFs are recorded in it.
+        session: FaissIngestSession, optional open session to add the chunks to.
+            Without one, the index is loaded and saved once per PDF. With one,
+            the text of every page is also written to the session's page store.
 
     Return:
         bill_info_list: List[Dict[str, str]], The summary of the bills 
-    that were added to the FAISS DB.
+    that were added to the FAISS DB, in the same order as `pdf_paths`.
 
     """
 
-    bill_info_list = []
-    # Write document into faiss index
+    bill_info_by_path = {}
+    pdf_paths_to_add = []
     for pdf_path in pdf_paths:
-        print(f"\nProcessing: {pdf_path}\n")
+        stored_bill_info = None
+        if manifest is not None:
+            stored_bill_info = get_unchanged_bill_info(manifest, pdf_path)
+        if stored_bill_info is not None:
+            print(f"Skipped unchanged: {pdf_path}")
+            bill_info_by_path[pdf_path] = stored_bill_info
+            # Indexes built before the page store existed still need their pages.
+            if session is not None and not session.page_store.has_pages(stored_bill_info["Path"]):
+                session.page_store.put_pages(stored_bill_info["Path"],
+                                             extract_text_from_pdf(pdf_path))
+        else:
+            pdf_paths_to_add.append(pdf_path)
+
+    if workers > 1:
+        extracted_pdfs = yield_in_input_order(
+            extract_texts_in_parallel(pdf_paths_to_add, workers), pdf_paths_to_add
+        )
+    else:
+        extracted_pdfs = (
+            (pdf_path, extract_text_from_pdf(pdf_path)) for pdf_path in pdf_paths_to_add
+        )
 
-        # Step 1: Extract text from the PDF. Returns a list
-        pages_of_pdf = extract_text_from_pdf(pdf_path)
+    # Write document into faiss index
+    for pdf_path, pages_of_pdf in extracted_pdfs:
+        print(f"\nProcessing: {pdf_path}\n")
 
+        # Step 1: Text of the PDF was extracted above. It is a list of pages
         if not pages_of_pdf:
             print("No text extracted from the PDF.")
             continue
@@ -215,7 +743,9 @@ def add_bills_to_faiss_index(pdf_paths):
         # Add PDF path to bill info for CSV
         bill_info["Path"] = "./" + "/".join(pdf_path.split("/")[-3:])
         bill_info["Filename"] = pdf_path.split("/")[-1]
-        bill_info_list.append(bill_info)
+        bill_info_by_path[pdf_path] = bill_info
+        if session is not None:
+            session.page_store.put_pages(bill_info["Path"], pages_of_pdf)
         # Step 3: Split the document into chunks and get the source and page number for each chunk
         chunk_texts, chunk_metadatas = chunk_pdf_pages(pages_of_pdf, pdf_path)
 
@@ -225,8 +755,20 @@ def add_bills_to_faiss_index(pdf_paths):
             metadata_of_chunk.update(bill_info)
 
         # Step 5: Add the document and metadata to the FAISS index.
-        add_chunk_to_faiss_index(chunk_texts, chunk_metadatas)
+        if session is not None:
+            session.add_chunks(chunk_texts, chunk_metadatas)
+        else:
+            add_chunk_to_faiss_index(chunk_texts, chunk_metadatas)
+
+        if manifest is not None:
+            record_bill_in_manifest(manifest, pdf_path, bill_info)
 
+    # Keep the input order so the csv matches the serial run.
+    bill_info_list = [
+        bill_info_by_path[pdf_path]
+        for pdf_path in pdf_paths
+        if pdf_path in bill_info_by_path
+    ]
     return bill_info_list
 
 
@@ -294,13 +836,6 @@ def write_bill_info_to_csv(bill_info_list, file_name="bill_info.csv"):
         print(e)
         print(f"Failed to write {path} into csv.")
 
-def sanitize_filename(filename):
-    """
-    Remove characters that are illegal in Windows file names.
-    """
-    # Remove: \ / * ? : " < > |
-    return re.sub(r'[\\/*?:"<>|]', "", filename)
-
 def create_folder_for_added_files(chunk_metadatas, uploaded_file):
     """
     Creates a folder to save the uploaded file, if there isn’t one already.
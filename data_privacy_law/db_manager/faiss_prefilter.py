@@ -0,0 +1,278 @@
+"""
+Filtered similarity search over the FAISS index that selects the matching
+chunks before the vector search instead of after it, see FaissPrefilter.
+Facets are looked up in the metadata index, see db_manager.metadata_index,
+and other metadata and the bill date in the indexed columns of a SQLite
+docstore, see db_manager.sqlite_docstore, where the store has one.
+"""
+
+import faiss
+import numpy as np
+
+from db_manager.index_types import get_search_parameters
+from db_manager.metadata_index import (
+    FACETS,
+    build_metadata_index,
+    get_doc_ids_for_facet,
+    get_sqlite_metadata_index,
+)
+from db_manager.sqlite_docstore import (
+    METADATA_COLUMNS,
+    IndexToDocstoreIdMap,
+    SQLiteDocstore,
+    get_documents,
+    parse_bill_date,
+)
+
+
+def get_id_selector(positions, ntotal):
+    """
+    Returns a FAISS IDSelector that only accepts the given positions of an index
+    with `ntotal` vectors: a range if the positions are contiguous, otherwise a
+    bitmap. The bitmap is returned as well, because the selector does not keep
+    it alive.
+
+    Returns:
+        tuple: (faiss.IDSelector, np.ndarray or None)
+    """
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return faiss.IDSelectorRange(int(positions[0]), int(positions[-1]) + 1), None
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[positions] = True
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap)), bitmap
+
+
+def intersect_positions(selected, positions):
+    """
+    Intersects a set of selected positions with more positions. None means that
+    nothing was selected yet, so every position is still allowed.
+    """
+    positions = np.unique(np.asarray(list(positions), dtype=np.int64))
+    if selected is None:
+        return positions
+    return np.intersect1d(selected, positions, assume_unique=True)
+
+
+class FaissPrefilter:
+    """
+    Filtered similarity search that selects the matching chunks before the vector
+    search instead of after it. The metadata filter is turned into the list of
+    index positions that satisfy it, using the metadata index for the facets, and
+    only those vectors are searched. So the search always returns k hits when at
+    least k chunks match, and its cost grows with the number of matching chunks
+    instead of the size of the index.
+
+    Args:
+        faiss_store (FAISS): The loaded FAISS index.
+        metadata_index (dict): Optional metadata index of the store. If it is
+            not given, its facets are read from the docstore.sqlite of the
+            store, or built from the docstore.
+    """
+
+    def __init__(self, faiss_store, metadata_index=None):
+        self.faiss_store = faiss_store
+        self.metadata_index = (metadata_index or get_sqlite_metadata_index(faiss_store)
+                               or build_metadata_index(faiss_store))
+        # docstore id -> position, built on first use unless the ids are in SQLite.
+        self.positions_by_doc_id = None
+        self.date_ordinals = None
+
+    def get_positions(self, doc_ids):
+        """
+        Returns docstore id -> index position for the ids that are in the index.
+        """
+        index_to_docstore_id = self.faiss_store.index_to_docstore_id
+        if isinstance(index_to_docstore_id, IndexToDocstoreIdMap):
+            return index_to_docstore_id.get_positions(doc_ids)
+        if self.positions_by_doc_id is None:
+            self.positions_by_doc_id = {
+                doc_id: position for position, doc_id in index_to_docstore_id.items()
+            }
+        return {
+            doc_id: self.positions_by_doc_id[doc_id]
+            for doc_id in doc_ids
+            if doc_id in self.positions_by_doc_id
+        }
+
+    def get_date_ordinals(self):
+        """
+        Returns the date of the bill of every position as a day ordinal, -1 if
+        it has no readable date. Computed on the first date filter, from the
+        indexed date column of a SQLite docstore where it has one.
+        """
+        if self.date_ordinals is None:
+            docstore = self.faiss_store.docstore
+            date_ordinals = np.full(self.faiss_store.index.ntotal, -1, dtype=np.int64)
+            saved_dates = None
+            if isinstance(docstore, SQLiteDocstore):
+                saved_dates = docstore.load_date_ordinals()
+            if saved_dates is None:
+                docs = getattr(docstore, "_dict").items()
+            else:
+                if saved_dates:
+                    saved_dates = np.asarray(saved_dates, dtype=np.int64)
+                    date_ordinals[saved_dates[:, 0]] = saved_dates[:, 1]
+                # Only the chunks added since the load are read.
+                docs = docstore.added.items()
+            ordinals_by_doc_id = {}
+            for doc_id, doc in docs:
+                bill_date = parse_bill_date(doc.metadata.get("Date"))
+                if bill_date is not None:
+                    ordinals_by_doc_id[doc_id] = bill_date.toordinal()
+            for doc_id, position in self.get_positions(ordinals_by_doc_id).items():
+                date_ordinals[position] = ordinals_by_doc_id[doc_id]
+            self.date_ordinals = date_ordinals
+        return self.date_ordinals
+
+    def has_column(self, key, values):
+        """
+        Returns True if the chunks with these metadata values can be looked up
+        in an indexed column of a SQLite docstore, see db_manager.sqlite_docstore.
+        """
+        return (
+            isinstance(self.faiss_store.docstore, SQLiteDocstore)
+            and key in METADATA_COLUMNS
+            and all(isinstance(value, str) for value in values)
+        )
+
+    def select(self, metadata_filter=None, date_from=None, date_to=None, predicate=None):
+        """
+        Returns the sorted index positions of the chunks that match every condition.
+
+        Args:
+            metadata_filter (dict): Metadata key -> value, or a list of values of
+                which any may match, e.g. {"State": "Texas", "Sector": ["Health"]}.
+                State, Type, Sector and Topics are looked up in the metadata index.
+            date_from (date): Optional, the earliest bill date to keep.
+            date_to (date): Optional, the latest bill date to keep.
+            predicate (callable): Optional, takes the metadata of a chunk and
+                returns True to keep it. Only run on the chunks still selected.
+
+        Returns:
+            np.ndarray: The positions, as int64.
+        """
+        all_docs = getattr(self.faiss_store.docstore, "_dict")
+        index_to_docstore_id = self.faiss_store.index_to_docstore_id
+        selected = None
+
+        for key, value in (metadata_filter or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if key in FACETS:
+                doc_ids = {
+                    doc_id
+                    for single_value in values
+                    for doc_id in get_doc_ids_for_facet(self.metadata_index, key, single_value)
+                }
+                positions = self.get_positions(doc_ids).values()
+            elif self.has_column(key, values):
+                positions = self.get_positions(
+                    self.faiss_store.docstore.find_doc_ids(key, values)
+                ).values()
+            else:
+                positions = self.get_positions(
+                    doc_id for doc_id, doc in all_docs.items() if doc.metadata.get(key) in values
+                ).values()
+            selected = intersect_positions(selected, positions)
+
+        if date_from is not None or date_to is not None:
+            date_ordinals = self.get_date_ordinals()
+            in_range = date_ordinals >= 0
+            if date_from is not None:
+                in_range &= date_ordinals >= date_from.toordinal()
+            if date_to is not None:
+                in_range &= date_ordinals <= date_to.toordinal()
+            selected = intersect_positions(selected, np.flatnonzero(in_range))
+
+        if predicate is not None:
+            candidates = selected if selected is not None else index_to_docstore_id
+            selected = intersect_positions(None, (
+                position
+                for position in candidates
+                if predicate(all_docs[index_to_docstore_id[int(position)]].metadata)
+            ))
+
+        if selected is None:
+            return np.arange(self.faiss_store.index.ntotal, dtype=np.int64)
+        return selected
+
+    def search_positions(self, embedding, positions, k):
+        """
+        Searches only the vectors at the given positions.
+
+        Returns:
+            tuple: (distances, positions) of the best k vectors, best first.
+        """
+        k = min(k, len(positions))
+        if k == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        vector = np.array([embedding], dtype=np.float32)
+        # pylint: disable=protected-access
+        if self.faiss_store._normalize_L2:
+            faiss.normalize_L2(vector)
+        index = self.faiss_store.index
+        higher_is_better = index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+        if isinstance(index, faiss.IndexFlat):
+            # Only the distances to the selected vectors are computed.
+            labels = np.ascontiguousarray(positions, dtype=np.int64).reshape(1, -1)
+            distances = np.empty(labels.shape, dtype=np.float32)
+            index.compute_distance_subset(
+                1, faiss.swig_ptr(vector), labels.shape[1],
+                faiss.swig_ptr(distances), faiss.swig_ptr(labels),
+            )
+            sort_keys = -distances[0] if higher_is_better else distances[0]
+            best = np.argpartition(sort_keys, k - 1)[:k]
+            best = best[np.argsort(sort_keys[best], kind="stable")]
+            return distances[0][best], labels[0][best]
+
+        selector, _bitmap = get_id_selector(positions, index.ntotal)
+        distances, labels = index.search(
+            vector, k, params=get_search_parameters(index, selector)
+        )
+        found = labels[0] >= 0
+        return distances[0][found], labels[0][found]
+
+    def similarity_search_with_score(
+        self, query, k=4, metadata_filter=None, date_from=None, date_to=None, predicate=None
+    ):
+        """
+        Returns the k chunks most similar to the query among the chunks that match
+        the filters, see select. Scores are the raw FAISS distances, as in
+        FAISS.similarity_search_with_score.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and scores, best first.
+        """
+        positions = self.select(metadata_filter, date_from, date_to, predicate)
+        if len(positions) == 0:
+            return []
+        embedding = self.faiss_store.embeddings.embed_query(query)
+        distances, found_positions = self.search_positions(embedding, positions, k)
+        doc_ids = [self.faiss_store.index_to_docstore_id[int(position)]
+                   for position in found_positions]
+        docs = get_documents(self.faiss_store.docstore, doc_ids)
+        return [
+            (docs[doc_id], float(distance))
+            for doc_id, distance in zip(doc_ids, distances)
+        ]
+
+    def similarity_search_with_relevance_scores(  # pylint: disable=redefined-builtin
+        self, query, k=4, filter=None, score_threshold=None, **kwargs
+    ):
+        """
+        Same as FAISS.similarity_search_with_relevance_scores, with the filter
+        applied before the search. Any keyword arguments of select can be added.
+        """
+        kwargs.pop("fetch_k", None)
+        # pylint: disable=protected-access
+        relevance_score_fn = self.faiss_store._select_relevance_score_fn()
+        results = [
+            (doc, relevance_score_fn(score))
+            for doc, score in self.similarity_search_with_score(
+                query, k=k, metadata_filter=filter, **kwargs
+            )
+        ]
+        if score_threshold is not None:
+            results = [result for result in results if result[1] >= score_threshold]
+        return results
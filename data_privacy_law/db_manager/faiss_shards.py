@@ -0,0 +1,357 @@
+"""
+One FAISS index per partition of the corpus: each state, plus Comprehensive,
+Federal and GDPR, see get_partition_key. The shards are saved in the shards
+folder of a snapshot, see db_manager.index_snapshots, with the list of
+partitions in shards/partitions.json, and are written by ingest sessions or
+build_faiss_shards. FaissShardRouter sends each search to the shards it
+concerns.
+"""
+
+import os
+import json
+import threading
+
+from langchain_community.vectorstores import FAISS
+
+from db_manager.bm25_index import (
+    has_identifier,
+    is_identifier_query,
+    reciprocal_rank_fusion,
+    search_bm25_index,
+)
+from db_manager.faiss_prefilter import FaissPrefilter
+from db_manager.index_snapshots import resolve_snapshot_folder
+from db_manager.index_types import get_index_vectors
+from db_manager.pdf_parser import sanitize_filename
+from db_manager.sqlite_docstore import get_documents, load_faiss_store, save_faiss_store
+
+SHARD_FOLDER_NAME = "shards"
+SHARD_PARTITIONS_FILE = "partitions.json"
+
+
+def get_partition_key(metadata):
+    """
+    Returns the partition a chunk belongs to: its state for state level bills,
+    otherwise "Federal", "GDPR" or "Comprehensive" from the type of the bill.
+    State level comprehensive bills are kept with their state, so a question
+    about one state only needs that state's shard.
+    """
+    state = metadata.get("State")
+    if state:
+        return str(state)
+    bill_type = str(metadata.get("Type") or "")
+    if "GDPR" in bill_type:
+        return "GDPR"
+    if "Federal" in bill_type:
+        return "Federal"
+    return "Comprehensive"
+
+
+def get_shard_root(faiss_folder="./db_manager/faiss_index"):
+    """
+    Returns the folder that holds the FAISS index of every partition.
+    """
+    return os.path.join(faiss_folder, SHARD_FOLDER_NAME)
+
+
+def get_shard_folder(faiss_folder, partition):
+    """
+    Returns the folder of the FAISS index of one partition.
+    """
+    return os.path.join(
+        get_shard_root(faiss_folder), sanitize_filename(partition).replace(" ", "_")
+    )
+
+
+def load_shard_partitions(faiss_folder="./db_manager/faiss_index"):
+    """
+    Returns the list of partitions that have a shard, empty if there are none.
+    """
+    partitions_path = os.path.join(get_shard_root(faiss_folder), SHARD_PARTITIONS_FILE)
+    if not os.path.exists(partitions_path):
+        return []
+    with open(partitions_path, "r", encoding="utf-8") as partitions_file:
+        return json.load(partitions_file)
+
+
+def save_shard_partitions(faiss_folder, partitions):
+    """
+    Adds partitions to the list of partitions that have a shard.
+    """
+    all_partitions = sorted(set(load_shard_partitions(faiss_folder)) | set(partitions))
+    os.makedirs(get_shard_root(faiss_folder), exist_ok=True)
+    partitions_path = os.path.join(get_shard_root(faiss_folder), SHARD_PARTITIONS_FILE)
+    temp_path = partitions_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as partitions_file:
+        json.dump(all_partitions, partitions_file)
+    os.replace(temp_path, partitions_path)
+
+
+def has_faiss_shards(faiss_folder="./db_manager/faiss_index"):
+    """
+    Returns True if the FAISS index has been split into shards.
+    """
+    return os.path.isfile(os.path.join(get_shard_root(faiss_folder), SHARD_PARTITIONS_FILE))
+
+
+def load_faiss_shard(faiss_folder, partition, embeddings):
+    """
+    Loads the FAISS index of one partition, or returns None if it has no shard.
+    """
+    shard_folder = get_shard_folder(faiss_folder, partition)
+    if not os.path.exists(os.path.join(shard_folder, "index.faiss")):
+        return None
+    return load_faiss_store(shard_folder, embeddings)
+
+
+def split_faiss_shards(faiss_store):
+    """
+    Splits a loaded FAISS index into one FAISS index per partition, in memory.
+    The vectors are copied from the index, so nothing is embedded again.
+
+    Returns:
+        dict: partition -> FAISS index of the partition
+    """
+    all_docs = getattr(faiss_store.docstore, "_dict")
+    vectors = get_index_vectors(faiss_store.index)
+    by_partition = {}
+    for position, doc_id in faiss_store.index_to_docstore_id.items():
+        doc = all_docs[doc_id]
+        by_partition.setdefault(get_partition_key(doc.metadata), []).append(
+            (position, doc_id, doc)
+        )
+
+    shards = {}
+    for partition, rows in by_partition.items():
+        shards[partition] = FAISS.from_embeddings(
+            text_embeddings=[
+                (doc.page_content, vectors[position].tolist())
+                for position, _, doc in rows
+            ],
+            embedding=faiss_store.embeddings,
+            metadatas=[doc.metadata for _, _, doc in rows],
+            ids=[doc_id for _, doc_id, _ in rows],
+            distance_strategy=faiss_store.distance_strategy,
+        )
+    return shards
+
+
+def build_faiss_shards(faiss_store, faiss_folder="./db_manager/faiss_index"):
+    """
+    Splits a loaded FAISS index into one FAISS index per partition and saves them
+    in the shards folder of faiss_folder, see split_faiss_shards. Ingest
+    sessions build missing shards into their next snapshot themselves.
+
+    Returns:
+        list[str]: The partitions that were written.
+    """
+    shards = split_faiss_shards(faiss_store)
+    for partition, shard in shards.items():
+        save_faiss_store(shard, get_shard_folder(faiss_folder, partition),
+                         with_search_tables=False)
+    save_shard_partitions(faiss_folder, shards)
+    return list(shards)
+
+
+class FaissShardRouter:
+    """
+    Routes similarity searches to the FAISS index of the partitions they concern.
+    A search filtered on one state only searches that state's shard. Any other
+    search is scattered over every shard and the results are merged by score.
+    Shards are loaded the first time they are searched. Without shards on disk
+    every search goes to the whole index, pre-filtered when it has a filter.
+
+    With a BM25 index the vector hits are combined with the BM25 hits by
+    reciprocal rank fusion when some vector hit passes the score threshold or
+    the query names an identifier, and queries that only name identifiers such
+    as "HB 1426" are answered from the BM25 index without embedding the query,
+    see db_manager.bm25_index. A query that matches neither way returns no hits.
+
+    The router can be used in place of the FAISS store it wraps for
+    similarity_search_with_relevance_scores and docstore lookups.
+
+    Args:
+        faiss_store (FAISS): The loaded FAISS index the shards were built from.
+        faiss_folder (str): The folder of the FAISS index, or of the snapshot
+            it was loaded from, see faiss_db_manager.get_snapshot_folder. The
+            shards are read from the current snapshot of the folder.
+        metadata_index (dict): Optional metadata index of the whole index, used
+            to pre-filter searches when there are no shards, see
+            db_manager.faiss_prefilter.
+        bm25_index (dict): Optional BM25 index of the whole index.
+    """
+
+    def __init__(self, faiss_store, faiss_folder="./db_manager/faiss_index",
+                 metadata_index=None, bm25_index=None):
+        self.faiss_store = faiss_store
+        self.faiss_folder = resolve_snapshot_folder(faiss_folder)
+        self.metadata_index = metadata_index
+        self.bm25_index = bm25_index
+        self.partitions = load_shard_partitions(self.faiss_folder)
+        self.shards = {}
+        self.prefilter = None
+        self.lock = threading.Lock()
+
+    @property
+    def docstore(self):
+        """
+        The docstore of the whole index.
+        """
+        return self.faiss_store.docstore
+
+    @property
+    def embeddings(self):
+        """
+        The embeddings used to embed queries.
+        """
+        return self.faiss_store.embeddings
+
+    def get_shard(self, partition):
+        """
+        Returns the FAISS index of a partition, or None if it has no shard.
+        Raises FileNotFoundError if the partition is listed but its shard
+        folder is missing.
+        """
+        if partition not in self.partitions:
+            return None
+        with self.lock:
+            if partition not in self.shards:
+                shard = load_faiss_shard(
+                    self.faiss_folder, partition, self.faiss_store.embeddings
+                )
+                if shard is None:
+                    raise FileNotFoundError(
+                        f"The shard of {partition} is missing from {self.faiss_folder}"
+                    )
+                self.shards[partition] = shard
+            return self.shards[partition]
+
+    def get_prefilter(self):
+        """
+        Returns the FaissPrefilter of the whole index, created on the first use.
+        """
+        with self.lock:
+            if self.prefilter is None:
+                self.prefilter = FaissPrefilter(self.faiss_store, self.metadata_index)
+            return self.prefilter
+
+    def route(self, search_filter=None):
+        """
+        Returns the partitions a search with this metadata filter has to look at.
+        """
+        if isinstance(search_filter, dict) and isinstance(search_filter.get("State"), str):
+            return [get_partition_key({"State": search_filter["State"]})]
+        return list(self.partitions)
+
+    def similarity_search_with_relevance_scores(  # pylint: disable=redefined-builtin
+        self, query, k=4, filter=None, score_threshold=None, fetch_k=20
+    ):
+        """
+        Same as FAISS.similarity_search_with_relevance_scores, searched over the
+        shards the filter routes to. The query is embedded once for all shards.
+        With a BM25 index the hits are fused with the BM25 hits, see the class.
+        score_threshold applies to the vector hits. BM25 hits are only fused in
+        when a vector hit passes it or the query names an identifier.
+
+        Returns:
+            List[Tuple[Document, float]]: The best k documents, best first, with
+                their relevance scores. Fused results carry their reciprocal
+                rank fusion score, and identifier lookups their BM25 score
+                divided by the best BM25 score.
+        """
+        if self.bm25_index is None:
+            return self.vector_search(query, k, filter, score_threshold, fetch_k)
+
+        lexical_results = self.lexical_search(query, k, filter)
+        if lexical_results and is_identifier_query(query):
+            best_score = lexical_results[0][1]
+            return [(doc, score / best_score) for doc, score in lexical_results]
+        vector_results = self.vector_search(query, k, filter, score_threshold, fetch_k)
+        if not lexical_results or not (vector_results or has_identifier(query)):
+            return vector_results
+
+        docs_by_key = {}
+        ranked_lists = []
+        for results in (vector_results, lexical_results):
+            ranked_keys = []
+            for doc, _ in results:
+                doc_key = doc.metadata.get("Chunk_id") or doc.page_content
+                docs_by_key.setdefault(doc_key, doc)
+                ranked_keys.append(doc_key)
+            ranked_lists.append(ranked_keys)
+        return [
+            (docs_by_key[doc_key], fused_score)
+            for doc_key, fused_score in reciprocal_rank_fusion(ranked_lists)[:k]
+        ]
+
+    def lexical_search(self, query, k=4, search_filter=None):
+        """
+        Returns the best k BM25 hits among the chunks that match the filter.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and BM25 scores, best first.
+        """
+        allowed_doc_ids = None
+        if search_filter is not None:
+            prefilter = self.get_prefilter()
+            if callable(search_filter):
+                positions = prefilter.select(predicate=search_filter)
+            else:
+                positions = prefilter.select(search_filter)
+            index_to_docstore_id = self.faiss_store.index_to_docstore_id
+            allowed_doc_ids = {index_to_docstore_id[int(position)] for position in positions}
+        hits = search_bm25_index(self.bm25_index, query, k, allowed_doc_ids)
+        docs = get_documents(self.faiss_store.docstore, [doc_id for doc_id, _ in hits])
+        return [(docs[doc_id], score) for doc_id, score in hits if doc_id in docs]
+
+    def search_whole_index(self, query, k=4, search_filter=None, score_threshold=None,
+                           fetch_k=20):
+        """
+        Returns the best k vector hits of the whole index, pre-filtered when
+        the filter is a dict.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and relevance scores, best first.
+        """
+        if isinstance(search_filter, dict):
+            return self.get_prefilter().similarity_search_with_relevance_scores(
+                query, k=k, filter=search_filter, score_threshold=score_threshold
+            )
+        return self.faiss_store.similarity_search_with_relevance_scores(
+            query, k=k, filter=search_filter, score_threshold=score_threshold, fetch_k=fetch_k
+        )
+
+    def vector_search(self, query, k=4, search_filter=None, score_threshold=None, fetch_k=20):
+        """
+        Returns the best k vector hits, from the shards the filter routes to.
+        If a shard is missing on disk, the whole index is searched instead.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and relevance scores, best first.
+        """
+        if not self.partitions:
+            return self.search_whole_index(query, k, search_filter, score_threshold, fetch_k)
+        try:
+            shards = [self.get_shard(partition) for partition in self.route(search_filter)]
+        except FileNotFoundError as shard_error:
+            print("Error loading FAISS shard; searching the whole index. Error:", shard_error)
+            return self.search_whole_index(query, k, search_filter, score_threshold, fetch_k)
+        shards = [shard for shard in shards if shard is not None]
+        if not shards:
+            return []
+
+        embedding = self.faiss_store.embeddings.embed_query(query)
+        results = []
+        for shard in shards:
+            # pylint: disable=protected-access
+            relevance_score_fn = shard._select_relevance_score_fn()
+            results.extend(
+                (doc, relevance_score_fn(score))
+                for doc, score in shard.similarity_search_with_score_by_vector(
+                    embedding, k=k, filter=search_filter, fetch_k=fetch_k
+                )
+            )
+        if score_threshold is not None:
+            results = [result for result in results if result[1] >= score_threshold]
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:k]
@@ -0,0 +1,341 @@
+"""
+Functions for saving the FAISS index as numbered snapshots.
+Every save writes the index, its metadata, BM25 and provider files and its
+shards into a new generation folder, generations/<generation>, and only then
+points the CURRENT file at it, which is replaced in one rename. A reader
+therefore always sees the files of one complete generation, never a mix of an
+old docstore and a new index.faiss, and a writer never waits for readers.
+
+Readers pin the generation they load, so it is not deleted while they may
+still read from it, e.g. the shards FaissShardRouter loads on first use.
+After a save, generations that are neither among the newest `keep` nor
+pinned are deleted. Pins of processes that have exited are ignored, and a pin
+of a running process is kept however old it is.
+
+A folder without a CURRENT file holds an index saved before snapshots, which
+is read as generation 0 from the folder itself. The first writer copies it
+into a generation, see migrate_legacy_index; its files are left in place and
+never deleted, as they may be tracked in git.
+"""
+
+import os
+import time
+import uuid
+import shutil
+
+CURRENT_FILE = "CURRENT"
+GENERATIONS_FOLDER = "generations"
+PINS_FOLDER = "pins"
+KEEP_GENERATIONS = 2
+# Pins and unfinished snapshots older than this are left over from a crash,
+# where it cannot be checked whether their process still runs.
+STALE_SECONDS = 24 * 3600
+# Files of an index saved before snapshots, copied by migrate_legacy_index.
+LEGACY_FILES = ("index.faiss", "index.pkl", "metadata_index.json", "bm25_index.json",
+                "embedding_provider.json", "shards")
+
+
+def get_current_generation(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the generation CURRENT points to, or 0 if there is no CURRENT file.
+    """
+    try:
+        with open(os.path.join(faiss_folder, CURRENT_FILE), "r", encoding="utf-8") as current:
+            return int(current.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def get_generation_folder(faiss_folder, generation):
+    """
+    Return the folder of a generation. Generation 0 is the folder itself.
+    """
+    if generation == 0:
+        return faiss_folder
+    return os.path.join(faiss_folder, GENERATIONS_FOLDER, str(generation))
+
+
+def resolve_snapshot_folder(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the folder of the current generation.
+    """
+    return get_generation_folder(faiss_folder, get_current_generation(faiss_folder))
+
+
+def list_generations(faiss_folder):
+    """
+    Return the published generations, oldest first.
+    """
+    try:
+        names = os.listdir(os.path.join(faiss_folder, GENERATIONS_FOLDER))
+    except OSError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def is_process_alive(pid):
+    """
+    Return False if no process with this id runs, True if it runs, and None
+    if this cannot be checked.
+    """
+    if os.name != "posix":
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def is_stale(path, pid):
+    """
+    Return True if a pin or unfinished snapshot belongs to a process that has
+    exited. Where that cannot be checked, it is stale once it is older than
+    STALE_SECONDS.
+    """
+    process_alive = is_process_alive(pid)
+    if process_alive is not None:
+        return not process_alive
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return True
+    return age > STALE_SECONDS
+
+
+def get_pinned_generations(faiss_folder):
+    """
+    Return the generations pinned by running readers. Stale pins are removed.
+    """
+    pins_folder = os.path.join(faiss_folder, PINS_FOLDER)
+    try:
+        names = os.listdir(pins_folder)
+    except OSError:
+        return set()
+    pinned = set()
+    for name in names:
+        parts = name.split("-")
+        if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+            continue
+        pin_path = os.path.join(pins_folder, name)
+        if is_stale(pin_path, int(parts[1])):
+            try:
+                os.remove(pin_path)
+            except OSError:
+                pass
+        else:
+            pinned.add(int(parts[0]))
+    return pinned
+
+
+class SnapshotPin:
+    """
+    Keeps one generation of the index from being deleted until it is released.
+    Use pin_snapshot to create one.
+
+    Args:
+        faiss_folder (str): The folder of the FAISS index.
+        generation (int): The pinned generation.
+        pin_path (str): The pin file, None for generation 0.
+    """
+
+    def __init__(self, faiss_folder, generation, pin_path):
+        self.faiss_folder = faiss_folder
+        self.generation = generation
+        self.folder = get_generation_folder(faiss_folder, generation)
+        self.pin_path = pin_path
+
+    def release(self):
+        """
+        Remove the pin. Safe to call more than once.
+        """
+        if self.pin_path is not None:
+            try:
+                os.remove(self.pin_path)
+            except OSError:
+                pass
+            self.pin_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def create_pin(faiss_folder, generation):
+    """
+    Write a pin file for a generation and return its SnapshotPin.
+    """
+    pins_folder = os.path.join(faiss_folder, PINS_FOLDER)
+    os.makedirs(pins_folder, exist_ok=True)
+    pin_path = os.path.join(pins_folder, f"{generation}-{os.getpid()}-{uuid.uuid4().hex}")
+    with open(pin_path, "w", encoding="utf-8"):
+        pass
+    return SnapshotPin(faiss_folder, generation, pin_path)
+
+
+def pin_snapshot(faiss_folder="./db_manager/faiss_index"):
+    """
+    Pin the current generation and return its SnapshotPin. If a save moves
+    CURRENT on and deletes the generation before the pin is written, the new
+    current generation is pinned instead.
+    """
+    while True:
+        generation = get_current_generation(faiss_folder)
+        if generation == 0:
+            return SnapshotPin(faiss_folder, 0, None)
+        pin = create_pin(faiss_folder, generation)
+        if os.path.isdir(pin.folder):
+            return pin
+        pin.release()
+        if get_current_generation(faiss_folder) == generation:
+            raise FileNotFoundError(f"{CURRENT_FILE} points to {pin.folder}, which does not exist")
+
+
+def begin_snapshot(faiss_folder="./db_manager/faiss_index"):
+    """
+    Create the folder the next generation is written into. It is only seen by
+    readers once it is published with publish_snapshot.
+
+    Returns:
+        str: The unfinished snapshot folder.
+    """
+    generations_folder = os.path.join(faiss_folder, GENERATIONS_FOLDER)
+    os.makedirs(generations_folder, exist_ok=True)
+    temp_folder = os.path.join(generations_folder, f"tmp-{os.getpid()}-{uuid.uuid4().hex}")
+    os.makedirs(temp_folder)
+    return temp_folder
+
+
+def write_current(faiss_folder, generation):
+    """
+    Point CURRENT at a generation, replacing the file in one rename.
+    """
+    current_path = os.path.join(faiss_folder, CURRENT_FILE)
+    temp_path = f"{current_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as current:
+        current.write(str(generation))
+        current.flush()
+        os.fsync(current.fileno())
+    os.replace(temp_path, current_path)
+
+
+def publish_snapshot(faiss_folder, temp_folder, keep=KEEP_GENERATIONS):
+    """
+    Make a snapshot written with begin_snapshot the current generation, then
+    delete the generations that are no longer needed.
+
+    Returns:
+        SnapshotPin: A pin of the new generation, for the writer to release.
+    """
+    generation = max([get_current_generation(faiss_folder), *list_generations(faiss_folder)]) + 1
+    while True:
+        folder = get_generation_folder(faiss_folder, generation)
+        try:
+            # Fails if another writer published this generation first.
+            os.rename(temp_folder, folder)
+            break
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+            generation += 1
+    snapshot_pin = create_pin(faiss_folder, generation)
+    if generation > get_current_generation(faiss_folder):
+        write_current(faiss_folder, generation)
+    collect_snapshots(faiss_folder, keep)
+    return snapshot_pin
+
+
+def has_legacy_index(faiss_folder):
+    """
+    Return True if the folder holds an index saved before snapshots.
+    """
+    return any(os.path.isfile(os.path.join(faiss_folder, name))
+               for name in ("index.faiss", "index.pkl"))
+
+
+def migrate_legacy_index(faiss_folder="./db_manager/faiss_index"):
+    """
+    Copy an index saved before snapshots into the first generation and point
+    CURRENT at it. The legacy files are linked or copied, not moved, so they
+    stay in place. Call it while holding the write lock of the folder.
+
+    Returns:
+        bool: True if the index was migrated.
+    """
+    if get_current_generation(faiss_folder) != 0 or not has_legacy_index(faiss_folder):
+        return False
+    temp_folder = begin_snapshot(faiss_folder)
+    try:
+        for name in LEGACY_FILES:
+            path = os.path.join(faiss_folder, name)
+            if os.path.isdir(path):
+                copy_snapshot_folder(path, os.path.join(temp_folder, name))
+            elif os.path.isfile(path):
+                link_or_copy(path, os.path.join(temp_folder, name))
+        publish_snapshot(faiss_folder, temp_folder).release()
+    except BaseException:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
+    return True
+
+
+def delete_generation(faiss_folder, generation):
+    """
+    Delete the folder of a published generation. Generation 0, the index
+    saved before snapshots, is never deleted.
+    """
+    if generation != 0:
+        shutil.rmtree(get_generation_folder(faiss_folder, generation), ignore_errors=True)
+
+
+def collect_snapshots(faiss_folder="./db_manager/faiss_index", keep=KEEP_GENERATIONS):
+    """
+    Delete the generations that are neither current, among the newest `keep`,
+    nor pinned, and unfinished snapshots of processes that have exited.
+    The files of an index saved before snapshots are left alone.
+
+    Returns:
+        list[int]: The deleted generations.
+    """
+    current = get_current_generation(faiss_folder)
+    if current == 0:
+        return []
+    generations = list_generations(faiss_folder)
+    needed = {current, *generations[-keep:], *get_pinned_generations(faiss_folder)}
+    deleted = [generation for generation in generations if generation not in needed]
+    for generation in deleted:
+        delete_generation(faiss_folder, generation)
+
+    generations_folder = os.path.join(faiss_folder, GENERATIONS_FOLDER)
+    for name in os.listdir(generations_folder):
+        parts = name.split("-")
+        if parts[0] == "tmp" and len(parts) == 3 and parts[1].isdigit():
+            temp_folder = os.path.join(generations_folder, name)
+            if is_stale(temp_folder, int(parts[1])):
+                shutil.rmtree(temp_folder, ignore_errors=True)
+    return deleted
+
+
+def copy_snapshot_folder(source, destination):
+    """
+    Copy a folder of index files into a new snapshot. Files are hard linked
+    where the file system allows it, which is safe because snapshots are never
+    written to after they are published.
+    """
+    shutil.copytree(source, destination, copy_function=link_or_copy, dirs_exist_ok=True)
+
+
+def link_or_copy(source, destination):
+    """
+    Hard link a file, or copy it if it cannot be linked.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
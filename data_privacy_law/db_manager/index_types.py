@@ -0,0 +1,183 @@
+"""
+Functions for choosing the type of the FAISS index.
+- Flat: Exact search over every vector. Best recall, cost grows with the corpus.
+- IVF: Vectors are clustered into `nlist` lists and a query only scans the
+    `nprobe` closest lists.
+- HNSW: Graph based search. Fast and accurate, but uses more memory per vector.
+- IVF-PQ: IVF with product quantized vectors. Far less memory per vector, at
+    the cost of some recall.
+IVF and IVF-PQ are trained on the vectors already in the index.
+compare_index_types measures the recall and latency of each type on a corpus.
+"""
+
+import time
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("Flat", "IVF", "HNSW", "IVF-PQ")
+
+
+def get_index_type(index):
+    """
+    Return the name of the type of a FAISS index, one of INDEX_TYPES.
+    """
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "IVF-PQ"
+    if isinstance(index, faiss.IndexIVF):
+        return "IVF"
+    if isinstance(index, faiss.IndexHNSW):
+        return "HNSW"
+    return "Flat"
+
+
+def get_index_vectors(index):
+    """
+    Return every vector stored in a FAISS index, in the order they were added.
+    The vectors of an IVF-PQ index are the quantized approximations.
+    """
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def get_pq_subquantizers(dimension):
+    """
+    Return the number of PQ sub-quantizers: the largest divisor of the
+    dimension that keeps at least 8 dimensions per sub-quantizer, at most 64.
+    """
+    for subquantizers in range(min(64, dimension // 8), 0, -1):
+        if dimension % subquantizers == 0:
+            return subquantizers
+    return 1
+
+
+def create_faiss_index(index_type, vectors, metric=faiss.METRIC_L2, nlist=None, nprobe=None,
+                       hnsw_m=32, ef_search=64):
+    """
+    Build a FAISS index of a type, trained on and holding `vectors`.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        vectors (np.ndarray): The vectors, shape (n, dimension).
+        metric (int): faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT.
+        nlist (int): Number of IVF lists. By default about 4 * sqrt(n), with
+            at least 39 training vectors per list.
+        nprobe (int): Number of IVF lists scanned per query. By default nlist / 4.
+        hnsw_m (int): Number of neighbours per HNSW node.
+        ef_search (int): Size of the HNSW candidate list at query time.
+
+    Returns:
+        faiss.Index: The new index, with the vectors added in order.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"{index_type} is not one of {INDEX_TYPES}")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    if index_type == "Flat":
+        index = faiss.IndexFlat(dimension, metric)
+    elif index_type == "HNSW":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, metric)
+        index.hnsw.efSearch = ef_search
+    else:
+        if count == 0:
+            raise ValueError(f"An {index_type} index needs vectors to train on")
+        if nlist is None:
+            nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if index_type == "IVF":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        else:
+            # Each of the 2^nbits centroids of a sub-quantizer wants 39 training vectors.
+            nbits = max(1, min(8, int(math.log2(max(2, count // 39)))))
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, get_pq_subquantizers(dimension), nbits, metric
+            )
+        index.train(vectors)
+        index.nprobe = nprobe or max(1, nlist // 4)
+
+    if count:
+        index.add(vectors)
+    return index
+
+
+def convert_faiss_index(index, index_type, **kwargs):
+    """
+    Return the vectors of an index in a new index of another type, trained on
+    those vectors. The index is returned as is if it already has that type.
+    """
+    if get_index_type(index) == index_type:
+        return index
+    return create_faiss_index(index_type, get_index_vectors(index), index.metric_type, **kwargs)
+
+
+def get_search_parameters(index, selector):
+    """
+    Return the search parameters that restrict a search of the index to the
+    ids accepted by `selector`, keeping the nprobe of IVF indexes.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def get_bytes_per_vector(index):
+    """
+    Return the size of the serialized index divided by the number of vectors.
+    """
+    if index.ntotal == 0:
+        return 0.0
+    return len(faiss.serialize_index(index)) / index.ntotal
+
+
+def compare_index_types(vectors, query_vectors, index_types=INDEX_TYPES, k=10,
+                        metric=faiss.METRIC_L2):
+    """
+    Build the corpus under each index type and measure it against Flat.
+
+    Args:
+        vectors (np.ndarray): The corpus, shape (n, dimension).
+        query_vectors (np.ndarray): The queries, shape (q, dimension).
+        index_types (tuple): The index types to compare.
+        k (int): Number of neighbours searched per query.
+        metric (int): faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT.
+
+    Returns:
+        list[dict]: One row per index type with the keys "Type",
+            "Recall@k" (share of Flat's top k found), "P50 ms", "P99 ms"
+            (single query latency), "Bytes/vector" and "Build s".
+    """
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    exact_index = create_faiss_index("Flat", vectors, metric)
+    _, exact_labels = exact_index.search(query_vectors, k)
+
+    report = []
+    for index_type in index_types:
+        build_start = time.perf_counter()
+        index = create_faiss_index(index_type, vectors, metric)
+        build_seconds = time.perf_counter() - build_start
+
+        latencies = []
+        found = 0
+        for query_vector, exact in zip(query_vectors, exact_labels):
+            query_start = time.perf_counter()
+            _, labels = index.search(query_vector.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            found += len(set(labels[0][labels[0] >= 0]) & set(exact[exact >= 0]))
+
+        expected = max(1, int((exact_labels >= 0).sum()))
+        report.append({
+            "Type": index_type,
+            f"Recall@{k}": found / expected,
+            "P50 ms": float(np.percentile(latencies, 50)),
+            "P99 ms": float(np.percentile(latencies, 99)),
+            "Bytes/vector": get_bytes_per_vector(index),
+            "Build s": build_seconds,
+        })
+    return report
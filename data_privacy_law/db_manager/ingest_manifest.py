@@ -0,0 +1,102 @@
+"""
+Functions for the ingest manifest.
+The manifest remembers the size, mtime and SHA-256 of every PDF that has been
+added to the FAISS index, together with the bill info the LLM extracted for it,
+so unchanged PDFs can be skipped on the next run of parse_bills.py.
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_PATH = "./db_manager/data/ingest_manifest.json"
+
+
+def load_ingest_manifest(manifest_path=MANIFEST_PATH):
+    """
+    Load the ingest manifest if it exists.
+
+    Args:
+        manifest_path (str): The path to the manifest json file.
+
+    Returns:
+        dict: {pdf_path: {"Size", "Mtime", "Sha256", "Bill_info"}}, empty if
+              there is no manifest yet or it cannot be read.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError) as load_error:
+        print("Error loading ingest manifest; starting a new one. Error:", load_error)
+        return {}
+
+
+def save_ingest_manifest(manifest, manifest_path=MANIFEST_PATH):
+    """
+    Write the ingest manifest to disk. The file is replaced atomically so an
+    interrupted run never leaves a half written manifest behind.
+    """
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def calculate_file_sha256(pdf_path, block_size=1 << 20):
+    """
+    Return the SHA-256 hex digest of a file, read in blocks.
+    """
+    sha256 = hashlib.sha256()
+    with open(pdf_path, "rb") as pdf_file:
+        for block in iter(lambda: pdf_file.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_manifest_key(pdf_path):
+    """
+    Return the key used for a PDF in the manifest.
+    """
+    return os.path.normpath(pdf_path)
+
+
+def get_unchanged_bill_info(manifest, pdf_path):
+    """
+    Return the stored bill info if the PDF has not changed since it was ingested.
+    Size and mtime are checked first, the file is only hashed when they differ.
+
+    Args:
+        manifest (dict): The ingest manifest.
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        dict or None: The stored bill info, or None if the PDF is new or changed.
+    """
+    entry = manifest.get(get_manifest_key(pdf_path))
+    if not entry:
+        return None
+
+    file_stat = os.stat(pdf_path)
+    if file_stat.st_size != entry["Size"]:
+        return None
+    if file_stat.st_mtime_ns != entry["Mtime"]:
+        # The file was touched, compare the content before parsing it again.
+        if calculate_file_sha256(pdf_path) != entry["Sha256"]:
+            return None
+        entry["Mtime"] = file_stat.st_mtime_ns
+    return dict(entry["Bill_info"])
+
+
+def record_bill_in_manifest(manifest, pdf_path, bill_info):
+    """
+    Record the fingerprint of an ingested PDF and the bill info extracted for it.
+    """
+    file_stat = os.stat(pdf_path)
+    manifest[get_manifest_key(pdf_path)] = {
+        "Size": file_stat.st_size,
+        "Mtime": file_stat.st_mtime_ns,
+        "Sha256": calculate_file_sha256(pdf_path),
+        "Bill_info": dict(bill_info),
+    }
@@ -0,0 +1,226 @@
+"""
+Single writer ingest queue of the FAISS index.
+Only the process that holds the write lock of the index folder, a file lock
+on ingest/write.lock, loads and saves the index, so two writers never save
+over each other's chunks. Writers that do not hold it, e.g. two users adding
+a document on the Add Documents page while parse_bills.py runs, write their
+chunks as a batch file into ingest/queue and wait, at most for a timeout if
+one is given. The holder of the lock saves as soon as it sees a queued batch,
+adding every queued batch in the order they were queued, so batches submitted
+at the same time are embedded and saved together.
+A batch file is only deleted once the snapshot with its chunks has been
+published, so a writer that crashes leaves its batches for the next one.
+A batch file that cannot be read is renamed to end in .failed, so it is
+not retried.
+"""
+
+import os
+import json
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INGEST_FOLDER_NAME = "ingest"
+LOCK_FILE = "write.lock"
+QUEUE_FOLDER_NAME = "queue"
+FAILED_SUFFIX = ".failed"
+# Results of submit_chunks.
+SAVED = "saved"
+QUEUED = "queued"
+
+
+def get_ingest_folder(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the folder of the write lock and the queue of an index folder.
+    """
+    return os.path.join(faiss_folder, INGEST_FOLDER_NAME)
+
+
+def get_queue_folder(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the folder of the queued batch files.
+    """
+    return os.path.join(get_ingest_folder(faiss_folder), QUEUE_FOLDER_NAME)
+
+
+class IndexWriteLock:
+    """
+    Cross-process lock that gives one writer at a time the FAISS index of a
+    folder. Threads of one process that each create their own lock also
+    exclude each other.
+
+    Args:
+        faiss_folder (str): The folder of the FAISS index.
+    """
+
+    def __init__(self, faiss_folder="./db_manager/faiss_index"):
+        self.lock_path = os.path.join(get_ingest_folder(faiss_folder), LOCK_FILE)
+        self.lock_file = None
+
+    def acquire(self, blocking=True, poll_interval=0.1):
+        """
+        Take the lock. Returns False if it is held elsewhere and blocking is False.
+        """
+        if self.lock_file is not None:
+            raise RuntimeError(f"{self.lock_path} is already held by this lock")
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, "a+b")  # pylint: disable=consider-using-with
+        while True:
+            try:
+                if fcntl is not None:
+                    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                    fcntl.flock(lock_file.fileno(), flags)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                self.lock_file = lock_file
+                return True
+            except OSError:
+                if not blocking:
+                    lock_file.close()
+                    return False
+                time.sleep(poll_interval)
+
+    def release(self):
+        """
+        Give the lock up. Safe to call when it is not held.
+        """
+        if self.lock_file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.lock_file.close()
+            self.lock_file = None
+
+    @property
+    def is_held(self):
+        """
+        True while this lock holds the index.
+        """
+        return self.lock_file is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def enqueue_batch(faiss_folder, chunk_texts, chunk_metadatas):
+    """
+    Write the chunks of one document to the queue of an index folder. The
+    file names sort in the order the batches were queued.
+
+    Returns:
+        str: The path of the batch file.
+    """
+    queue_folder = get_queue_folder(faiss_folder)
+    os.makedirs(queue_folder, exist_ok=True)
+    batch_name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex}.json"
+    batch_path = os.path.join(queue_folder, batch_name)
+    temp_path = batch_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as batch_file:
+        json.dump({"Texts": list(chunk_texts), "Metadatas": list(chunk_metadatas)},
+                  batch_file, default=str)
+    os.replace(temp_path, batch_path)
+    return batch_path
+
+
+def list_queued_batches(faiss_folder="./db_manager/faiss_index"):
+    """
+    Return the paths of the queued batch files, oldest first.
+    """
+    queue_folder = get_queue_folder(faiss_folder)
+    try:
+        names = os.listdir(queue_folder)
+    except OSError:
+        return []
+    return [os.path.join(queue_folder, name) for name in sorted(names)
+            if name.endswith(".json")]
+
+
+def load_batch(batch_path):
+    """
+    Read a batch file.
+
+    Returns:
+        tuple: (list of chunk texts, list of chunk metadata dicts)
+    """
+    with open(batch_path, "r", encoding="utf-8") as batch_file:
+        batch = json.load(batch_file)
+    return batch["Texts"], batch["Metadatas"]
+
+
+def remove_batches(batch_paths):
+    """
+    Delete batch files whose chunks have been saved.
+    """
+    for batch_path in batch_paths:
+        try:
+            os.remove(batch_path)
+        except OSError:
+            pass
+
+
+def set_batch_aside(batch_path):
+    """
+    Rename a batch file that cannot be read so it is no longer queued.
+    """
+    try:
+        os.replace(batch_path, batch_path + FAILED_SUFFIX)
+    except OSError:
+        pass
+
+
+def submit_chunks(faiss_folder, chunk_texts, chunk_metadatas, open_session,
+                  poll_interval=0.1, timeout=None):
+    """
+    Queue the chunks of one document and wait until they are saved. If no
+    other writer holds the index, this call becomes the writer and saves its
+    batch together with the batches queued meanwhile. Otherwise the holder of
+    the lock adds the batch at its next save, and the call returns QUEUED if
+    that takes longer than the timeout. The batch stays queued in that case.
+
+    Args:
+        faiss_folder (str): The folder of the FAISS index.
+        chunk_texts (list[str]): The chunk texts.
+        chunk_metadatas (list[dict]): The chunk metadata.
+        open_session (callable): Called with the held IndexWriteLock, returns
+            the FaissIngestSession that adds the queued batches and releases
+            the lock when it ends.
+        poll_interval (float): Seconds between checks while another writer
+            holds the index.
+        timeout (float): Optional, the seconds to wait while another writer
+            holds the index. None waits until the batch is saved.
+
+    Returns:
+        str: SAVED once the batch is saved, QUEUED if the timeout passed first.
+    """
+    batch_path = enqueue_batch(faiss_folder, chunk_texts, chunk_metadatas)
+    write_lock = IndexWriteLock(faiss_folder)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if write_lock.acquire(blocking=False):
+            if os.path.isfile(batch_path):
+                with open_session(write_lock):
+                    pass
+            else:
+                write_lock.release()
+            return SAVED
+        if not os.path.isfile(batch_path):
+            return SAVED
+        if deadline is not None and time.monotonic() >= deadline:
+            return QUEUED
+        time.sleep(poll_interval)
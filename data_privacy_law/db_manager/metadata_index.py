@@ -0,0 +1,312 @@
+"""
+Functions for the metadata inverted index of the FAISS docstore.
+For every facet (State, Type, Sector and Topics) the index maps each value to
+the list of docstore ids of the chunks that have it, so looking up e.g. all
+chunks of Texas is a dictionary lookup instead of a scan over the docstore.
+It also maps the Chunk_id of every chunk to its docstore id, so the text of a
+chunk can be fetched without walking the docstore, and keeps the Title, Topics
+and State of every bill by its Path, so the bills of a state can be listed
+without reading any chunk.
+The facet postings are saved as a table of the docstore.sqlite of the index,
+and the Chunk_ids as its indexed chunk_id column, see
+db_manager.sqlite_docstore. They are read per lookup, so only the bills are
+loaded, from metadata_index.json next to the FAISS index. Stores without
+the table, e.g. ones saved before it, get an index built in memory.
+"""
+
+import os
+import json
+from collections.abc import Mapping
+
+FACETS = ("State", "Type", "Sector", "Topics")
+BILL_FIELDS = ("Title", "Topics", "State")
+METADATA_INDEX_FILE = "metadata_index.json"
+FACETS_TABLE = "facets"
+
+
+def normalize_facet_value(facet, value):
+    """
+    Return the key of a facet value. Topics are matched case and whitespace
+    insensitively, the other facets are matched exactly.
+    """
+    if facet == "Topics":
+        return " ".join(str(value).lower().split())
+    return str(value)
+
+
+def get_facet_values(metadata, facet):
+    """
+    Return the normalized values a chunk has for a facet. Topics is a list,
+    the other facets hold one value. Empty values are left out.
+    """
+    value = metadata.get(facet)
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [
+        normalize_facet_value(facet, single_value)
+        for single_value in values
+        if single_value not in (None, "")
+    ]
+
+
+def create_metadata_index():
+    """
+    Return an empty metadata index.
+    """
+    return {"Count": 0, "Facets": {facet: {} for facet in FACETS}, "Chunk_ids": {}, "Bills": {}}
+
+
+def add_to_metadata_index(metadata_index, doc_id, metadata):
+    """
+    Add the docstore id of one chunk to the posting lists of its facet values
+    and to the Chunk_id map, and its bill to the bills. If two chunks share a
+    Chunk_id, the first one is kept.
+    """
+    chunk_id = metadata.get("Chunk_id")
+    if chunk_id is not None:
+        metadata_index["Chunk_ids"].setdefault(chunk_id, doc_id)
+    for facet in FACETS:
+        postings = metadata_index["Facets"][facet]
+        for value in dict.fromkeys(get_facet_values(metadata, facet)):
+            postings.setdefault(value, []).append(doc_id)
+    add_bill_to_metadata_index(metadata_index, metadata)
+
+
+def add_bill_to_metadata_index(metadata_index, metadata):
+    """
+    Count one chunk and add its bill to the bills, the part of the index that
+    is saved in metadata_index.json. The first chunk of a bill is kept.
+    """
+    bill_key = metadata.get("Path") or metadata.get("Title")
+    if bill_key:
+        metadata_index["Bills"].setdefault(
+            str(bill_key), {field: metadata.get(field) for field in BILL_FIELDS}
+        )
+    metadata_index["Count"] += 1
+
+
+def build_metadata_index(faiss_store):
+    """
+    Build the metadata index of every chunk in a loaded FAISS store.
+    """
+    metadata_index = create_metadata_index()
+    # pylint: disable=protected-access
+    for doc_id, doc in faiss_store.docstore._dict.items():
+        add_to_metadata_index(metadata_index, doc_id, getattr(doc, "metadata", {}))
+    return metadata_index
+
+
+def create_facet_table(connection):
+    """
+    Create the table of facet postings in a docstore.sqlite.
+    """
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS {FACETS_TABLE} (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (facet, value, position)
+        ) WITHOUT ROWID"""
+    )
+
+
+def add_facet_rows(connection, rows):
+    """
+    Write the facet values of chunks to the table of a docstore.sqlite.
+
+    Args:
+        connection (sqlite3.Connection): The open docstore.sqlite.
+        rows (list[tuple]): (index position, metadata dict) of each chunk.
+    """
+    connection.executemany(
+        f"INSERT INTO {FACETS_TABLE} VALUES (?, ?, ?)",
+        [
+            (facet, value, position)
+            for position, metadata in rows
+            for facet in FACETS
+            for value in dict.fromkeys(get_facet_values(metadata, facet))
+        ],
+    )
+
+
+class FacetPostings(Mapping):
+    """
+    Read-only facet value -> docstore ids mapping of one facet, read from the
+    facets table of a docstore.sqlite per lookup. Used in place of the
+    posting dict of a facet in an index built in memory.
+    """
+
+    def __init__(self, docstore, facet):
+        self.docstore = docstore
+        self.facet = facet
+
+    def __getitem__(self, value):
+        doc_ids = [
+            doc_id for doc_id, in self.docstore.query(
+                f"SELECT documents.id FROM {FACETS_TABLE} AS facets "
+                "JOIN documents ON documents.position = facets.position "
+                "WHERE facets.facet = ? AND facets.value = ? ORDER BY facets.position",
+                (self.facet, value),
+            )
+        ]
+        if not doc_ids:
+            raise KeyError(value)
+        return doc_ids
+
+    def __iter__(self):
+        return (value for value, in self.docstore.query(
+            f"SELECT DISTINCT value FROM {FACETS_TABLE} WHERE facet = ?", (self.facet,)
+        ))
+
+    def __len__(self):
+        return self.docstore.query(
+            f"SELECT COUNT(DISTINCT value) FROM {FACETS_TABLE} WHERE facet = ?", (self.facet,)
+        )[0][0]
+
+
+class ChunkIdMap(Mapping):
+    """
+    Read-only Chunk_id -> docstore id mapping, read from the indexed chunk_id
+    column of a docstore.sqlite per lookup. The first chunk with a Chunk_id
+    is returned.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, chunk_id):
+        rows = self.docstore.query(
+            "SELECT id FROM documents WHERE chunk_id = ? ORDER BY position LIMIT 1", (chunk_id,)
+        )
+        if not rows:
+            raise KeyError(chunk_id)
+        return rows[0][0]
+
+    def __iter__(self):
+        return (chunk_id for chunk_id, in self.docstore.query(
+            "SELECT DISTINCT chunk_id FROM documents WHERE chunk_id IS NOT NULL"
+        ))
+
+    def __len__(self):
+        return self.docstore.query("SELECT COUNT(DISTINCT chunk_id) FROM documents")[0][0]
+
+
+def get_sqlite_metadata_index(faiss_store, bills=None):
+    """
+    Return a metadata index whose facets and Chunk_ids are read from the
+    docstore.sqlite of a loaded store, or None if it has no facets table.
+    Only chunks saved in the file are found.
+
+    Args:
+        faiss_store (FAISS): The loaded FAISS store.
+        bills (dict): Optional bills of the index, see add_bill_to_metadata_index.
+    """
+    docstore = faiss_store.docstore
+    # A SQLiteDocstore, whose class is not imported as db_manager.sqlite_docstore
+    # imports this module.
+    if not (callable(getattr(type(docstore), "has_table", None))
+            and docstore.has_table(FACETS_TABLE)):
+        return None
+    return {
+        "Count": docstore.count_saved(),
+        "Facets": {facet: FacetPostings(docstore, facet) for facet in FACETS},
+        "Chunk_ids": ChunkIdMap(docstore),
+        "Bills": {} if bills is None else bills,
+    }
+
+
+def save_metadata_index(metadata_index, faiss_folder="./db_manager/faiss_index"):
+    """
+    Write the bills of the metadata index next to the FAISS index. The facets
+    and Chunk_ids are saved with the docstore, see add_facet_rows.
+    """
+    index_path = os.path.join(faiss_folder, METADATA_INDEX_FILE)
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as index_file:
+        json.dump({"Count": metadata_index["Count"], "Bills": metadata_index["Bills"]},
+                  index_file)
+    os.replace(temp_path, index_path)
+
+
+def load_bills(faiss_folder, doc_count):
+    """
+    Return the bills saved next to the FAISS index, or None if the file is
+    missing, unreadable or does not cover `doc_count` chunks.
+    """
+    index_path = os.path.join(faiss_folder, METADATA_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, "r", encoding="utf-8") as index_file:
+            saved_index = json.load(index_file)
+    except (OSError, ValueError) as load_error:
+        print("Error loading metadata index; rebuilding it. Error:", load_error)
+        return None
+    if saved_index.get("Count") != doc_count or "Bills" not in saved_index:
+        return None
+    return saved_index["Bills"]
+
+
+def load_metadata_index(faiss_store, faiss_folder="./db_manager/faiss_index"):
+    """
+    Load the metadata index of a loaded FAISS store. The facets and Chunk_ids
+    are read from its docstore.sqlite where it has them, and the bills from
+    the file next to the FAISS index. Whatever is missing, or does not cover
+    the same number of chunks as the store, is rebuilt from the docstore.
+
+    Args:
+        faiss_store (FAISS): The loaded FAISS store the index belongs to.
+        faiss_folder (str): The folder of the FAISS index.
+    """
+    # pylint: disable=protected-access
+    doc_count = len(faiss_store.docstore._dict)
+    bills = load_bills(faiss_folder, doc_count)
+    metadata_index = get_sqlite_metadata_index(faiss_store, bills)
+    if metadata_index is None:
+        metadata_index = build_metadata_index(faiss_store)
+    elif bills is None:
+        metadata_index["Bills"] = build_metadata_index(faiss_store)["Bills"]
+    return metadata_index
+
+
+def get_doc_ids_for_facet(metadata_index, facet, value):
+    """
+    Return the docstore ids of the chunks with a facet value.
+
+    Args:
+        metadata_index (dict): The metadata index.
+        facet (str): One of FACETS.
+        value (str): The facet value, e.g. "Texas" for State.
+
+    Returns:
+        list[str]: The docstore ids, empty if no chunk has the value.
+    """
+    if facet not in FACETS:
+        raise ValueError(f"{facet} is not one of {FACETS}")
+    return metadata_index["Facets"][facet].get(normalize_facet_value(facet, value), [])
+
+
+def get_doc_id_for_chunk(metadata_index, chunk_id):
+    """
+    Return the docstore id of the chunk with a Chunk_id, or None if it is not indexed.
+    """
+    return metadata_index["Chunk_ids"].get(chunk_id)
+
+
+def get_bills_of_state(metadata_index, state):
+    """
+    Return the Title and Topics of every bill of a state, one entry per title.
+
+    Args:
+        metadata_index (dict): The metadata index.
+        state (str): The state, e.g. "Texas".
+
+    Returns:
+        list[dict]: {"Title": ..., "Topics": ...} of each bill, in the order
+            the bills were added.
+    """
+    bills = {}
+    for bill in metadata_index["Bills"].values():
+        if bill.get("State") == state:
+            title = bill.get("Title") or "No Title"
+            bills[title] = {"Title": title, "Topics": bill.get("Topics") or "No Topics"}
+    return list(bills.values())
@@ -0,0 +1,134 @@
+"""
+Store of the text of every PDF page that was added to the FAISS index.
+Pages are written at ingest time, compressed, in a SQLite file next to the
+index and keyed by (Path, Page), the same values the chunk metadata holds,
+so a page can be fetched at question time without parsing the PDF again.
+"""
+
+import os
+import zlib
+import sqlite3
+import threading
+
+PAGE_STORE_PATH = "./db_manager/faiss_index/pages.sqlite"
+
+# Shared read handles, one per file, so the connection is opened once per process.
+open_page_stores = {}
+open_page_stores_lock = threading.Lock()
+
+
+def get_page_key(pdf_path):
+    """
+    Return the key used for a PDF in the page store.
+    """
+    return os.path.normpath(pdf_path)
+
+
+class PageStore:
+    """
+    SQLite backed store of page texts. The file is only opened on the first
+    lookup, and lookups on a missing file return None without creating it.
+
+    Args:
+        db_path (str): The path to the SQLite file.
+    """
+
+    def __init__(self, db_path=PAGE_STORE_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self, create=False):
+        """
+        Open the SQLite file. Returns None if it does not exist and create is False.
+        """
+        if self.connection is None:
+            if not create and not os.path.exists(self.db_path):
+                return None
+            folder = os.path.dirname(self.db_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    path TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    text BLOB NOT NULL,
+                    PRIMARY KEY (path, page)
+                ) WITHOUT ROWID"""
+            )
+            self.connection.commit()
+        return self.connection
+
+    def put_pages(self, pdf_path, pages):
+        """
+        Store the pages of a PDF, replacing any pages stored for it before.
+
+        Args:
+            pdf_path (str): The "Path" of the PDF as it is in the chunk metadata.
+            pages (list[str]): The text of each page, as extract_text_from_pdf returns.
+        """
+        key = get_page_key(pdf_path)
+        rows = [
+            (key, page_num, zlib.compress(page_text.encode("utf-8")))
+            for page_num, page_text in enumerate(pages, start=1)
+        ]
+        with self.lock:
+            connection = self.connect(create=True)
+            connection.execute("DELETE FROM pages WHERE path = ?", (key,))
+            connection.executemany(
+                "INSERT INTO pages (path, page, text) VALUES (?, ?, ?)", rows
+            )
+            connection.commit()
+
+    def get_page(self, pdf_path, page_num):
+        """
+        Return the text of one page, or None if it is not stored.
+
+        Args:
+            pdf_path (str): The "Path" of the PDF as it is in the chunk metadata.
+            page_num (int or str): The page number, starting at 1.
+        """
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT text FROM pages WHERE path = ? AND page = ?",
+                (get_page_key(pdf_path), int(page_num)),
+            ).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def has_pages(self, pdf_path):
+        """
+        Return True if any page of the PDF is stored.
+        """
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return False
+            row = connection.execute(
+                "SELECT 1 FROM pages WHERE path = ? LIMIT 1", (get_page_key(pdf_path),)
+            ).fetchone()
+        return row is not None
+
+    def close(self):
+        """
+        Close the SQLite connection.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def open_page_store(db_path=PAGE_STORE_PATH):
+    """
+    Return the shared PageStore of a file, creating it on the first call.
+    """
+    with open_page_stores_lock:
+        if db_path not in open_page_stores:
+            open_page_stores[db_path] = PageStore(db_path)
+        return open_page_stores[db_path]
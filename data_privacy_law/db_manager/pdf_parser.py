@@ -2,6 +2,9 @@
 Functions for parsing texts from pdf.
 """
 
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import PyPDF2
 from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -114,6 +117,49 @@ def extract_text_from_pdf(pdf_path):
 
     return text
 
+def extract_texts_in_parallel(pdf_paths, workers):
+    """
+    Extract the text of many PDF files on a pool of worker processes.
+    PyPDF2 is pure Python and CPU-bound, so this spreads the parsing across cores.
+
+    Args:
+        pdf_paths (list[str]): The paths to the PDF files.
+        workers (int): The maximum number of worker processes to use.
+
+    Yields:
+        tuple: (pdf_path, pages) in completion order, where pages is the same
+               list of strings that extract_text_from_pdf returns for pdf_path.
+    """
+    if not pdf_paths:
+        return
+
+    max_workers = max(1, min(workers, len(pdf_paths)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        future_to_path = {
+            executor.submit(extract_text_from_pdf, pdf_path): pdf_path
+            for pdf_path in pdf_paths
+        }
+        for future in as_completed(future_to_path):
+            yield future_to_path[future], future.result()
+
+def yield_in_input_order(extracted_pdfs, pdf_paths):
+    """
+    Reorder the (pdf_path, pages) pairs of extract_texts_in_parallel into the
+    order of `pdf_paths`. Pairs that finish early are held back until every
+    PDF before them has been yielded, so the PDFs are handled as soon as
+    possible but always in the same order as a serial run.
+
+    Yields:
+        tuple: (pdf_path, pages) in the order of pdf_paths.
+    """
+    waiting = {}
+    next_index = 0
+    for pdf_path, pages in extracted_pdfs:
+        waiting[pdf_path] = pages
+        while next_index < len(pdf_paths) and pdf_paths[next_index] in waiting:
+            yield pdf_paths[next_index], waiting.pop(pdf_paths[next_index])
+            next_index += 1
+
 def extract_uploaded_pdf_pages(uploaded_file):
     """
     Takes an uploaded file (Streamlit's UploadedFile) and returns a list of 
@@ -144,3 +190,10 @@ def read_pdf(uploaded_file):
             if page_text:
                 text += page_text
     return text
+
+def sanitize_filename(filename):
+    """
+    Remove characters that are illegal in Windows file names.
+    """
+    # Remove: \ / * ? : " < > |
+    return re.sub(r'[\\/*?:"<>|]', "", filename)
@@ -0,0 +1,239 @@
+"""
+Functions for benchmarking retrieval without the network.
+The chunks of the PDFs in pdfs/ are embedded with a local embedder, which
+gives every text the same vector on every run, and indexed into a FAISS store
+with its metadata and BM25 indexes. Larger corpora are made by copying the
+chunks under other states. For each corpus the benchmark reports the index
+build time, the memory used and the p50/p95/p99 latency of
+similarity_search_with_relevance_scores with and without a State filter, both
+for the plain FAISS store, which applies LangChain's filter after the search,
+as the reference, and for the FaissShardRouter the State Privacy page
+searches through, with its pre-filter and BM25 fusion.
+The LLM is not used, so the State and Type of a PDF are taken from its folder.
+"""
+
+import gc
+import os
+import re
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from db_manager.bm25_index import build_bm25_index
+from db_manager.embedding_pipeline import LocalFakeEmbeddings
+from db_manager.faiss_db_manager import calculate_updated_chunk_ids
+from db_manager.faiss_shards import FaissShardRouter
+from db_manager.metadata_index import build_metadata_index
+from db_manager.pdf_parser import chunk_pdf_pages, extract_text_from_pdf
+
+BENCHMARK_QUESTIONS = (
+    "What rights do consumers have to delete their personal data?",
+    "Which businesses must comply with the data privacy act?",
+    "How long can health records be kept?",
+    "What are the penalties for a data breach?",
+    "Can parents access the social media accounts of minors?",
+    "Does the law cover biometric data?",
+    "When must a controller respond to a consumer request?",
+    "What is a data broker?",
+    "HB 1426",
+    "Sec. 541.051",
+)
+# States the copies of a synthetic corpus are assigned to, so a State filter
+# keeps the same share of a larger corpus as of the real one.
+SYNTHETIC_STATES = (
+    "Arizona", "Arkansas", "Delaware", "Georgia", "Hawaii", "Idaho", "Illinois",
+    "Indiana", "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland",
+    "Massachusetts", "Michigan", "Minnesota", "Mississippi", "Missouri",
+    "Nebraska", "Nevada", "New Hampshire", "New Jersey", "New Mexico", "New York",
+    "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Pennsylvania",
+    "Rhode Island", "South Carolina", "South Dakota", "Vermont", "West Virginia",
+    "Wisconsin", "Wyoming",
+)
+EMBED_BATCH_SIZE = 10000
+
+
+def get_pdf_bill_info(pdf_path):
+    """
+    Return the State, Type and Title of a PDF from its folder and file name,
+    e.g. pdfs/Texas/HB 1426.pdf or pdfs/Comprehensive/OregonConsumerPrivacyAct.pdf.
+    """
+    folder = os.path.basename(os.path.dirname(pdf_path))
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    if folder == "Comprehensive":
+        match = re.match(r"[A-Z][a-z]+", name)
+        state = match.group(0) if match else "Unknown"
+        bill_type = "Comprehensive State level"
+    else:
+        state = folder
+        bill_type = "State level sectoral"
+    return {"State": state, "Type": bill_type, "Title": f"{state}: {name}"}
+
+
+def load_pdf_corpus(pdf_folder="./pdfs"):
+    """
+    Chunk every PDF under a folder the way the ingest does.
+
+    Returns:
+        tuple: (list of chunk texts, list of chunk metadata dicts)
+    """
+    texts = []
+    metadatas = []
+    for folder, _, file_names in sorted(os.walk(pdf_folder)):
+        for file_name in sorted(file_names):
+            if not file_name.lower().endswith(".pdf"):
+                continue
+            pdf_path = os.path.join(folder, file_name)
+            chunk_texts, chunk_metadatas = chunk_pdf_pages(
+                extract_text_from_pdf(pdf_path), pdf_path
+            )
+            bill_info = get_pdf_bill_info(pdf_path)
+            for metadata in chunk_metadatas:
+                metadata.update(bill_info)
+            texts.extend(chunk_texts)
+            metadatas.extend(calculate_updated_chunk_ids(chunk_metadatas))
+    return texts, metadatas
+
+
+def make_synthetic_corpus(texts, metadatas, scale):
+    """
+    Return a corpus `scale` times the size of the given one. The first copy is
+    the corpus itself; the others have their texts numbered and are assigned
+    to SYNTHETIC_STATES in turn.
+    """
+    synthetic_texts = list(texts)
+    synthetic_metadatas = list(metadatas)
+    for copy_number in range(1, scale):
+        state = SYNTHETIC_STATES[(copy_number - 1) % len(SYNTHETIC_STATES)]
+        for text, metadata in zip(texts, metadatas):
+            synthetic_texts.append(f"{text} (copy {copy_number})")
+            synthetic_metadatas.append({
+                **metadata,
+                "State": state,
+                "Chunk_id": f"{metadata.get('Chunk_id')}_Copy_{copy_number}",
+            })
+    return synthetic_texts, synthetic_metadatas
+
+
+def get_memory_mb():
+    """
+    Return the resident memory of this process in MB, or 0.0 if it is unknown.
+    """
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def build_benchmark_router(texts, metadatas, embeddings, bm25=True):
+    """
+    Build the FAISS store, metadata index and BM25 index of a corpus.
+    The texts are embedded in batches; only the indexing is timed.
+
+    Returns:
+        tuple: (FaissShardRouter, seconds spent building the indexes)
+    """
+    faiss_store = None
+    build_seconds = 0.0
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch_texts = texts[start:start + EMBED_BATCH_SIZE]
+        batch_metadatas = metadatas[start:start + EMBED_BATCH_SIZE]
+        vectors = embeddings.embed_documents(batch_texts)
+        build_start = time.perf_counter()
+        if faiss_store is None:
+            faiss_store = FAISS.from_embeddings(
+                list(zip(batch_texts, vectors)), embeddings, metadatas=batch_metadatas
+            )
+        else:
+            faiss_store.add_embeddings(list(zip(batch_texts, vectors)), batch_metadatas)
+        build_seconds += time.perf_counter() - build_start
+
+    build_start = time.perf_counter()
+    metadata_index = build_metadata_index(faiss_store)
+    bm25_index = build_bm25_index(faiss_store) if bm25 else None
+    build_seconds += time.perf_counter() - build_start
+    # No shards are saved in a folder that does not exist, so the router
+    # pre-filters the whole index as the page does without shards.
+    router = FaissShardRouter(faiss_store, os.path.join(os.devnull, "benchmark"),
+                              metadata_index=metadata_index, bm25_index=bm25_index)
+    return router, build_seconds
+
+
+def measure_search_latency(vector_store, questions=BENCHMARK_QUESTIONS, k=10,
+                           search_filter=None, rounds=5):
+    """
+    Return the latency in ms of every search of the questions, `rounds` times.
+    vector_store is a FAISS store or a FaissShardRouter.
+    """
+    latencies = []
+    for _ in range(rounds):
+        for question in questions:
+            search_start = time.perf_counter()
+            vector_store.similarity_search_with_relevance_scores(
+                query=question, k=k, filter=search_filter, score_threshold=0.2
+            )
+            latencies.append((time.perf_counter() - search_start) * 1000)
+    return latencies
+
+
+def run_retrieval_benchmark(texts, metadatas, scales=(1,), k=10, rounds=5, size=768,
+                            filter_state="Texas", bm25=True, embeddings=None):
+    """
+    Benchmark the corpus and its synthetic copies.
+
+    Args:
+        texts (list[str]): The chunk texts, see load_pdf_corpus.
+        metadatas (list[dict]): The chunk metadata.
+        scales (tuple[int]): The sizes of the corpora, in multiples of the corpus.
+        k (int): Number of documents searched per question.
+        rounds (int): How often every question in BENCHMARK_QUESTIONS is searched.
+        size (int): Dimension of the LocalFakeEmbeddings vectors.
+        filter_state (str): The State of the filtered searches.
+        bm25 (bool): Whether the router fuses its searches with BM25 hits, as
+            on the page.
+        embeddings (Embeddings): Optional local embeddings to use instead of
+            LocalFakeEmbeddings, e.g. embedding_providers.HashingEmbeddings.
+
+    Returns:
+        list[dict]: One row per scale with the keys "Scale", "Chunks",
+            "Build s", "Vectors MB", "Memory MB" (growth of the resident memory
+            while the corpus was built), and "P50 ms", "P95 ms", "P99 ms" for
+            the searches of the FAISS store without a filter and "State P50 ms",
+            "State P95 ms", "State P99 ms" for its searches filtered on
+            filter_state. The same keys prefixed with "Router " hold the
+            latencies of the FaissShardRouter.
+    """
+    if embeddings is None:
+        embeddings = LocalFakeEmbeddings(size=size)
+    report = []
+    for scale in scales:
+        gc.collect()
+        memory_before = get_memory_mb()
+        corpus_texts, corpus_metadatas = make_synthetic_corpus(texts, metadatas, scale)
+        router, build_seconds = build_benchmark_router(
+            corpus_texts, corpus_metadatas, embeddings, bm25
+        )
+        memory_used = max(0.0, get_memory_mb() - memory_before)
+
+        row = {
+            "Scale": scale,
+            "Chunks": len(corpus_texts),
+            "Build s": build_seconds,
+            "Vectors MB": router.faiss_store.index.ntotal * router.faiss_store.index.d * 4 / 2**20,
+            "Memory MB": memory_used,
+        }
+        for store_prefix, vector_store in (("", router.faiss_store), ("Router ", router)):
+            for filter_prefix, search_filter in (("", None),
+                                                 ("State ", {"State": filter_state})):
+                latencies = measure_search_latency(
+                    vector_store, k=k, search_filter=search_filter, rounds=rounds
+                )
+                for percentile in (50, 95, 99):
+                    row[f"{store_prefix}{filter_prefix}P{percentile} ms"] = float(
+                        np.percentile(latencies, percentile)
+                    )
+        report.append(row)
+        del router, corpus_texts, corpus_metadatas
+    return report
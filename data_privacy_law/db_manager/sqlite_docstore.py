@@ -0,0 +1,653 @@
+"""
+SQLite document store of the FAISS index, saved as docstore.sqlite in place of
+the pickled docstore in index.pkl.
+Every chunk is a row keyed by its position in the FAISS index, with its
+docstore id, text, metadata as JSON, the Chunk_id, State, Type, Path and
+Page metadata in indexed columns and the bill date as an indexed day ordinal.
+The same file holds the BM25 postings, see db_manager.bm25_index, and the
+facet postings, see db_manager.metadata_index, as indexed tables, and their
+version and totals in a properties table.
+Loading an index only reads the vectors. The docstore id of a position, the
+text and metadata of a chunk and the postings of a term are read when a
+search needs them, so loading takes about as long for a large corpus as for a
+small one, and nothing is unpickled.
+
+The file is written in WAL mode into a new snapshot, see
+db_manager.index_snapshots, and never changed after it is published, so it
+is read without locks. A session that adds chunks to a loaded index keeps
+them in memory; the next save copies the saved file and appends them.
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+from urllib.request import pathname2url
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from db_manager.bm25_index import (
+    BM25_INDEX_VERSION,
+    BM25_POSTINGS_TABLE,
+    add_bm25_rows,
+    create_bm25_tables,
+    drop_bm25_tables,
+    get_total_length,
+)
+from db_manager.metadata_index import FACETS_TABLE, add_facet_rows, create_facet_table
+
+DOCSTORE_FILE = "docstore.sqlite"
+# Metadata key -> indexed column, see SQLiteDocstore.find_doc_ids.
+METADATA_COLUMNS = {
+    "Chunk_id": "chunk_id",
+    "State": "state",
+    "Type": "type",
+    "Path": "path",
+    "Page": "page",
+}
+# Bill date of the chunk as a day ordinal, see SQLiteDocstore.load_date_ordinals.
+DATE_COLUMN = "date_ordinal"
+PROPERTIES_TABLE = "properties"
+WRITE_BATCH_SIZE = 1000
+READ_BATCH_SIZE = 500
+
+
+class DocumentMap(Mapping):
+    """
+    Read-only docstore id -> Document mapping over a SQLiteDocstore, used where
+    the code reads docstore._dict of an in memory docstore. Lookups read one
+    row; items() and values() read every row once, in index order.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, doc_id):
+        doc = self.docstore.get_document(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __iter__(self):
+        return (doc_id for doc_id, _ in self.docstore.iter_documents(with_documents=False))
+
+    def __len__(self):
+        return self.docstore.count()
+
+    def items(self):
+        return self.docstore.iter_documents()
+
+    def values(self):
+        return (doc for _, doc in self.docstore.iter_documents())
+
+    def get(self, key, default=None):
+        doc = self.docstore.get_document(key)
+        return default if doc is None else doc
+
+
+class IndexToDocstoreIdMap(Mapping):
+    """
+    Position -> docstore id mapping used as the index_to_docstore_id of a FAISS
+    store loaded from a docstore.sqlite. The saved chunks hold the positions
+    0 to their count - 1, see write_docstore, and their ids are read when they
+    are looked up. Positions added since the load are kept in memory.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+        self.added = {}
+
+    def __getitem__(self, position):
+        if position in self.added:
+            return self.added[position]
+        if self.is_saved(position):
+            rows = self.docstore.query("SELECT id FROM documents WHERE position = ?",
+                                       (int(position),))
+            if rows:
+                return rows[0][0]
+        raise KeyError(position)
+
+    def __contains__(self, position):
+        return position in self.added or self.is_saved(position)
+
+    def __iter__(self):
+        yield from range(self.docstore.count_saved())
+        yield from self.added
+
+    def __len__(self):
+        return self.docstore.count_saved() + len(self.added)
+
+    def is_saved(self, position):
+        """
+        Return True if a position belongs to a saved chunk.
+        """
+        try:
+            return 0 <= int(position) < self.docstore.count_saved()
+        except (TypeError, ValueError):
+            return False
+
+    def items(self):
+        yield from self.docstore.iter_saved_ids()
+        yield from self.added.items()
+
+    def values(self):
+        return (doc_id for _, doc_id in self.items())
+
+    def update(self, positions):
+        """
+        Add position -> docstore id pairs, as FAISS does for added chunks.
+        """
+        self.added.update(positions)
+
+    def get_positions(self, doc_ids):
+        """
+        Return docstore id -> position for the ids that are in the index.
+        """
+        doc_ids = list(doc_ids)
+        positions = self.docstore.get_saved_positions(doc_ids)
+        wanted = set(doc_ids)
+        positions.update({doc_id: position for position, doc_id in self.added.items()
+                          if doc_id in wanted})
+        return positions
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore that reads the chunks of a saved index from its docstore.sqlite
+    and keeps the chunks added since in memory. Safe to share between threads.
+
+    Args:
+        db_path (str): The docstore.sqlite of a saved index, None for an empty store.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.added = {}
+        self.lock = threading.Lock()
+        self.connection = None
+        self.saved_count = None
+        self.columns = None
+        self.tables = None
+
+    def connect(self):
+        """
+        Open the saved file read-only. Returns None if the store has no file.
+        """
+        if self.db_path is None:
+            return None
+        if self.connection is None:
+            # Published files never change, so SQLite may skip locking them.
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro&immutable=1"
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        return self.connection
+
+    def query(self, sql, parameters=()):
+        """
+        Run a query on the saved file and return all rows, [] without a file.
+        """
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return []
+            return connection.execute(sql, parameters).fetchall()
+
+    def count(self):
+        """
+        Return the number of chunks, saved and added.
+        """
+        return self.count_saved() + len(self.added)
+
+    def count_saved(self):
+        """
+        Return the number of chunks in the saved file.
+        """
+        if self.saved_count is None:
+            rows = self.query("SELECT COUNT(*) FROM documents")
+            self.saved_count = rows[0][0] if rows else 0
+        return self.saved_count
+
+    def has_column(self, column):
+        """
+        Return True if the saved file has a column. Files saved by older
+        versions have no DATE_COLUMN.
+        """
+        if self.columns is None:
+            self.columns = {row[1] for row in self.query("PRAGMA table_info(documents)")}
+        return column in self.columns
+
+    def has_table(self, table):
+        """
+        Return True if the saved file has a table. Files saved by older
+        versions have no BM25, facets or properties tables.
+        """
+        if self.tables is None:
+            self.tables = {
+                name for name, in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+        return table in self.tables
+
+    def get_property(self, key):
+        """
+        Return a value of the properties table of the saved file, or None.
+        """
+        if not self.has_table(PROPERTIES_TABLE):
+            return None
+        rows = self.query(f"SELECT value FROM {PROPERTIES_TABLE} WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def add(self, texts):
+        overlapping = set(texts).intersection(self.added)
+        overlapping.update(self.get_saved_documents(list(texts)))
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self.added.update(texts)
+
+    def search(self, search):
+        doc = self.get_document(search)
+        if doc is None:
+            return f"ID {search} not found."
+        return doc
+
+    def get_document(self, doc_id):
+        """
+        Return the Document of a docstore id, or None.
+        """
+        if doc_id in self.added:
+            return self.added[doc_id]
+        return self.get_saved_documents([doc_id]).get(doc_id)
+
+    def get_documents(self, doc_ids):
+        """
+        Return docstore id -> Document for the ids that are in the store.
+        """
+        doc_ids = list(doc_ids)
+        found = {doc_id: self.added[doc_id] for doc_id in doc_ids if doc_id in self.added}
+        found.update(self.get_saved_documents(
+            [doc_id for doc_id in doc_ids if doc_id not in found]
+        ))
+        return found
+
+    def get_saved_documents(self, doc_ids):
+        """
+        Read the Documents of docstore ids from the saved file.
+        """
+        found = {}
+        for start in range(0, len(doc_ids), READ_BATCH_SIZE):
+            batch = doc_ids[start:start + READ_BATCH_SIZE]
+            rows = self.query(
+                "SELECT id, text, metadata FROM documents "
+                f"WHERE id IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for doc_id, text, metadata in rows:
+                found[doc_id] = Document(id=doc_id, page_content=text,
+                                         metadata=json.loads(metadata))
+        return found
+
+    def find_saved_ids(self, ids):
+        """
+        Return the ids that a saved chunk has as its docstore id or Chunk_id.
+        """
+        ids = [chunk_id for chunk_id in ids if chunk_id is not None]
+        found = set()
+        for start in range(0, len(ids), READ_BATCH_SIZE):
+            batch = ids[start:start + READ_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            for row in self.query(
+                f"SELECT id, chunk_id FROM documents "
+                f"WHERE id IN ({placeholders}) OR chunk_id IN ({placeholders})",
+                batch + batch,
+            ):
+                found.update(row)
+        return found.intersection(ids)
+
+    def get_saved_positions(self, doc_ids):
+        """
+        Return docstore id -> position for the ids in the saved file.
+        """
+        positions = {}
+        for start in range(0, len(doc_ids), READ_BATCH_SIZE):
+            batch = doc_ids[start:start + READ_BATCH_SIZE]
+            positions.update(self.query(
+                f"SELECT id, position FROM documents WHERE id IN ({', '.join('?' * len(batch))})",
+                batch,
+            ))
+        return positions
+
+    def iter_saved_rows(self, columns):
+        """
+        Yield the position and `columns` of every saved row in index order,
+        read in batches.
+        """
+        position = -1
+        while True:
+            rows = self.query(
+                f"SELECT position, {columns} FROM documents WHERE position > ? "
+                f"ORDER BY position LIMIT {READ_BATCH_SIZE}",
+                (position,),
+            )
+            yield from rows
+            if len(rows) < READ_BATCH_SIZE:
+                break
+            position = rows[-1][0]
+
+    def iter_saved_ids(self):
+        """
+        Yield (position, docstore id) of every saved chunk in index order.
+        """
+        return ((position, doc_id) for position, doc_id in self.iter_saved_rows("id"))
+
+    def iter_documents(self, with_documents=True):
+        """
+        Yield (docstore id, Document) for every chunk in index order, or
+        (docstore id, None) without with_documents. Rows are read in batches.
+        """
+        if with_documents:
+            for _, doc_id, text, metadata in self.iter_saved_rows("id, text, metadata"):
+                yield doc_id, Document(id=doc_id, page_content=text,
+                                       metadata=json.loads(metadata))
+        else:
+            for _, doc_id in self.iter_saved_ids():
+                yield doc_id, None
+        yield from self.added.items()
+
+    def find_doc_ids(self, key, values):
+        """
+        Return the docstore ids of the saved chunks whose metadata `key`, one
+        of METADATA_COLUMNS, is one of the string `values`, using its index.
+        Chunks added since the store was loaded are checked in memory.
+        """
+        values = list(values)
+        column = METADATA_COLUMNS[key]
+        doc_ids = [
+            doc_id for doc_id, in self.query(
+                f"SELECT id FROM documents WHERE {column} IN ({', '.join('?' * len(values))})",
+                values,
+            )
+        ]
+        doc_ids.extend(doc_id for doc_id, doc in self.added.items()
+                       if doc.metadata.get(key) in values)
+        return doc_ids
+
+    def load_date_ordinals(self):
+        """
+        Return (position, day ordinal of the bill date) of the saved chunks
+        with a readable date, read from the index of DATE_COLUMN without
+        reading the chunks. None if the file has no DATE_COLUMN.
+        """
+        if not self.has_column(DATE_COLUMN):
+            return None
+        return self.query(
+            f"SELECT position, {DATE_COLUMN} FROM documents "
+            f"INDEXED BY documents_{DATE_COLUMN} WHERE {DATE_COLUMN} IS NOT NULL"
+        )
+
+    def load_index_to_docstore_id(self):
+        """
+        Return the position -> docstore id map of the saved chunks, which
+        reads the ids when they are looked up.
+        """
+        return IndexToDocstoreIdMap(self)
+
+    def close(self):
+        """
+        Close the saved file.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    @property
+    def _dict(self):
+        """
+        The chunks as a mapping, see DocumentMap.
+        """
+        return DocumentMap(self)
+
+
+def get_documents(docstore, doc_ids):
+    """
+    Returns docstore id -> Document for the ids that are in a docstore. A
+    SQLite docstore reads them in batched queries instead of one per id.
+    """
+    if isinstance(docstore, SQLiteDocstore):
+        return docstore.get_documents(doc_ids)
+    all_docs = getattr(docstore, "_dict")
+    return {doc_id: all_docs[doc_id] for doc_id in doc_ids if doc_id in all_docs}
+
+
+def parse_bill_date(value):
+    """
+    Returns the date of a bill from its "Date" metadata (MMDDYYYY), or None
+    if it is missing or not in that format.
+    """
+    try:
+        return datetime.strptime(str(value), "%m%d%Y").date()
+    except ValueError:
+        return None
+
+
+def get_date_ordinal(value):
+    """
+    Return the bill date of a "Date" metadata value as a day ordinal, or None.
+    """
+    bill_date = parse_bill_date(value)
+    return None if bill_date is None else bill_date.toordinal()
+
+
+def get_column_value(metadata, key):
+    """
+    Return the value of an indexed column, None unless it is a string.
+    """
+    value = metadata.get(key)
+    return value if isinstance(value, str) else None
+
+
+def add_search_rows(connection, rows):
+    """
+    Write the BM25 and facet postings of chunks.
+
+    Args:
+        connection (sqlite3.Connection): The open docstore.sqlite.
+        rows (list[tuple]): (index position, text, metadata dict) of each chunk.
+    """
+    add_bm25_rows(connection, [(position, text) for position, text, _ in rows])
+    add_facet_rows(connection, [(position, metadata) for position, _, metadata in rows])
+
+
+def read_property(connection, key):
+    """
+    Return a value of the properties table of an open docstore.sqlite, or None.
+    """
+    try:
+        rows = connection.execute(
+            f"SELECT value FROM {PROPERTIES_TABLE} WHERE key = ?", (key,)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return rows[0][0] if rows else None
+
+
+def has_search_tables(connection):
+    """
+    Return True if an open docstore.sqlite has the BM25 tables of this
+    BM25_INDEX_VERSION and the facets table.
+    """
+    tables = {name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )}
+    return (
+        {BM25_POSTINGS_TABLE, FACETS_TABLE} <= tables
+        and read_property(connection, "bm25_version") == BM25_INDEX_VERSION
+    )
+
+
+def rebuild_search_tables(connection):
+    """
+    Write the BM25 and facet postings of every chunk of a copied
+    docstore.sqlite that was saved without them or with another version.
+    """
+    drop_bm25_tables(connection)
+    connection.execute(f"DROP TABLE IF EXISTS {FACETS_TABLE}")
+    create_bm25_tables(connection)
+    create_facet_table(connection)
+    position = -1
+    while True:
+        rows = connection.execute(
+            "SELECT position, text, metadata FROM documents WHERE position > ? "
+            f"ORDER BY position LIMIT {WRITE_BATCH_SIZE}",
+            (position,),
+        ).fetchall()
+        add_search_rows(connection, [(row[0], row[1], json.loads(row[2])) for row in rows])
+        if len(rows) < WRITE_BATCH_SIZE:
+            break
+        position = rows[-1][0]
+
+
+def write_docstore(docstore, index_to_docstore_id, db_path, with_search_tables=True):
+    """
+    Write the chunks of a docstore, in the order of index_to_docstore_id, to a
+    new docstore.sqlite. The saved file of a SQLiteDocstore is copied and only
+    the chunks added since are written. with_search_tables also writes their
+    BM25 and facet postings.
+    """
+    temp_path = db_path + ".tmp"
+    for path in (temp_path, temp_path + "-wal", temp_path + "-shm"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    start = 0
+    if isinstance(docstore, SQLiteDocstore) and docstore.db_path is not None:
+        saved_count = docstore.count() - len(docstore.added)
+        new_ids = [index_to_docstore_id.get(position)
+                   for position in range(saved_count, len(index_to_docstore_id))]
+        if len(new_ids) == len(docstore.added) and all(
+            doc_id in docstore.added for doc_id in new_ids
+        ):
+            shutil.copyfile(docstore.db_path, temp_path)
+            start = saved_count
+
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS documents (
+                position INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                chunk_id TEXT,
+                state TEXT,
+                type TEXT,
+                path TEXT,
+                page TEXT,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                {DATE_COLUMN} INTEGER
+            )"""
+        )
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(documents)")}
+        if DATE_COLUMN not in columns:
+            # A file copied from an older version; fill the column from the metadata.
+            connection.create_function("get_date_ordinal", 1, get_date_ordinal,
+                                       deterministic=True)
+            connection.execute(f"ALTER TABLE documents ADD COLUMN {DATE_COLUMN} INTEGER")
+            connection.execute(f"UPDATE documents SET {DATE_COLUMN} = "
+                               "get_date_ordinal(json_extract(metadata, '$.Date'))")
+            connection.commit()
+        for column in (*METADATA_COLUMNS.values(), DATE_COLUMN):
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})"
+            )
+        if with_search_tables:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {PROPERTIES_TABLE} (key TEXT PRIMARY KEY, value)"
+            )
+            if start > 0 and not has_search_tables(connection):
+                rebuild_search_tables(connection)
+            create_bm25_tables(connection)
+            create_facet_table(connection)
+        for batch_start in range(start, len(index_to_docstore_id), WRITE_BATCH_SIZE):
+            rows = []
+            docs = []
+            for position in range(batch_start,
+                                  min(batch_start + WRITE_BATCH_SIZE, len(index_to_docstore_id))):
+                doc_id = index_to_docstore_id[position]
+                doc = docstore.search(doc_id)
+                if not isinstance(doc, Document):
+                    raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+                docs.append(doc)
+                rows.append((
+                    position, doc_id,
+                    *(get_column_value(doc.metadata, key) for key in METADATA_COLUMNS),
+                    doc.page_content, json.dumps(doc.metadata, default=str),
+                    get_date_ordinal(doc.metadata.get("Date")),
+                ))
+            connection.executemany(
+                f"INSERT INTO documents (position, id, {', '.join(METADATA_COLUMNS.values())}, "
+                f"text, metadata, {DATE_COLUMN}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            if with_search_tables:
+                add_search_rows(connection, [(row[0], doc.page_content, doc.metadata)
+                                             for row, doc in zip(rows, docs)])
+            connection.commit()
+        if with_search_tables:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {PROPERTIES_TABLE} VALUES (?, ?)",
+                [("bm25_version", BM25_INDEX_VERSION),
+                 ("bm25_total_length", get_total_length(connection))],
+            )
+            connection.commit()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        connection.close()
+    os.replace(temp_path, db_path)
+
+
+def save_faiss_store(faiss_store, folder, with_search_tables=True):
+    """
+    Write a FAISS store to a folder as index.faiss and docstore.sqlite.
+    with_search_tables also saves its BM25 and facet postings, which shards,
+    only searched by vector, do without.
+    """
+    os.makedirs(folder, exist_ok=True)
+    faiss.write_index(faiss_store.index, os.path.join(folder, "index.faiss"))
+    write_docstore(faiss_store.docstore, faiss_store.index_to_docstore_id,
+                   os.path.join(folder, DOCSTORE_FILE), with_search_tables)
+
+
+def has_sqlite_docstore(folder):
+    """
+    Return True if the FAISS store in a folder was saved with save_faiss_store.
+    """
+    return os.path.isfile(os.path.join(folder, DOCSTORE_FILE))
+
+
+def load_sqlite_faiss_store(folder, embeddings):
+    """
+    Load a FAISS store saved with save_faiss_store. Only the vectors are read.
+    """
+    docstore = SQLiteDocstore(os.path.join(folder, DOCSTORE_FILE))
+    index = faiss.read_index(os.path.join(folder, "index.faiss"))
+    return FAISS(embeddings, index, docstore, docstore.load_index_to_docstore_id())
+
+
+def load_faiss_store(folder, embeddings):
+    """
+    Loads the FAISS store saved in a folder, with its docstore in
+    docstore.sqlite. Stores saved before have their docstore pickled in
+    index.pkl, which is unpickled in full.
+    """
+    if has_sqlite_docstore(folder):
+        return load_sqlite_faiss_store(folder, embeddings)
+    return FAISS.load_local(
+        folder_path=folder,
+        embeddings=embeddings,
+        allow_dangerous_deserialization=True,
+    )
@@ -0,0 +1,119 @@
+"""
+Functions for keeping the context sent to the LLM chains within a token budget.
+The chains stuff every document they are given into the prompt, so the
+documents are packed first: documents are taken in order of relevance while
+they fit the budget of the chain, the first document that does not fit is cut
+at a sentence boundary, and the documents that do not fit at all are dropped.
+Tokens are estimated locally, without calling the API.
+"""
+
+import math
+import re
+
+from langchain.docstore.document import Document
+
+# Token budgets of the variable part of the prompt of each chain: the documents,
+# the question and, for the confirmation chain, the first answer.
+CONTEXT_TOKEN_BUDGETS = {"conversational": 6000, "confirmation": 6000}
+CHARS_PER_TOKEN = 4
+# Truncated documents shorter than this are dropped instead.
+MIN_TRUNCATED_TOKENS = 50
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def estimate_tokens(text):
+    """
+    Return an estimate of the number of tokens in a text: the larger of one
+    token per 4 characters and one token per word or punctuation mark.
+    """
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / CHARS_PER_TOKEN), len(TOKEN_PATTERN.findall(text)))
+
+
+def truncate_to_sentences(text, max_tokens):
+    """
+    Return the longest start of a text that ends at a sentence boundary and
+    has at most `max_tokens` tokens, or "" if the first sentence is too long.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    truncated = ""
+    for boundary in SENTENCE_END_PATTERN.finditer(text):
+        candidate = text[:boundary.start()]
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        truncated = candidate
+    return truncated
+
+
+def get_doc_label(doc):
+    """
+    Return the chunk ids of a document, for the packing report.
+    """
+    return doc.metadata.get("Chunk_ids") or [doc.metadata.get("Chunk_id", "Unknown")]
+
+
+def pack_context(docs, token_budget, reserved_tokens=0):
+    """
+    Keep the documents that fit a token budget.
+
+    Args:
+        docs (List[Document]): The documents, most relevant first.
+        token_budget (int): The number of tokens the documents may use.
+        reserved_tokens (int): Tokens of the budget used by other inputs of
+            the chain, such as a previous answer.
+
+    Returns:
+        tuple: (the packed documents, a report dict with the keys "Budget",
+            "Used", "Kept", "Truncated" and "Dropped"; the last three list the
+            chunk ids of the documents kept whole, cut and left out)
+    """
+    remaining = max(0, token_budget - reserved_tokens)
+    packed_docs = []
+    report = {"Budget": remaining, "Used": 0, "Kept": [], "Truncated": [], "Dropped": []}
+    for doc in docs:
+        doc_tokens = estimate_tokens(doc.page_content)
+        if doc_tokens <= remaining:
+            packed_docs.append(doc)
+            report["Kept"].extend(get_doc_label(doc))
+        else:
+            text = ""
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                text = truncate_to_sentences(doc.page_content, remaining)
+            if not text:
+                report["Dropped"].extend(get_doc_label(doc))
+                continue
+            doc_tokens = estimate_tokens(text)
+            packed_docs.append(Document(page_content=text, metadata=doc.metadata))
+            report["Truncated"].extend(get_doc_label(doc))
+        remaining -= doc_tokens
+        report["Used"] += doc_tokens
+    return packed_docs, report
+
+
+def pack_chain_context(chain_name, docs, question, answer="", token_budget=None):
+    """
+    Pack the documents for one of the chains in CONTEXT_TOKEN_BUDGETS. The
+    question and the previous answer are taken out of the budget.
+
+    Args:
+        chain_name (str): "conversational" or "confirmation".
+        docs (List[Document]): The documents, most relevant first.
+        question (str): The question of the user.
+        answer (str): The previous answer, for the confirmation chain.
+        token_budget (int): Optional, replaces the budget of the chain.
+
+    Returns:
+        tuple: (the packed documents, the report of pack_context)
+    """
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGETS[chain_name]
+    reserved_tokens = estimate_tokens(question) + estimate_tokens(answer)
+    packed_docs, report = pack_context(docs, token_budget, reserved_tokens)
+    if report["Truncated"] or report["Dropped"]:
+        print(f"Context for the {chain_name} chain was cut to {report['Used']} tokens.",
+              "Truncated:", report["Truncated"], "Dropped:", report["Dropped"])
+    return packed_docs, report
@@ -1,5 +1,7 @@
 """
 This module contains functions to interact with the LLM models.
+- get_registered_chain: Returns the stuff-documents chain for a model and prompt,
+    built once per process and shared between threads.
 - parse_bill_info: Extracts bill details from a PDF file using the LLM.
 - get_conversational_chain: Sets up a QA chain using ChatGoogleGenerativeAI
     and a custom prompt template.
@@ -7,10 +9,13 @@ This module contains functions to interact with the LLM models.
     and a custom prompt template.
 - get_document_specific_summary: Generates a summary of the page based on the
     user's question.
+- summarize_page: Summarizes a single page based on the user's question.
 - generate_page_summary: Generates a summary of the page based on the user's question.
 """
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 import google.generativeai as genai
@@ -20,10 +25,58 @@ from langchain.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 from db_manager.pdf_parser import extract_text_from_pdf
+from db_manager.page_store import open_page_store
 
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+# Chains and LLM clients built so far in this process, see get_registered_chain.
+chain_registry = {}
+llm_clients = {}
+chain_registry_lock = threading.Lock()
+
+
+def get_registered_chain(
+    prompt_template, input_variables, model, temperature, system_prompt=None
+):
+    """
+    Return the stuff-documents chain for a prompt and model, building it on the
+    first call only. Chains are keyed by model, temperature, system prompt and
+    prompt, and chains with the same model settings share one
+    ChatGoogleGenerativeAI client and so one connection to the API.
+
+    Args:
+        prompt_template (str): The prompt template of the chain.
+        input_variables (list[str]): The input variables of the prompt.
+        model (str): The name of the Gemini model.
+        temperature (float): The temperature of the model.
+        system_prompt (str): Optional system prompt of the model.
+    """
+    llm_key = (model, temperature, system_prompt)
+    chain_key = (*llm_key, prompt_template, tuple(input_variables))
+    with chain_registry_lock:
+        if chain_key not in chain_registry:
+            if llm_key not in llm_clients:
+                llm_kwargs = {"model": model, "temperature": temperature}
+                if system_prompt is not None:
+                    llm_kwargs["system_prompt"] = system_prompt
+                llm_clients[llm_key] = ChatGoogleGenerativeAI(**llm_kwargs)
+            prompt = PromptTemplate(template=prompt_template, input_variables=input_variables)
+            chain_registry[chain_key] = create_stuff_documents_chain(
+                llm=llm_clients[llm_key], prompt=prompt
+            )
+        return chain_registry[chain_key]
+
+
+def clear_chain_registry():
+    """
+    Forget every chain and LLM client built so far, e.g. after the API key changes.
+    """
+    with chain_registry_lock:
+        chain_registry.clear()
+        llm_clients.clear()
+
+
 def parse_bill_info(pdf_text):
     """
     Feeds the extracted PDF text into the LLM to obtain bill details.
@@ -53,9 +106,9 @@ def parse_bill_info(pdf_text):
         Bill text:
         {context}
     """
-    model = ChatGoogleGenerativeAI(model="gemini-1.5-flash-8b", temperature=0.2)
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context"])
-    chain = create_stuff_documents_chain(llm=model, prompt=prompt)
+    chain = get_registered_chain(
+        prompt_template, ["context"], model="gemini-1.5-flash-8b", temperature=0.2
+    )
 
     doc = Document(page_content=pdf_text)
 
@@ -136,12 +189,12 @@ def parse_bill_variant_for_adding_docs(pdf_text: str, user_state: str, level_of_
         }}
     """
 
-    model = ChatGoogleGenerativeAI(model="gemini-1.5-flash-8b", temperature=0.2)
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context", "state", "lvl_law"]
+    chain = get_registered_chain(
+        prompt_template,
+        ["context", "state", "lvl_law"],
+        model="gemini-1.5-flash-8b",
+        temperature=0.2,
     )
-    chain = create_stuff_documents_chain(llm=model, prompt=prompt)
 
     doc = Document(page_content=pdf_text)
 
@@ -220,7 +273,9 @@ def get_conversational_chain():
 
         Answer:
     """
-    model = ChatGoogleGenerativeAI(
+    return get_registered_chain(
+        prompt_template,
+        ["context", "question"],
         model="gemini-2.0-flash-001",
         temperature=0.2,
         system_prompt=(
@@ -228,10 +283,6 @@ def get_conversational_chain():
             bullet points for the main body of the response, and a conclusion"""
         ),
     )
-    prompt = PromptTemplate(
-        template=prompt_template, input_variables=["context", "question"]
-    )
-    return create_stuff_documents_chain(llm=model, prompt=prompt)
 
 
 def get_confirmation_result_chain():
@@ -267,7 +318,9 @@ THERE MUST BE AN INTRODUCTION AND CONCLUSION part to your response no matter wha
 
         Answer:
     """
-    model = ChatGoogleGenerativeAI(
+    return get_registered_chain(
+        prompt_template,
+        ["context", "question", "answer"],
         model="gemini-2.0-flash-001",
         temperature=0.2,
         system_prompt=(
@@ -275,10 +328,6 @@ THERE MUST BE AN INTRODUCTION AND CONCLUSION part to your response no matter wha
             bullet points, and a conclusion"""
         ),
     )
-    prompt = PromptTemplate(
-        template=prompt_template, input_variables=["context", "question", "answer"]
-    )
-    return create_stuff_documents_chain(llm=model, prompt=prompt)
 
 
 def get_document_specific_summary():
@@ -296,26 +345,60 @@ def get_document_specific_summary():
     {context}
     Summary:
     """
-    model = ChatGoogleGenerativeAI(
+    return get_registered_chain(
+        prompt_template,
+        ["context", "question"],
         model="gemini-2.0-flash-001",
         temperature=0.2,
         system_prompt=("""You only have knowledge based on the provided text."""),
     )
-    prompt = PromptTemplate(
-        template=prompt_template, input_variables=["context", "question"]
-    )
-    return create_stuff_documents_chain(llm=model, prompt=prompt)
 
 
-def generate_page_summary(chunk_ids_with_metadata, user_question):
+def summarize_page(title, page_text, page_num, pdf_path, user_question):
+    """
+    Summarize one page for the user's question and return its record.
+    If the LLM call fails the record is kept with empty relevant information
+    and marked as failed, so one failing page does not lose the summaries of
+    the others and the caller can tell the records are incomplete.
+    """
+    failed = False
+    try:
+        page_information = get_document_specific_summary().invoke(
+            {
+                "context": [Document(page_content=page_text)],
+                "question": user_question,
+            }
+        )
+    except Exception as summary_error:  # pylint: disable=broad-exception-caught
+        print(f"Error summarizing page {page_num} of {pdf_path}:", summary_error)
+        page_information = ""
+        failed = True
+    return {
+        "Document": title,
+        "Page": page_num,
+        "Relevant Information": page_information if page_information else "",
+        "File Path": pdf_path,
+        "Failed": failed,
+    }
+
+
+def generate_page_summary(
+    chunk_ids_with_metadata, user_question, page_store=None, max_concurrency=4
+):
     """
     This function generates a summary of the page based on the user's question.
+    The page texts are read from the page store written at ingest time; a PDF
+    is only parsed when its pages are not in the store. The pages are
+    summarized concurrently and the records keep the order of the input,
+    grouped by PDF.
     Args:
         chunk_ids_with_metadata (list): A list of tuples containing:
             - pdf_path (str): The path to the PDF file
             - doc_title (str): The title of the document
             - page_num (int): The page number of the document
         user_question (str): The question posed by the user to analyze the Documents
+        page_store (PageStore): Optional, defaults to the shared store of the index.
+        max_concurrency (int): Maximum number of summaries requested at once.
     """
     if not isinstance(chunk_ids_with_metadata, list):
         raise TypeError("chunk_ids_with_metadata must be a list")
@@ -323,37 +406,38 @@ def generate_page_summary(chunk_ids_with_metadata, user_question):
     if not isinstance(user_question, str):
         raise TypeError("user_question must be a string")
 
-    records = []
-    unique_pdf_paths = set(pdf_path for pdf_path, _, _ in chunk_ids_with_metadata)
-    unique_pdf_paths_list = list(unique_pdf_paths)
+    if page_store is None:
+        page_store = open_page_store()
+
+    pages_to_summarize = []
+    unique_pdf_paths_list = list(
+        dict.fromkeys(pdf_path for pdf_path, _, _ in chunk_ids_with_metadata)
+    )
     for pdf_path in unique_pdf_paths_list:
-        all_pdf_pages = extract_text_from_pdf(pdf_path)
+        all_pdf_pages = None
         for path, title, page_num in chunk_ids_with_metadata:
-            for i, page_text in enumerate(all_pdf_pages):
-                if (i + 1 == int(page_num)) and (path == pdf_path):
-                    chunk_pdf_pages = []
-                    chunk_pdf_pages.append(title)
-                    chunk_pdf_pages.append(page_text)
-                    chunk_pdf_pages.append(page_num)
-                    # st.write(f"Chunk PDF Pages: {chunk_pdf_pages}")
-                    page_information = get_document_specific_summary().invoke(
-                        {
-                            "context": [Document(page_content=chunk_pdf_pages[1])],
-                            "question": user_question,
-                        }
-                    )
-                    if page_information:
-                        chunk_pdf_pages.append(page_information)
-                    else:
-                        chunk_pdf_pages.append("")
-                    records.append(
-                        {
-                            "Document": chunk_pdf_pages[0],
-                            "Page": chunk_pdf_pages[2],
-                            "Relevant Information": chunk_pdf_pages[3],
-                            "File Path": pdf_path,
-                        }
-                    )
+            if path != pdf_path:
+                continue
+            page_text = page_store.get_page(pdf_path, page_num)
+            if page_text is None:
+                # Fall back to parsing the PDF, once per PDF.
+                if all_pdf_pages is None:
+                    all_pdf_pages = extract_text_from_pdf(pdf_path)
+                if not 1 <= int(page_num) <= len(all_pdf_pages):
+                    continue
+                page_text = all_pdf_pages[int(page_num) - 1]
+            pages_to_summarize.append((title, page_text, page_num, pdf_path))
+
+    if not pages_to_summarize:
+        return []
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_concurrency, len(pages_to_summarize)))
+    ) as executor:
+        records = list(executor.map(
+            lambda page: summarize_page(*page, user_question), pages_to_summarize
+        ))
+
     for record in records:
         if not all(
             key in record
@@ -1,12 +1,36 @@
 """
 Parse PDF in selected folders and add into FAISS database.
-Usage: python parse_bills.py -s <state1> -s <state2> ...
+Usage: python parse_bills.py -s <state1> -s <state2> ... [-w <workers>]
 -s <state1> -s <state2> ...: Specify the state folders to parse. Enter 'all' for all available.
+-w <workers>: Number of processes used to extract text from the PDFs. Default is 1.
+--force: Parse every PDF again, even the ones the ingest manifest marks as unchanged.
+--checkpoint-every <n>: Save the FAISS index after every n PDFs. By default it is saved once at the end.
+--embed-batch-size <n>: Number of chunks per embedding request. Default is 100.
+--embed-concurrency <n>: Maximum number of embedding requests in flight. Default is 4.
+--index-type <type>: Rebuild the FAISS index as Flat, IVF, HNSW or IVF-PQ. By default the type is kept.
+--shards: Also keep one FAISS index per state (plus Comprehensive, Federal and GDPR) up to date.
+    Questions about one state then only search that state's index.
+--embedding-provider <name>: Embed with gemini, local-hashing or local-fake. By default the
+    EMBEDDING_PROVIDER environment variable is used, or gemini. An index can only be extended
+    and searched with the provider that built it.
 """
 import os
 import argparse
 
-from db_manager.faiss_db_manager import add_bills_to_faiss_index, write_bill_info_to_csv
+from db_manager.faiss_db_manager import (
+    FaissIngestSession,
+    add_bills_to_faiss_index,
+    write_bill_info_to_csv,
+)
+from db_manager.faiss_shards import has_faiss_shards
+from db_manager.index_types import INDEX_TYPES
+from db_manager.index_snapshots import resolve_snapshot_folder
+from db_manager.embedding_providers import EMBEDDING_PROVIDERS
+from db_manager.ingest_manifest import (
+    get_manifest_key,
+    load_ingest_manifest,
+    save_ingest_manifest,
+)
 
 us_states = [
     "Alabama",
@@ -70,6 +94,23 @@ def get_args():
     parser.add_argument("-s", "--states", required=True, action="append", type=str,
                         help="Which folder's bill PDF would you like to parse?\
                               Enter 'all' for all available.")
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help="Number of processes used to extract text from the PDFs.")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore the ingest manifest and parse every PDF again.")
+    parser.add_argument("--checkpoint-every", default=None, type=int,
+                        help="Save the FAISS index after this many PDFs.")
+    parser.add_argument("--embed-batch-size", default=100, type=int,
+                        help="Number of chunks per embedding request.")
+    parser.add_argument("--embed-concurrency", default=4, type=int,
+                        help="Maximum number of embedding requests in flight.")
+    parser.add_argument("--index-type", default=None, choices=INDEX_TYPES,
+                        help="Type of the FAISS index. By default the current type is kept.")
+    parser.add_argument("--shards", action="store_true",
+                        help="Also write one FAISS index per partition.")
+    parser.add_argument("--embedding-provider", default=None, choices=list(EMBEDDING_PROVIDERS),
+                        help="Embedding provider of the index. By default the "
+                             "EMBEDDING_PROVIDER environment variable, or gemini.")
     return parser.parse_args()
 
 def main():
@@ -92,6 +133,7 @@ def main():
         state_inputs.remove("all")
 
     print(f"Processed list: [{", ".join(state_inputs)}]")
+    all_pdf_paths = []
     for state_input in state_inputs:
         state_input = state_input.strip().capitalize()
 
@@ -118,8 +160,34 @@ def main():
             print(f"No PDF files found in folder: {pdfs_folder}")
             continue
 
-        # Process the list of PDF paths and write into csv.
-        bill_info_list = add_bills_to_faiss_index(pdf_paths)
+        all_pdf_paths.extend(pdf_paths)
+
+    # The manifest only describes what is in the index, so start over when
+    # the index was deleted. --force drops the entries of the selected PDFs.
+    manifest = {}
+    if os.path.exists(os.path.join(resolve_snapshot_folder(), "index.faiss")):
+        manifest = load_ingest_manifest()
+    if args.force:
+        for pdf_path in all_pdf_paths:
+            manifest.pop(get_manifest_key(pdf_path), None)
+
+    # Process all of the PDF paths in one batch, so the workers are shared
+    # across folders, and write into csv.
+    if all_pdf_paths:
+        with FaissIngestSession(
+            checkpoint_every=args.checkpoint_every,
+            batch_size=args.embed_batch_size,
+            max_concurrency=args.embed_concurrency,
+            write_shards=args.shards or has_faiss_shards(resolve_snapshot_folder()),
+            index_type=args.index_type,
+            embedding_provider=args.embedding_provider,
+        ) as session:
+            bill_info_list = add_bills_to_faiss_index(
+                all_pdf_paths, workers=args.workers, manifest=manifest, session=session
+            )
+        # Only saved once the session has embedded and saved every chunk. After
+        # a failure the PDFs are parsed again and their chunk ids deduplicated.
+        save_ingest_manifest(manifest)
         write_bill_info_to_csv(bill_info_list)
 
 if __name__ == "__main__":
@@ -3,25 +3,106 @@ Unittest for the functions in db_manager
 including test pdf extraction
 """
 
+import gc
+import json
 import os
+import sqlite3
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import date
 from io import StringIO
 
 import unittest
 from unittest.mock import patch, MagicMock
 
+import faiss
+import numpy as np
 import google.generativeai as genai
+from langchain_community.vectorstores import FAISS
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 
 from db_manager.pdf_parser import (extract_text_from_pdf,
+    extract_texts_in_parallel,
     chunk_pdf_pages)
-from db_manager.faiss_db_manager import (add_chunk_to_faiss_index,
+from db_manager.faiss_db_manager import (FaissIngestSession,
+    add_chunk_to_faiss_index,
     add_bills_to_faiss_index,
     map_chunk_to_metadata,
     load_faiss_index,
+    get_faiss_index_version,
     obtain_text_of_chunk,
+    obtain_texts_of_chunks,
     calculate_updated_chunk_ids,
     write_bill_info_to_csv)
+from db_manager.faiss_prefilter import FaissPrefilter
+from db_manager.faiss_shards import (FaissShardRouter,
+    build_faiss_shards,
+    get_partition_key,
+    get_shard_folder,
+    load_shard_partitions)
+
+from db_manager.embedding_cache import CachedQueryEmbeddings, EmbeddingCache
+from db_manager.embedding_pipeline import (embed_texts_in_batches,
+    is_quota_error,
+    LocalFakeEmbeddings)
+from db_manager.embedding_providers import (HashingEmbeddings,
+    create_embeddings,
+    get_embedding_provider_info,
+    load_embedding_provider_info,
+    save_embedding_provider_info)
+from db_manager.answer_cache import AnswerCache
+from db_manager.context_assembly import assemble_context, merge_texts
+from db_manager.bm25_index import (build_bm25_index,
+    has_identifier,
+    is_identifier_query,
+    load_bm25_index,
+    reciprocal_rank_fusion,
+    search_bm25_index,
+    tokenize,
+    SQLiteBM25Index)
+from db_manager.index_types import (INDEX_TYPES,
+    compare_index_types,
+    convert_faiss_index,
+    create_faiss_index,
+    get_index_type)
+from db_manager.index_snapshots import (SnapshotPin,
+    collect_snapshots,
+    get_current_generation,
+    list_generations,
+    pin_snapshot,
+    publish_snapshot,
+    resolve_snapshot_folder)
+from db_manager.ingest_queue import (IndexWriteLock,
+    enqueue_batch,
+    list_queued_batches,
+    submit_chunks,
+    QUEUED,
+    SAVED)
+from db_manager.page_store import PageStore
+from db_manager.sqlite_docstore import (IndexToDocstoreIdMap,
+    SQLiteDocstore,
+    load_faiss_store,
+    save_faiss_store)
+from db_manager.retrieval_benchmark import (get_pdf_bill_info,
+    make_synthetic_corpus,
+    run_retrieval_benchmark)
+from db_manager.metadata_index import (add_to_metadata_index,
+    build_metadata_index,
+    create_metadata_index,
+    get_bills_of_state,
+    get_doc_ids_for_facet,
+    get_doc_id_for_chunk,
+    load_metadata_index,
+    save_metadata_index)
+from db_manager.ingest_manifest import (load_ingest_manifest,
+    save_ingest_manifest,
+    get_unchanged_bill_info,
+    record_bill_in_manifest)
 
 from llm_manager.llm_manager import parse_bill_info
 
@@ -89,6 +170,17 @@ class TestPDFExtraction(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             extract_text_from_pdf(temp_pdf_path)
 
+    def test_pdf_extraction_in_parallel(self):
+        """
+        Test the process pool gives the same pages as the serial extraction.
+        """
+        pdf_paths = [self.temp_pdf_path, "./pdfs/Texas/HB 186 Social_media_children.pdf"]
+        results = dict(extract_texts_in_parallel(pdf_paths, workers=2))
+        self.assertCountEqual(results.keys(), pdf_paths)
+        for pdf_path in pdf_paths:
+            self.assertEqual(results[pdf_path], extract_text_from_pdf(pdf_path))
+        self.assertEqual(list(extract_texts_in_parallel([], workers=2)), [])
+
 
 class TestDBManager(unittest.TestCase):
     """
@@ -215,8 +307,43 @@ class TestFAISSIndex(unittest.TestCase):
     General unittests for faiss index related functions.
     """
 
+    def setUp(self):
+        """
+        FAISS is mocked in these tests, so the files saved next to it and the
+        snapshot folders are not written, the index in the repository is
+        neither migrated nor pinned, and the write lock and queue are kept in
+        a temporary folder.
+        """
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        patcher = patch("db_manager.ingest_queue.get_ingest_folder", return_value=temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.save_metadata_index")
+        self.mock_save_metadata_index = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.save_embedding_provider_info")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.save_faiss_store")
+        self.mock_save_faiss_store = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.begin_snapshot")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.publish_snapshot")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.migrate_legacy_index")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("db_manager.faiss_db_manager.pin_snapshot",
+                        side_effect=lambda faiss_folder: SnapshotPin(faiss_folder, 0, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch("db_manager.faiss_db_manager.FAISS")
-    @patch("db_manager.faiss_db_manager.GoogleGenerativeAIEmbeddings")
+    @patch("db_manager.embedding_providers.GoogleGenerativeAIEmbeddings")
     @patch("db_manager.faiss_db_manager.os.path.exists")
     @patch("db_manager.faiss_db_manager.calculate_updated_chunk_ids")
     def test_add_chunk_to_faiss_index_create_new(
@@ -238,10 +365,12 @@ class TestFAISSIndex(unittest.TestCase):
 
         # Mock embeddings
         mock_embeddings.return_value = MagicMock()
+        mock_embeddings.return_value.embed_documents.side_effect = (
+            lambda texts: [[0.1, 0.2] for _ in texts])
 
         # Mock FAISS
         mock_faiss_instance = MagicMock()
-        mock_faiss.from_texts.return_value = mock_faiss_instance
+        mock_faiss.from_embeddings.return_value = mock_faiss_instance
 
         # Run the function
         add_chunk_to_faiss_index(
@@ -249,16 +378,17 @@ class TestFAISSIndex(unittest.TestCase):
         )
 
         # Check if FAISS was called to create a new index
-        mock_faiss.from_texts.assert_called_once()
-        mock_faiss_instance.save_local.assert_called_once()
+        mock_faiss.from_embeddings.assert_called_once()
+        self.mock_save_faiss_store.assert_called_once()
 
 
+    @patch("db_manager.sqlite_docstore.FAISS")
     @patch("db_manager.faiss_db_manager.FAISS")
-    @patch("db_manager.faiss_db_manager.GoogleGenerativeAIEmbeddings")
+    @patch("db_manager.embedding_providers.GoogleGenerativeAIEmbeddings")
     @patch("db_manager.faiss_db_manager.os.path.exists")
     @patch("db_manager.faiss_db_manager.calculate_updated_chunk_ids")
     def test_add_chunk_to_faiss_index_load_and_add_texts(
-        self, mock_chunks, mock_exists, mock_embeddings, mock_faiss
+        self, mock_chunks, mock_exists, mock_embeddings, mock_faiss, mock_load_faiss
     ):
         """
         Test whether add_chunk_to_faiss_index can load existing index and add texts properly
@@ -268,6 +398,7 @@ class TestFAISSIndex(unittest.TestCase):
             mock_exists: mock patch for os.path.exists
             mock_embeddings: mock patch for GoogleGenerativeAIEmbeddings
             mock_faiss: mock patch for FAISS
+            mock_load_faiss: mock patch for FAISS where the index is loaded
         """
 
         mock_chunks.return_value = [{"Chunk_id": "456"}]
@@ -275,30 +406,34 @@ class TestFAISSIndex(unittest.TestCase):
 
         # Mock embeddings
         mock_embeddings.return_value = MagicMock()
+        mock_embeddings.return_value.embed_documents.side_effect = (
+            lambda texts: [[0.1, 0.2] for _ in texts])
 
         # Mock FAISS load
         mock_faiss_instance = MagicMock()
         setattr(mock_faiss_instance.docstore, "_dict", {"123": "123"})
-        mock_faiss.load_local.return_value = mock_faiss_instance
+        mock_load_faiss.load_local.return_value = mock_faiss_instance
 
         add_chunk_to_faiss_index(["new chunk"], [{"Chunk_id": "456"}])  # New ID
-        mock_faiss.load_local.assert_called_once()
+        mock_load_faiss.load_local.assert_called_once()
 
         # Check if FAISS was called to create a add new index
-        mock_faiss_instance.add_texts.assert_called_once_with(
-            texts=["new chunk"], metadatas=[{"Chunk_id": "456"}], ids=["456"]
+        mock_faiss_instance.add_embeddings.assert_called_once_with(
+            text_embeddings=[("new chunk", [0.1, 0.2])],
+            metadatas=[{"Chunk_id": "456"}], ids=["456"]
 
 
         )
-        mock_faiss_instance.save_local.assert_called_once()
+        self.mock_save_faiss_store.assert_called_once()
 
 
+    @patch("db_manager.sqlite_docstore.FAISS")
     @patch("db_manager.faiss_db_manager.FAISS")
-    @patch("db_manager.faiss_db_manager.GoogleGenerativeAIEmbeddings")
+    @patch("db_manager.embedding_providers.GoogleGenerativeAIEmbeddings")
     @patch("db_manager.faiss_db_manager.os")
     @patch("db_manager.faiss_db_manager.calculate_updated_chunk_ids")
     def test_add_chunk_to_faiss_index_load_error(
-        self, mock_chunks, mock_exists, mock_embeddings, mock_faiss
+        self, mock_chunks, mock_exists, mock_embeddings, mock_faiss, mock_load_faiss
     ):
         """
         Test whether add_chunk_to_faiss_index can handle load errors properly
@@ -308,6 +443,7 @@ class TestFAISSIndex(unittest.TestCase):
             mock_exists: mock patch for os.path.exists
             mock_embeddings: mock patch for GoogleGenerativeAIEmbeddings
             mock_faiss: mock patch for FAISS
+            mock_load_faiss: mock patch for FAISS where the index is loaded
         """
 
         with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
@@ -317,24 +453,77 @@ class TestFAISSIndex(unittest.TestCase):
             mock_exists.return_value = True
             # Mock embeddings
             mock_embeddings.return_value = MagicMock()
+            mock_embeddings.return_value.embed_documents.side_effect = (
+                lambda texts: [[0.1, 0.2] for _ in texts])
 
             # Mock OSError when loading FAISS
-            mock_faiss.load_local.side_effect = OSError("Failed to load index")
+            mock_load_faiss.load_local.side_effect = OSError("Failed to load index")
 
-            # Mock FAISS.from_texts to handle new index creation
+            # Mock FAISS.from_embeddings to handle new index creation
             mock_faiss_instance = MagicMock()
-            mock_faiss.from_texts.return_value = mock_faiss_instance
+            mock_faiss.from_embeddings.return_value = mock_faiss_instance
 
             add_chunk_to_faiss_index(["test chunk"], [{"Chunk_id": "789"}])
 
             # Ensure a try except and new FAISS index was created
-            mock_faiss.load_local.assert_called_once()
-            mock_faiss.from_texts.assert_called_once()
-            mock_faiss_instance.save_local.assert_called_once()
+            mock_load_faiss.load_local.assert_called_once()
+            mock_faiss.from_embeddings.assert_called_once()
+            self.mock_save_faiss_store.assert_called_once()
 
 
+    @patch("db_manager.sqlite_docstore.FAISS")
     @patch("db_manager.faiss_db_manager.FAISS")
-    @patch("db_manager.faiss_db_manager.GoogleGenerativeAIEmbeddings")
+    @patch("db_manager.embedding_providers.GoogleGenerativeAIEmbeddings")
+    @patch("db_manager.faiss_db_manager.os.path.exists")
+    def test_faiss_ingest_session(self, mock_exists, mock_embeddings, mock_faiss,
+                                  mock_load_faiss):
+        """
+        Test FaissIngestSession loads and saves the index once for many documents.
+
+        Args:
+            mock_exists: mock patch for os.path.exists
+            mock_embeddings: mock patch for GoogleGenerativeAIEmbeddings
+            mock_faiss: mock patch for FAISS
+            mock_load_faiss: mock patch for FAISS where the index is loaded
+        """
+        mock_exists.return_value = True
+        mock_embeddings.return_value = MagicMock()
+        mock_embeddings.return_value.embed_documents.side_effect = (
+            lambda texts: [[0.1, 0.2] for _ in texts])
+        mock_faiss_instance = MagicMock()
+        setattr(mock_faiss_instance.docstore, "_dict", {"T_Page_1_ChunkNo_0": "doc"})
+        mock_load_faiss.load_local.return_value = mock_faiss_instance
+
+        with FaissIngestSession() as session:
+            session.add_chunks(["old", "new"], [{"Title": "T", "Page": "1"},
+                                                {"Title": "T", "Page": "1"}])
+            session.add_chunks(["other"], [{"Title": "U", "Page": "1"}])
+            # Adding the same document again adds nothing
+            session.add_chunks(["other"], [{"Title": "U", "Page": "1"}])
+            self.mock_save_faiss_store.assert_not_called()
+
+        mock_load_faiss.load_local.assert_called_once()
+        # Chunks of both documents are embedded and added together
+        mock_faiss_instance.add_embeddings.assert_called_once()
+        self.assertEqual(mock_faiss_instance.add_embeddings.call_args.kwargs["ids"],
+                         ["T_Page_1_ChunkNo_1", "U_Page_1_ChunkNo_0"])
+        self.mock_save_faiss_store.assert_called_once()
+        metadata_index = self.mock_save_metadata_index.call_args.args[0]
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "Topics", "Any"), [])
+        self.assertEqual(metadata_index["Count"], 3)
+
+        # Checkpoints save during the session as well
+        mock_faiss_instance.reset_mock()
+        self.mock_save_faiss_store.reset_mock()
+        with FaissIngestSession(checkpoint_every=1) as session:
+            session.add_chunks(["a"], [{"Title": "V", "Page": "1"}])
+            session.add_chunks(["b"], [{"Title": "W", "Page": "1"}])
+            self.assertEqual(self.mock_save_faiss_store.call_count, 2)
+        self.assertEqual(self.mock_save_faiss_store.call_count, 2)
+
+
+    @patch("db_manager.sqlite_docstore.FAISS")
+    @patch("db_manager.embedding_providers.GoogleGenerativeAIEmbeddings")
     def test_load_faiss_index(self, mock_embeddings, mock_faiss):
         """
         Test whether load_faiss_index works properly
@@ -353,6 +542,23 @@ class TestFAISSIndex(unittest.TestCase):
         mock_faiss.load_local.assert_called_once()
 
 
+    def test_get_faiss_index_version(self):
+        """
+        Test the index version changes when the index files are saved again.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(get_faiss_index_version(temp_dir), (None, None))
+            for file_name in ("index.faiss", "index.pkl"):
+                with open(os.path.join(temp_dir, file_name), "wb") as index_file:
+                    index_file.write(b"index")
+            first_version = get_faiss_index_version(temp_dir)
+            self.assertEqual(get_faiss_index_version(temp_dir), first_version)
+
+            with open(os.path.join(temp_dir, "index.pkl"), "wb") as index_file:
+                index_file.write(b"new index")
+            self.assertNotEqual(get_faiss_index_version(temp_dir), first_version)
+
+
     @patch("db_manager.faiss_db_manager.load_faiss_index")
     def test_obtain_text_of_chunk(self, mock_load_faiss):
         """
@@ -388,6 +594,33 @@ class TestFAISSIndex(unittest.TestCase):
         setattr(mock_faiss_instance.docstore, "_dict", {"Chunk_id_1": mock_doc1})
         self.assertEqual(obtain_text_of_chunk(1), "")
 
+    @patch("db_manager.faiss_db_manager.load_faiss_index")
+    def test_obtain_texts_of_chunks(self, mock_load_faiss):
+        """
+        Test chunk ids are resolved through the Chunk_id map of a loaded store.
+        """
+        faiss_store = MagicMock()
+        setattr(faiss_store.docstore, "_dict", {
+            "uuid1": MagicMock(metadata={"Chunk_id": "Bill_Page_1_ChunkNo_0"},
+                               page_content="first"),
+            "uuid2": MagicMock(metadata={"Chunk_id": "Bill_Page_1_ChunkNo_1"},
+                               page_content="second"),
+        })
+        metadata_index = build_metadata_index(faiss_store)
+        self.assertEqual(get_doc_id_for_chunk(metadata_index, "Bill_Page_1_ChunkNo_1"), "uuid2")
+
+        texts = obtain_texts_of_chunks(
+            ["Bill_Page_1_ChunkNo_1", "Bill_Page_1_ChunkNo_0", "Missing"],
+            faiss_store, metadata_index,
+        )
+        self.assertEqual(texts, {"Bill_Page_1_ChunkNo_1": "second",
+                                 "Bill_Page_1_ChunkNo_0": "first",
+                                 "Missing": None})
+        self.assertEqual(
+            obtain_text_of_chunk("Bill_Page_1_ChunkNo_0", faiss_store, metadata_index), "first"
+        )
+        mock_load_faiss.assert_not_called()
+
 
     @patch("db_manager.faiss_db_manager.add_chunk_to_faiss_index")
     @patch("db_manager.faiss_db_manager.chunk_pdf_pages")
@@ -413,6 +646,1329 @@ class TestFAISSIndex(unittest.TestCase):
             self.assertEqual(mock_chunk_pdf.call_count, len(pdf_paths))
             self.assertEqual(mock_add_chunk.call_count, len(pdf_paths))
 
+    @patch("db_manager.faiss_db_manager.add_chunk_to_faiss_index")
+    @patch("db_manager.faiss_db_manager.chunk_pdf_pages")
+    @patch("db_manager.faiss_db_manager.parse_bill_info")
+    @patch("db_manager.faiss_db_manager.extract_texts_in_parallel")
+    def test_add_bills_to_faiss_index_workers(
+        self, mock_parallel, mock_parse_bill, mock_chunk_pdf, mock_add_chunk
+    ):
+        """
+        Test add_bills_to_faiss_index uses the process pool and keeps the input order.
+        """
+        with patch("sys.stdout", new_callable=StringIO):
+            pdf_paths = ["a/b/path_1", "a/b/path_2", "a/b/path_3"]
+            # Pool yields in completion order
+            mock_parallel.return_value = iter([
+                ("a/b/path_3", ["page"]),
+                ("a/b/path_1", ["page"]),
+                ("a/b/path_2", ["page"]),
+            ])
+            mock_parse_bill.side_effect = lambda text: {"Title": "Bill"}
+            mock_chunk_pdf.side_effect = lambda pages, pdf_path: ([pdf_path], [{}])
+            bill_info_list = add_bills_to_faiss_index(pdf_paths, workers=3)
+            mock_parallel.assert_called_once_with(pdf_paths, 3)
+            self.assertEqual(mock_add_chunk.call_count, len(pdf_paths))
+            # Chunks are added in input order, as in a serial run.
+            self.assertEqual([call.args[0] for call in mock_add_chunk.call_args_list],
+                             [[pdf_path] for pdf_path in pdf_paths])
+            self.assertEqual([info["Filename"] for info in bill_info_list],
+                             ["path_1", "path_2", "path_3"])
+
+
+class TestFaissPrefilter(unittest.TestCase):
+    """
+    Unittests for the pre-filtered search, on a small local index.
+    """
+
+    def setUp(self):
+        self.embeddings = LocalFakeEmbeddings(size=16)
+        states = ["Texas", "Washington", "Florida", "Alabama"]
+        texts = [f"chunk {ind}" for ind in range(40)]
+        metadatas = [
+            {"State": states[ind % 4], "Sector": "Health" if ind % 5 == 0 else "Finance",
+             "Date": f"0101{2020 + ind % 6}", "Title": f"Bill {ind}"}
+            for ind in range(40)
+        ]
+        self.faiss_store = FAISS.from_embeddings(
+            list(zip(texts, self.embeddings.embed_documents(texts))),
+            self.embeddings, metadatas=metadatas,
+        )
+        self.prefilter = FaissPrefilter(self.faiss_store)
+
+    def brute_force(self, query, keep, k):
+        """
+        Return the contents of the k nearest chunks that pass `keep`.
+        """
+        results = self.faiss_store.similarity_search_with_score(query, k=40)
+        return [doc.page_content for doc, _ in results if keep(doc.metadata)][:k]
+
+    def test_select(self):
+        """
+        Test facet, date and predicate conditions are combined.
+        """
+        positions = self.prefilter.select({"State": "Texas", "Sector": ["Health"]})
+        self.assertEqual(positions.tolist(), [0, 20])
+        positions = self.prefilter.select(date_from=date(2024, 1, 1),
+                                          predicate=lambda meta: meta["State"] == "Texas")
+        self.assertEqual(positions.tolist(), [4, 16, 28])
+        self.assertEqual(len(self.prefilter.select()), 40)
+
+    def test_prefiltered_search_returns_k_hits(self):
+        """
+        Test the search returns exactly k hits that match the filter, the same
+        as a brute force search over the matching chunks.
+        """
+        results = self.prefilter.similarity_search_with_score(
+            "chunk 7", k=5, metadata_filter={"State": "Washington"})
+        self.assertEqual(len(results), 5)
+        self.assertEqual({doc.metadata["State"] for doc, _ in results}, {"Washington"})
+        self.assertEqual([doc.page_content for doc, _ in results],
+                         self.brute_force("chunk 7", lambda meta: meta["State"] == "Washington", 5))
+
+        # A very selective filter still finds its chunks
+        results = self.prefilter.similarity_search_with_score(
+            "chunk 7", k=5, metadata_filter={"State": "Texas", "Sector": "Health"})
+        self.assertEqual(sorted(doc.page_content for doc, _ in results),
+                         ["chunk 0", "chunk 20"])
+        self.assertEqual(self.prefilter.similarity_search_with_score(
+            "chunk 7", metadata_filter={"State": "Ohio"}), [])
+
+    def test_prefiltered_search_with_id_selector(self):
+        """
+        Test an index that is not flat is searched with an IDSelector.
+        """
+        flat_index = self.faiss_store.index
+        hnsw_index = faiss.IndexHNSWFlat(flat_index.d, 16)
+        hnsw_index.hnsw.efSearch = 64
+        hnsw_index.add(flat_index.reconstruct_n(0, flat_index.ntotal))
+        self.faiss_store.index = hnsw_index
+
+        results = self.prefilter.similarity_search_with_score(
+            "chunk 3", k=4, metadata_filter={"State": ["Texas", "Florida"]})
+        self.assertEqual([doc.page_content for doc, _ in results],
+                         self.brute_force(
+                             "chunk 3", lambda meta: meta["State"] in ("Texas", "Florida"), 4))
+
+
+class TestIndexTypes(unittest.TestCase):
+    """
+    Unittests for the selectable FAISS index types.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((400, 16)).astype(np.float32)
+
+    def test_create_each_index_type(self):
+        """
+        Test every type holds the vectors and finds a stored vector first.
+        """
+        for index_type in INDEX_TYPES:
+            index = create_faiss_index(index_type, self.vectors)
+            self.assertEqual(get_index_type(index), index_type)
+            self.assertEqual(index.ntotal, 400)
+            if index_type != "IVF-PQ":
+                _, labels = index.search(self.vectors[7:8], 1)
+                self.assertEqual(labels[0][0], 7)
+        with self.assertRaises(ValueError):
+            create_faiss_index("LSH", self.vectors)
+
+    def test_convert_keeps_vector_order(self):
+        """
+        Test a converted index keeps the positions, so the docstore mapping holds.
+        """
+        flat_index = create_faiss_index("Flat", self.vectors)
+        ivf_index = convert_faiss_index(flat_index, "IVF")
+        self.assertEqual(get_index_type(ivf_index), "IVF")
+        self.assertIs(convert_faiss_index(ivf_index, "IVF"), ivf_index)
+        hnsw_index = convert_faiss_index(ivf_index, "HNSW")
+        np.testing.assert_allclose(hnsw_index.reconstruct_n(0, 400), self.vectors)
+
+    def test_compare_index_types(self):
+        """
+        Test the report has a row per type and Flat has perfect recall.
+        """
+        report = compare_index_types(self.vectors, self.vectors[:20], ("Flat", "HNSW"), k=5)
+        self.assertEqual([row["Type"] for row in report], ["Flat", "HNSW"])
+        self.assertEqual(report[0]["Recall@5"], 1.0)
+        self.assertGreater(report[1]["Recall@5"], 0.8)
+        self.assertEqual(report[0]["Bytes/vector"] // 1, 64)
+        self.assertLessEqual(report[0]["P50 ms"], report[0]["P99 ms"])
+
+    def test_ingest_session_index_type(self):
+        """
+        Test the session saves the index as the requested type, and chunks are
+        added to a trained index afterwards.
+        """
+        embeddings = LocalFakeEmbeddings(size=16)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with FaissIngestSession(temp_dir, embeddings=embeddings, cache_path=None,
+                                    index_type="IVF") as session:
+                session.add_chunks([f"text {ind}" for ind in range(100)],
+                                   [{"Title": "A", "Page": str(ind)} for ind in range(100)])
+            with FaissIngestSession(temp_dir, embeddings=embeddings,
+                                    cache_path=None) as session:
+                self.assertEqual(get_index_type(session.faiss_store.index), "IVF")
+                session.add_chunks(["new text"], [{"Title": "B", "Page": "1"}])
+            faiss_store = load_faiss_store(resolve_snapshot_folder(temp_dir), embeddings)
+            self.assertEqual(faiss_store.index.ntotal, 101)
+            prefilter = FaissPrefilter(faiss_store)
+            results = prefilter.similarity_search_with_score(
+                "text 5", k=1, predicate=lambda meta: meta["Title"] == "A")
+            self.assertEqual(results[0][0].page_content, "text 5")
+
+
+class TestBM25Index(unittest.TestCase):
+    """
+    Unittests for the BM25 index and the hybrid search.
+    """
+
+    def setUp(self):
+        self.embeddings = LocalFakeEmbeddings(size=16)
+        texts = [
+            "HB 1426 relating to menstrual health information.",
+            "An act relating to the privacy of consumer health data.",
+            "Sec. 541.051. A controller shall limit the collection of personal data.",
+            "Children using social media platforms, see H.B. 18.",
+        ]
+        metadatas = [
+            {"State": "Texas", "Chunk_id": "A"}, {"State": "Washington", "Chunk_id": "B"},
+            {"State": "Texas", "Chunk_id": "C"}, {"State": "Texas", "Chunk_id": "D"},
+        ]
+        self.faiss_store = FAISS.from_texts(texts, self.embeddings, metadatas=metadatas)
+        self.bm25_index = build_bm25_index(self.faiss_store)
+
+    def test_tokenize_identifiers(self):
+        """
+        Test identifiers written in different ways share a term.
+        """
+        self.assertIn("hb1426", tokenize("HB 1426"))
+        self.assertIn("hb1426", tokenize("H.B. 1426"))
+        self.assertIn("hb1426", tokenize("hb1426"))
+        self.assertIn("sec541.051", tokenize("Section 541.051"))
+        self.assertIn("sec541.051", tokenize("§ 541.051"))
+
+    def test_is_identifier_query(self):
+        """
+        Test only queries made of identifiers are identifier lookups.
+        """
+        for query in ("HB 1426", "SB 5708, HB 1834", "Sec. 541.051", "§ 541.051(a)"):
+            self.assertTrue(is_identifier_query(query), query)
+        for query in ("What does HB 1426 say?", "health data", "Texas 2023", "2023",
+                      "March 2023", ""):
+            self.assertFalse(is_identifier_query(query), query)
+        self.assertTrue(has_identifier("What does HB 1426 say?"))
+        self.assertFalse(has_identifier("bills passed in March 2023"))
+
+    def test_stopwords_do_not_match(self):
+        """
+        Test stopwords are not indexed and weak matches are not returned.
+        """
+        self.assertEqual(tokenize("what is the weather on mars"), ["weather", "mars"])
+        self.assertNotIn("the", self.bm25_index["Postings"])
+        self.assertEqual(search_bm25_index(self.bm25_index, "what is the weather on mars"), [])
+        self.assertEqual(search_bm25_index(self.bm25_index, "relating", min_score=10.0), [])
+
+    def test_search_and_persistence(self):
+        """
+        Test BM25 ranks the chunk with the identifier first, and a saved store
+        searches the postings in its docstore.sqlite with the same scores.
+        """
+        all_docs = getattr(self.faiss_store.docstore, "_dict")
+        results = search_bm25_index(self.bm25_index, "Section 541.051", k=2)
+        self.assertEqual(all_docs[results[0][0]].metadata["Chunk_id"], "C")
+        self.assertEqual(search_bm25_index(self.bm25_index, "HB 1426", k=4,
+                                           allowed_doc_ids=set()), [])
+        self.assertEqual(search_bm25_index(self.bm25_index, "unknown words"), [])
+
+        self.assertEqual(load_bm25_index(self.faiss_store)["Count"], 4)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            save_faiss_store(self.faiss_store, temp_dir)
+            saved_store = load_faiss_store(temp_dir, self.embeddings)
+            saved_index = load_bm25_index(saved_store)
+            self.assertIsInstance(saved_index, SQLiteBM25Index)
+            for query in ("Section 541.051", "HB 1426", "health data relating", "mars"):
+                expected = search_bm25_index(self.bm25_index, query, k=3, min_score=0.0)
+                results = search_bm25_index(saved_index, query, k=3, min_score=0.0)
+                self.assertEqual([doc_id for doc_id, _ in results],
+                                 [doc_id for doc_id, _ in expected], query)
+                for (_, score), (_, expected_score) in zip(results, expected):
+                    self.assertAlmostEqual(score, expected_score)
+            texas_ids = set(saved_store.docstore.find_doc_ids("State", ["Texas"]))
+            self.assertTrue(all(
+                doc_id in texas_ids
+                for doc_id, _ in search_bm25_index(saved_index, "health relating",
+                                                   allowed_doc_ids=texas_ids, min_score=0.0)))
+
+    def test_reciprocal_rank_fusion(self):
+        """
+        Test ids ranked well in both lists come first.
+        """
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+        self.assertEqual([item_id for item_id, _ in fused], ["b", "a", "d", "c"])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+
+    def test_hybrid_search(self):
+        """
+        Test identifier lookups skip the embedding call and other queries fuse
+        the vector and BM25 hits within the filter.
+        """
+        router = FaissShardRouter(self.faiss_store, "./no_shards",
+                                  bm25_index=self.bm25_index)
+        call_count = self.embeddings.call_count
+        results = router.similarity_search_with_relevance_scores(
+            "HB 1426", k=2, filter={"State": "Texas"})
+        self.assertEqual(self.embeddings.call_count, call_count)
+        self.assertEqual(results[0][0].metadata["Chunk_id"], "A")
+        self.assertEqual(results[0][1], 1.0)
+
+        results = router.similarity_search_with_relevance_scores(
+            "menstrual health information", k=4, filter={"State": "Texas"})
+        self.assertEqual(self.embeddings.call_count, call_count + 1)
+        self.assertEqual(results[0][0].metadata["Chunk_id"], "A")
+        self.assertEqual({doc.metadata["State"] for doc, _ in results}, {"Texas"})
+
+        # Without a vector hit above the threshold or an identifier, BM25 hits
+        # are not fused in.
+        self.assertEqual(router.similarity_search_with_relevance_scores(
+            "menstrual health information", k=4, filter={"State": "Texas"},
+            score_threshold=2.0), [])
+        results = router.similarity_search_with_relevance_scores(
+            "What does HB 1426 say?", k=4, filter={"State": "Texas"}, score_threshold=2.0)
+        self.assertEqual(results[0][0].metadata["Chunk_id"], "A")
+
+
+class TestFaissShards(unittest.TestCase):
+    """
+    Unittests for the per-partition FAISS shards, on a small local index.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.embeddings = LocalFakeEmbeddings(size=16)
+        self.texts = ["texas health data", "texas minors", "washington health data",
+                      "federal privacy act"]
+        self.metadatas = [
+            {"Title": "TX", "Page": "1", "State": "Texas", "Type": "State level sectoral"},
+            {"Title": "TX", "Page": "2", "State": "Texas", "Type": "State level sectoral"},
+            {"Title": "WA", "Page": "1", "State": "Washington",
+             "Type": "Comprehensive State level"},
+            {"Title": "US", "Page": "1", "State": None, "Type": "Federal level"},
+        ]
+
+    def ingest(self, write_shards):
+        """
+        Add the test chunks to a new index in the temporary folder.
+        """
+        with FaissIngestSession(self.temp_dir.name, embeddings=self.embeddings,
+                                cache_path=None, write_shards=write_shards) as session:
+            for text, metadata in zip(self.texts, self.metadatas):
+                session.add_chunks([text], [dict(metadata)])
+        return load_faiss_store(resolve_snapshot_folder(self.temp_dir.name), self.embeddings)
+
+    def test_partition_key(self):
+        """
+        Test state bills go to their state and the others to their type.
+        """
+        self.assertEqual(get_partition_key(self.metadatas[2]), "Washington")
+        self.assertEqual(get_partition_key(self.metadatas[3]), "Federal")
+        self.assertEqual(get_partition_key({"Type": "GDPR"}), "GDPR")
+        self.assertEqual(get_partition_key({"Type": "Comprehensive"}), "Comprehensive")
+
+    def test_state_search_only_touches_its_shard(self):
+        """
+        Test a state filtered search is routed to one shard and other searches
+        are merged over all shards by score.
+        """
+        faiss_store = self.ingest(write_shards=True)
+        self.assertEqual(load_shard_partitions(resolve_snapshot_folder(self.temp_dir.name)),
+                         ["Federal", "Texas", "Washington"])
+        router = FaissShardRouter(faiss_store, self.temp_dir.name)
+
+        results = router.similarity_search_with_relevance_scores(
+            "texas minors", k=10, filter={"State": "Texas"})
+        self.assertEqual([doc.page_content for doc, _ in results][0], "texas minors")
+        self.assertEqual({doc.metadata["State"] for doc, _ in results}, {"Texas"})
+        self.assertEqual(list(router.shards), ["Texas"])
+
+        results = router.similarity_search_with_relevance_scores("federal privacy act", k=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0].page_content, "federal privacy act")
+        scores = [score for _, score in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(router.similarity_search_with_relevance_scores(
+            "x", filter={"State": "Ohio"}), [])
+
+    def test_missing_shard_falls_back_to_whole_index(self):
+        """
+        Test a listed shard whose folder is missing raises in get_shard, and
+        searches fall back to the whole index instead of coming back empty.
+        """
+        faiss_store = self.ingest(write_shards=True)
+        snapshot_folder = resolve_snapshot_folder(self.temp_dir.name)
+        shutil.rmtree(get_shard_folder(snapshot_folder, "Texas"))
+        router = FaissShardRouter(faiss_store, self.temp_dir.name)
+        with self.assertRaises(FileNotFoundError):
+            router.get_shard("Texas")
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            results = router.similarity_search_with_relevance_scores(
+                "texas minors", k=10, filter={"State": "Texas"})
+        self.assertIn("Error loading FAISS shard", mock_stdout.getvalue())
+        self.assertEqual(sorted(doc.page_content for doc, _ in results),
+                         ["texas health data", "texas minors"])
+
+    def test_build_shards_from_index(self):
+        """
+        Test an existing index is split into shards without embedding again, and
+        the router searches the whole index when there are no shards.
+        """
+        faiss_store = self.ingest(write_shards=False)
+        router = FaissShardRouter(faiss_store, self.temp_dir.name)
+        results = router.similarity_search_with_relevance_scores(
+            "texas minors", k=10, filter={"State": "Texas"})
+        self.assertEqual(len(results), 2)
+
+        call_count = self.embeddings.call_count
+        snapshot_folder = resolve_snapshot_folder(self.temp_dir.name)
+        self.assertEqual(sorted(build_faiss_shards(faiss_store, snapshot_folder)),
+                         ["Federal", "Texas", "Washington"])
+        self.assertEqual(self.embeddings.call_count, call_count)
+        router = FaissShardRouter(faiss_store, self.temp_dir.name)
+        shard_results = router.similarity_search_with_relevance_scores(
+            "texas minors", k=10, filter={"State": "Texas"})
+        self.assertEqual([doc.page_content for doc, _ in shard_results],
+                         [doc.page_content for doc, _ in results])
+
+
+class TestIndexSnapshots(unittest.TestCase):
+    """
+    Unittests for the numbered snapshots the FAISS index is saved as.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def ingest(self, title, write_shards=None):
+        """
+        Add one chunk to the index in the temporary folder.
+        """
+        with FaissIngestSession(self.temp_dir.name, cache_path=None, write_shards=write_shards,
+                                embedding_provider="local-fake") as session:
+            session.add_chunks([f"text of {title}"],
+                               [{"Title": title, "Page": "1", "State": title}])
+
+    def test_reader_keeps_its_snapshot(self):
+        """
+        Test a loaded index keeps reading its generation while newer ones are
+        published, and old unpinned generations are deleted.
+        """
+        folder = self.temp_dir.name
+        self.ingest("Texas")
+        faiss_store = load_faiss_index(folder, embedding_provider="local-fake")
+        self.assertEqual(get_current_generation(folder), 1)
+        self.assertEqual(faiss_store.snapshot_folder, resolve_snapshot_folder(folder))
+        first_version = get_faiss_index_version(folder)
+
+        for title in ("Ohio", "Iowa", "Utah"):
+            self.ingest(title)
+        self.assertEqual(get_current_generation(folder), 4)
+        self.assertNotEqual(get_faiss_index_version(folder), first_version)
+        self.assertEqual(list_generations(folder), [1, 3, 4])
+        self.assertEqual(load_metadata_index(faiss_store, faiss_store.snapshot_folder)["Count"], 1)
+        self.assertEqual(os.listdir(os.path.join(folder, "generations")).count("tmp"), 0)
+
+        del faiss_store
+        gc.collect()
+        self.assertEqual(collect_snapshots(folder), [1])
+        self.assertEqual(list_generations(folder), [3, 4])
+
+    def test_legacy_index_and_stale_pins(self):
+        """
+        Test an index saved before snapshots is read in place and replaced, and
+        pins of readers that are gone do not keep a generation.
+        """
+        folder = self.temp_dir.name
+        FAISS.from_texts(["old text"], LocalFakeEmbeddings()).save_local(folder)
+        save_embedding_provider_info(get_embedding_provider_info("local-fake"), folder)
+        self.assertEqual(resolve_snapshot_folder(folder), folder)
+        with pin_snapshot(folder) as snapshot_pin:
+            self.assertEqual(snapshot_pin.generation, 0)
+            self.assertIsNone(snapshot_pin.pin_path)
+
+        self.ingest("Texas")
+        # The legacy index was copied into generation 1 and is never deleted.
+        self.assertEqual(list_generations(folder), [1, 2])
+        snapshot_pin = pin_snapshot(folder)
+        # A pin of this process, which still runs, is kept however old it is.
+        os.utime(snapshot_pin.pin_path, (0, 0))
+        # A pin left by a reader that has exited.
+        finished = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                  capture_output=True, text=True, check=True)
+        dead_pin_path = os.path.join(folder, "pins", f"3-{finished.stdout.strip()}-dead")
+        with open(dead_pin_path, "w", encoding="utf-8"):
+            pass
+        self.ingest("Ohio")
+        self.ingest("Iowa")
+        self.ingest("Utah")
+        self.assertTrue(os.path.isfile(os.path.join(folder, "index.faiss")))
+        self.assertTrue(os.path.isfile(os.path.join(folder, "index.pkl")))
+        self.assertEqual(list_generations(folder), [2, 4, 5])
+        self.assertTrue(os.path.exists(snapshot_pin.pin_path))
+        self.assertFalse(os.path.exists(dead_pin_path))
+        snapshot_pin.release()
+
+        faiss_store = load_faiss_index(folder, embedding_provider="local-fake")
+        self.assertEqual(faiss_store.index.ntotal, 5)
+
+    def test_unchanged_shards_are_linked(self):
+        """
+        Test a new snapshot rewrites only the shards that changed.
+        """
+        folder = self.temp_dir.name
+        self.ingest("Texas", write_shards=True)
+        self.ingest("Ohio")
+        self.ingest("Ohio other")
+        first = os.path.join(folder, "generations", "2", "shards", "Texas", "index.faiss")
+        second = os.path.join(folder, "generations", "3", "shards", "Texas", "index.faiss")
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(load_shard_partitions(resolve_snapshot_folder(folder)),
+                         ["Ohio", "Ohio other", "Texas"])
+
+
+class TestIngestQueue(unittest.TestCase):
+    """
+    Unittests for the write lock and the queue of concurrent index writers.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def open_session(self, write_lock=None):
+        """
+        Return an ingest session on the temporary folder with local embeddings.
+        """
+        return FaissIngestSession(self.temp_dir.name, cache_path=None,
+                                  embedding_provider="local-fake", write_lock=write_lock)
+
+    def test_write_lock_excludes_other_writers(self):
+        """
+        Test a second lock on the folder is refused until the first is released.
+        """
+        with IndexWriteLock(self.temp_dir.name):
+            self.assertFalse(IndexWriteLock(self.temp_dir.name).acquire(blocking=False))
+        other_lock = IndexWriteLock(self.temp_dir.name)
+        self.assertTrue(other_lock.acquire(blocking=False))
+        other_lock.release()
+
+    def test_session_saves_queued_batches_together(self):
+        """
+        Test batches queued while a writer holds the index are added in order
+        at its next save, in one snapshot, and then removed from the queue.
+        """
+        with self.open_session() as session:
+            session.add_chunks(["texas minors"], [{"Title": "TX", "Page": "1"}])
+            enqueue_batch(self.temp_dir.name, ["ohio data"], [{"Title": "OH", "Page": "1"}])
+            enqueue_batch(self.temp_dir.name, ["iowa data", "iowa more"],
+                          [{"Title": "IA", "Page": "1"}, {"Title": "IA", "Page": "1"}])
+        self.assertEqual(list_queued_batches(self.temp_dir.name), [])
+        self.assertEqual(get_current_generation(self.temp_dir.name), 1)
+        faiss_store = load_faiss_index(self.temp_dir.name, embedding_provider="local-fake")
+        self.assertEqual(
+            [doc.metadata["Chunk_id"] for doc in getattr(faiss_store.docstore, "_dict").values()],
+            ["TX_Page_1_ChunkNo_0", "OH_Page_1_ChunkNo_0",
+             "IA_Page_1_ChunkNo_0", "IA_Page_1_ChunkNo_1"])
+
+    def test_session_saves_when_batches_are_queued(self):
+        """
+        Test a long session saves a queued batch at its next add_chunks, and a
+        writer that times out while the index is held leaves its batch queued.
+        """
+        with self.open_session() as session:
+            session.add_chunks(["texas minors"], [{"Title": "TX", "Page": "1"}])
+            self.assertEqual(get_current_generation(self.temp_dir.name), 0)
+            result = submit_chunks(self.temp_dir.name, ["ohio data"],
+                                   [{"Title": "OH", "Page": "1"}], self.open_session,
+                                   poll_interval=0.01, timeout=0.05)
+            self.assertEqual(result, QUEUED)
+            self.assertEqual(len(list_queued_batches(self.temp_dir.name)), 1)
+            session.add_chunks(["iowa data"], [{"Title": "IA", "Page": "1"}])
+            self.assertEqual(list_queued_batches(self.temp_dir.name), [])
+            self.assertEqual(get_current_generation(self.temp_dir.name), 1)
+            faiss_store = load_faiss_index(self.temp_dir.name, embedding_provider="local-fake")
+            self.assertEqual(faiss_store.index.ntotal, 3)
+
+    def test_batches_queued_during_the_last_save_are_saved(self):
+        """
+        Test a batch queued while the session publishes its last snapshot is
+        saved before the lock is released.
+        """
+        def publish_and_queue(faiss_folder, temp_folder):
+            if not list_generations(faiss_folder):
+                enqueue_batch(faiss_folder, ["ohio data"], [{"Title": "OH", "Page": "1"}])
+            return publish_snapshot(faiss_folder, temp_folder)
+
+        with patch("db_manager.faiss_db_manager.publish_snapshot",
+                   side_effect=publish_and_queue):
+            with self.open_session() as session:
+                session.add_chunks(["texas minors"], [{"Title": "TX", "Page": "1"}])
+        self.assertEqual(list_queued_batches(self.temp_dir.name), [])
+        faiss_store = load_faiss_index(self.temp_dir.name, embedding_provider="local-fake")
+        self.assertEqual(faiss_store.index.ntotal, 2)
+
+    def test_unreadable_batch_is_set_aside(self):
+        """
+        Test a batch that cannot be read is renamed and not retried at every add.
+        """
+        batch_path = enqueue_batch(self.temp_dir.name, ["ohio data"], [{"Title": "OH"}])
+        with open(batch_path, "w", encoding="utf-8") as batch_file:
+            batch_file.write("not json")
+        with patch("sys.stdout", new_callable=StringIO):
+            with self.open_session() as session:
+                session.add_chunks(["texas minors"], [{"Title": "TX", "Page": "1"}])
+                self.assertFalse(session.has_queued_batches())
+                session.add_chunks(["iowa data"], [{"Title": "IA", "Page": "1"}])
+        self.assertEqual(list_queued_batches(self.temp_dir.name), [])
+        self.assertTrue(os.path.isfile(batch_path + ".failed"))
+        self.assertEqual(list_generations(self.temp_dir.name), [1, 2])
+
+    def test_concurrent_writers_lose_no_chunks(self):
+        """
+        Test chunks submitted from many threads at once all end up in the index.
+        """
+        results = []
+
+        def submit(title):
+            results.append(submit_chunks(self.temp_dir.name, [f"text of {title}"],
+                                         [{"Title": title, "Page": "1"}], self.open_session,
+                                         poll_interval=0.01))
+
+        threads = [threading.Thread(target=submit, args=(f"Bill{ind}",)) for ind in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [SAVED] * 8)
+        self.assertEqual(list_queued_batches(self.temp_dir.name), [])
+        self.assertLessEqual(get_current_generation(self.temp_dir.name), 8)
+        faiss_store = load_faiss_index(self.temp_dir.name, embedding_provider="local-fake")
+        self.assertEqual(faiss_store.index.ntotal, 8)
+
+
+class TestSQLiteDocstore(unittest.TestCase):
+    """
+    Unittests for the SQLite docstore the FAISS index is saved with.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.embeddings = LocalFakeEmbeddings(size=16)
+        self.texts = ["texas health data", "texas minors", "washington health data"]
+        self.metadatas = [
+            {"Chunk_id": "TX_1", "State": "Texas", "Page": 1, "Topics": ["Health"]},
+            {"Chunk_id": "TX_2", "State": "Texas", "Page": 2, "Topics": []},
+            {"Chunk_id": "WA_1", "State": "Washington", "Page": 1, "Topics": ["Health"]},
+        ]
+        self.faiss_store = FAISS.from_texts(self.texts, self.embeddings,
+                                            metadatas=self.metadatas)
+
+    def test_round_trip(self):
+        """
+        Test a saved store loads without index.pkl and returns the same chunks.
+        """
+        folder = os.path.join(self.temp_dir.name, "first")
+        save_faiss_store(self.faiss_store, folder)
+        self.assertEqual(sorted(os.listdir(folder)), ["docstore.sqlite", "index.faiss"])
+
+        faiss_store = load_faiss_store(folder, self.embeddings)
+        self.assertIsInstance(faiss_store.docstore, SQLiteDocstore)
+        self.assertEqual(faiss_store.index_to_docstore_id, self.faiss_store.index_to_docstore_id)
+        all_docs = getattr(faiss_store.docstore, "_dict")
+        self.assertEqual(len(all_docs), 3)
+        self.assertEqual([doc.metadata for doc in all_docs.values()], self.metadatas)
+        results = faiss_store.similarity_search("texas minors", k=1)
+        self.assertEqual(results[0].page_content, "texas minors")
+        self.assertEqual(results[0].metadata["Page"], 2)
+        self.assertEqual(len(faiss_store.docstore.find_doc_ids("State", ["Texas"])), 2)
+        self.assertIn("ID missing not found", faiss_store.docstore.search("missing"))
+
+    def test_added_chunks_are_appended(self):
+        """
+        Test chunks added to a loaded store are saved after the saved ones,
+        and ids already in the file cannot be added again.
+        """
+        first_folder = os.path.join(self.temp_dir.name, "first")
+        second_folder = os.path.join(self.temp_dir.name, "second")
+        save_faiss_store(self.faiss_store, first_folder)
+        faiss_store = load_faiss_store(first_folder, self.embeddings)
+        faiss_store.add_texts(["federal privacy act"], metadatas=[{"State": "Federal"}],
+                              ids=["US_1"])
+        with self.assertRaises(ValueError):
+            faiss_store.add_texts(["again"], ids=[faiss_store.index_to_docstore_id[0]])
+        self.assertEqual(faiss_store.docstore.find_doc_ids("State", ["Federal"]), ["US_1"])
+        save_faiss_store(faiss_store, second_folder)
+
+        reloaded = load_faiss_store(second_folder, self.embeddings)
+        self.assertEqual(reloaded.index_to_docstore_id[3], "US_1")
+        self.assertEqual(reloaded.docstore.search("US_1").page_content, "federal privacy act")
+        self.assertEqual(len(getattr(load_faiss_store(first_folder, self.embeddings).docstore,
+                                     "_dict")), 3)
+
+    def test_prefilter_uses_indexed_columns(self):
+        """
+        Test filters on indexed and other metadata select the same chunks as
+        on the in memory docstore.
+        """
+        folder = os.path.join(self.temp_dir.name, "first")
+        save_faiss_store(self.faiss_store, folder)
+        faiss_store = load_faiss_store(folder, self.embeddings)
+        for metadata_filter in ({"Chunk_id": "TX_2"}, {"Page": 1}, {"Chunk_id": ["TX_1", "WA_1"]}):
+            np.testing.assert_array_equal(
+                FaissPrefilter(faiss_store).select(metadata_filter),
+                FaissPrefilter(self.faiss_store).select(metadata_filter))
+
+
+    def test_docstore_ids_are_read_on_lookup(self):
+        """
+        Test loading reads no docstore ids, lookups and added positions work,
+        and hits are read in one batch.
+        """
+        folder = os.path.join(self.temp_dir.name, "first")
+        save_faiss_store(self.faiss_store, folder)
+        faiss_store = load_faiss_store(folder, self.embeddings)
+        index_to_docstore_id = faiss_store.index_to_docstore_id
+        self.assertIsInstance(index_to_docstore_id, IndexToDocstoreIdMap)
+        self.assertEqual(index_to_docstore_id.added, {})
+        self.assertEqual(index_to_docstore_id[1], self.faiss_store.index_to_docstore_id[1])
+        self.assertNotIn(3, index_to_docstore_id)
+        with self.assertRaises(KeyError):
+            _ = index_to_docstore_id[3]
+        faiss_store.add_texts(["federal privacy act"], metadatas=[{"State": "Federal"}],
+                              ids=["US_1"])
+        self.assertEqual(len(index_to_docstore_id), 4)
+        self.assertEqual(list(index_to_docstore_id.values())[-1], "US_1")
+        self.assertEqual(index_to_docstore_id.get_positions(["US_1", "missing"]), {"US_1": 3})
+        with patch.object(SQLiteDocstore, "get_document", side_effect=AssertionError):
+            results = FaissPrefilter(faiss_store).similarity_search_with_score(
+                "texas", k=3, metadata_filter={"State": "Texas"})
+        self.assertEqual(len(results), 2)
+
+    def test_search_tables_are_added_to_older_files(self):
+        """
+        Test a file saved without the BM25 and facet tables is searched with an
+        index built in memory, and gets the tables for every chunk at its next save.
+        """
+        folder = os.path.join(self.temp_dir.name, "first")
+        save_faiss_store(self.faiss_store, folder)
+        connection = sqlite3.connect(os.path.join(folder, "docstore.sqlite"))
+        for table in ("bm25_postings", "bm25_lengths", "facets", "properties"):
+            connection.execute(f"DROP TABLE {table}")
+        connection.commit()
+        connection.close()
+
+        older_store = load_faiss_store(folder, self.embeddings)
+        self.assertIsInstance(load_bm25_index(older_store), dict)
+        older_store.add_texts(["federal privacy act"], metadatas=[{"State": "Federal"}],
+                              ids=["US_1"])
+        second_folder = os.path.join(self.temp_dir.name, "second")
+        save_faiss_store(older_store, second_folder)
+        reloaded = load_faiss_store(second_folder, self.embeddings)
+        bm25_index = load_bm25_index(reloaded)
+        self.assertIsInstance(bm25_index, SQLiteBM25Index)
+        self.assertEqual([doc_id for doc_id, _ in search_bm25_index(bm25_index, "minors")],
+                         [reloaded.index_to_docstore_id[1]])
+        self.assertEqual(search_bm25_index(bm25_index, "federal")[0][0], "US_1")
+        metadata_index = load_metadata_index(reloaded, second_folder)
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "Topics", "health"),
+                         [reloaded.index_to_docstore_id[0], reloaded.index_to_docstore_id[2]])
+
+    def test_date_filter_reads_date_column(self):
+        """
+        Test the date filter reads the date column without reading the chunks,
+        and a file saved without the column gets it at the next save.
+        """
+        for metadata, bill_date in zip(self.metadatas, ("01152024", "06302023", "bad")):
+            metadata["Date"] = bill_date
+        faiss_store = FAISS.from_texts(self.texts, self.embeddings, metadatas=self.metadatas)
+        folder = os.path.join(self.temp_dir.name, "first")
+        save_faiss_store(faiss_store, folder)
+        connection = sqlite3.connect(os.path.join(folder, "docstore.sqlite"))
+        connection.execute("DROP INDEX documents_date_ordinal")
+        connection.execute("ALTER TABLE documents DROP COLUMN date_ordinal")
+        connection.commit()
+        connection.close()
+
+        older_store = load_faiss_store(folder, self.embeddings)
+        self.assertIsNone(older_store.docstore.load_date_ordinals())
+        np.testing.assert_array_equal(
+            FaissPrefilter(older_store).select(date_from=date(2024, 1, 1)), [0])
+
+        second_folder = os.path.join(self.temp_dir.name, "second")
+        save_faiss_store(older_store, second_folder)
+        reloaded = load_faiss_store(second_folder, self.embeddings)
+        self.assertEqual(reloaded.docstore.load_date_ordinals(),
+                         [(1, date(2023, 6, 30).toordinal()), (0, date(2024, 1, 15).toordinal())])
+        prefilter = FaissPrefilter(reloaded)
+        with patch.object(SQLiteDocstore, "iter_documents", side_effect=AssertionError):
+            np.testing.assert_array_equal(prefilter.select(date_from=date(2024, 1, 1)), [0])
+            np.testing.assert_array_equal(prefilter.select(date_to=date(2024, 1, 1)), [1])
+
+
+class TestEmbeddingPipeline(unittest.TestCase):
+    """
+    General unittests for the batched embedding stage.
+    """
+
+    def test_embed_texts_in_batches(self):
+        """
+        Test batches keep the order of the texts and match the fake embedder.
+        """
+        embeddings = LocalFakeEmbeddings(size=8)
+        texts = [f"chunk {ind}" for ind in range(25)]
+        vectors = embed_texts_in_batches(texts, embeddings, batch_size=10, max_concurrency=3)
+        self.assertEqual(embeddings.call_count, 3)
+        self.assertEqual(vectors, [embeddings.embed_text(text) for text in texts])
+        self.assertEqual(embed_texts_in_batches([], embeddings), [])
+
+    def test_embed_texts_in_batches_retries_quota_errors(self):
+        """
+        Test a batch that hits the quota is retried and other errors are raised.
+        """
+        embeddings = MagicMock()
+        embeddings.embed_documents.side_effect = [
+            ResourceExhausted("quota"),
+            [[0.1], [0.2]],
+        ]
+        with patch("sys.stdout", new_callable=StringIO):
+            vectors = embed_texts_in_batches(["a", "b"], embeddings, initial_backoff=0)
+        self.assertEqual(vectors, [[0.1], [0.2]])
+        self.assertEqual(embeddings.embed_documents.call_count, 2)
+
+        embeddings.embed_documents.side_effect = ValueError("bad request")
+        with self.assertRaises(ValueError):
+            embed_texts_in_batches(["a", "b"], embeddings, initial_backoff=0)
+
+    def test_is_quota_error(self):
+        """
+        Test quota errors are recognised by type or status code, not by message text.
+        """
+        wrapped = ValueError("embedding failed")
+        wrapped.__cause__ = ResourceExhausted("quota")
+        self.assertTrue(is_quota_error(wrapped))
+        self.assertTrue(is_quota_error(TooManyRequests("slow down")))
+        self.assertFalse(is_quota_error(ValueError("chunk 429 of HB 1429 is invalid")))
+        self.assertFalse(is_quota_error(ValueError("bad request")))
+
+
+class TestEmbeddingProviders(unittest.TestCase):
+    """
+    Unittests for the embedding provider registry and the local hashing embedder.
+    """
+
+    def test_hashing_embeddings(self):
+        """
+        Test related texts get closer vectors than unrelated ones, the same on every call.
+        """
+        embeddings = HashingEmbeddings(size=64)
+        vectors = embeddings.encode(["Consumers may delete their personal data.",
+                                     "consumer right to deletion of personal data",
+                                     "Maternal mortality review committee", ""])
+        self.assertEqual(vectors.shape, (4, 64))
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+        self.assertEqual(float(np.linalg.norm(vectors[3])), 0.0)
+        np.testing.assert_allclose(
+            embeddings.embed_query("Consumers may delete their personal data."),
+            vectors[0], rtol=1e-6)
+
+    def test_provider_selected_by_environment(self):
+        """
+        Test the provider comes from EMBEDDING_PROVIDER unless one is named.
+        """
+        with patch.dict(os.environ, {"EMBEDDING_PROVIDER": "local-hashing"}):
+            self.assertIsInstance(create_embeddings(), HashingEmbeddings)
+            self.assertIsInstance(create_embeddings("local-fake"), LocalFakeEmbeddings)
+        with self.assertRaises(ValueError):
+            create_embeddings("unknown")
+
+    def test_loading_with_another_provider_fails(self):
+        """
+        Test the index records its provider and cannot be loaded with another one.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(load_embedding_provider_info(temp_dir)["Provider"], "gemini")
+            with FaissIngestSession(temp_dir, cache_path=None,
+                                    embedding_provider="local-hashing") as session:
+                session.add_chunks(["texas minors", "federal privacy act"],
+                                   [{"Title": "TX", "Page": "1"}, {"Title": "US", "Page": "1"}])
+            self.assertEqual(load_embedding_provider_info(resolve_snapshot_folder(temp_dir)),
+                             {"Provider": "local-hashing", "Model": "local-hashing-768",
+                              "Dimension": 768})
+
+            faiss_store = load_faiss_index(temp_dir, embedding_provider="local-hashing")
+            results = faiss_store.similarity_search("texas minor", k=1)
+            self.assertEqual(results[0].page_content, "texas minors")
+            with self.assertRaises(ValueError):
+                load_faiss_index(temp_dir, embedding_provider="local-fake")
+            with self.assertRaises(ValueError):
+                with FaissIngestSession(temp_dir, cache_path=None,
+                                        embedding_provider="local-fake"):
+                    pass
+
+    def test_embeddings_passed_in_record_their_provider(self):
+        """
+        Test embeddings passed to a session are recorded under the provider of
+        their model, so the index loads with that provider's name.
+        """
+        self.assertEqual(get_embedding_provider_info(embeddings=LocalFakeEmbeddings()),
+                         get_embedding_provider_info("local-fake"))
+        self.assertEqual(get_embedding_provider_info(embeddings=LocalFakeEmbeddings(size=16)),
+                         {"Provider": "local-fake-16", "Model": "local-fake-16",
+                          "Dimension": 16})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with FaissIngestSession(temp_dir, cache_path=None,
+                                    embeddings=LocalFakeEmbeddings()) as session:
+                session.add_chunks(["texas minors"], [{"Title": "TX", "Page": "1"}])
+            self.assertEqual(
+                load_embedding_provider_info(resolve_snapshot_folder(temp_dir))["Provider"],
+                "local-fake")
+            faiss_store = load_faiss_index(temp_dir, embedding_provider="local-fake")
+            self.assertEqual(faiss_store.index.ntotal, 1)
+
+            # Indexes that recorded the model name as the provider still load.
+            save_embedding_provider_info({"Provider": "local-fake-768", "Model": "local-fake-768",
+                                          "Dimension": 768}, resolve_snapshot_folder(temp_dir))
+            faiss_store = load_faiss_index(temp_dir, embedding_provider="local-fake")
+            self.assertEqual(faiss_store.index.ntotal, 1)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """
+    General unittests for the on-disk embedding cache.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache = EmbeddingCache(os.path.join(self.temp_dir.name, "cache.sqlite"),
+                                    max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_cache_round_trip_and_eviction(self):
+        """
+        Test cached vectors are returned, counted and the least recently used is evicted.
+        """
+        self.assertEqual(self.cache.get_many("model", ["a", "b"]), [None, None])
+        self.cache.put_many("model", ["a", "b"], [[0.5, 1.0], [2.0, 3.0]])
+        self.assertEqual(self.cache.get_many("model", ["a"]), [[0.5, 1.0]])
+        self.assertEqual(self.cache.get_many("other_model", ["a"]), [None])
+
+        # "b" is now the least recently used and is evicted
+        self.cache.put_many("model", ["c"], [[4.0, 5.0]])
+        self.assertEqual(self.cache.get_many("model", ["a", "b", "c"]),
+                         [[0.5, 1.0], None, [4.0, 5.0]])
+        self.assertEqual(self.cache.stats()["hits"], 3)
+        self.assertEqual(self.cache.stats()["misses"], 4)
+
+    def test_embed_texts_with_cache(self):
+        """
+        Test a second embedding of the same texts makes no embedding calls.
+        """
+        self.cache.max_entries = 100
+        embeddings = LocalFakeEmbeddings(size=4)
+        texts = ["chunk 1", "chunk 2", "chunk 1"]
+        first = embed_texts_in_batches(texts, embeddings, cache=self.cache)
+        self.assertEqual(embeddings.call_count, 1)
+        second = embed_texts_in_batches(texts, embeddings, cache=self.cache)
+        self.assertEqual(embeddings.call_count, 1)
+        np.testing.assert_allclose(first, second, rtol=1e-6)
+
+    def test_cached_query_embeddings(self):
+        """
+        Test a repeated query is served from memory, a query seen by an earlier
+        process from disk, and both count as hits.
+        """
+        self.cache.max_entries = 100
+        embeddings = LocalFakeEmbeddings(size=4)
+        cached = CachedQueryEmbeddings(embeddings, cache=self.cache, max_memory_entries=1)
+        first = cached.embed_query("Does this state regulate biometric data?")
+        second = cached.embed_query("  does this STATE regulate biometric data? ")
+        self.assertEqual(embeddings.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(cached.stats(), {"memory_hits": 1, "disk_hits": 0,
+                                          "misses": 1, "hit_rate": 0.5})
+
+        # Queries and documents with the same text are cached apart
+        cached.embed_documents(["does this state regulate biometric data?"])
+        self.assertEqual(embeddings.call_count, 2)
+
+        restarted = CachedQueryEmbeddings(embeddings, cache=self.cache)
+        np.testing.assert_allclose(
+            restarted.embed_query("Does this state regulate biometric data?"), first, rtol=1e-6)
+        self.assertEqual(embeddings.call_count, 2)
+        self.assertEqual(restarted.stats()["disk_hits"], 1)
+
+
+class TestAnswerCache(unittest.TestCase):
+    """
+    General unittests for the persistent answer cache.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache = AnswerCache(os.path.join(self.temp_dir.name, "answers.sqlite"),
+                                 max_entries=2, similarity_threshold=0.9)
+        vectors = {
+            "does texas regulate biometric data?": [1.0, 0.0, 0.0],
+            "is biometric data regulated in texas?": [0.95, 0.1, 0.0],
+            "what are the penalties?": [0.0, 1.0, 0.0],
+        }
+        self.embed_query = MagicMock(side_effect=lambda text: vectors[text.lower()])
+        self.records = [{"Document": "Bill", "Page": "1"}]
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_exact_and_near_duplicate_hits(self):
+        """
+        Test the same question and a near duplicate return the stored answer,
+        and a different question or state does not.
+        """
+        self.cache.store("Texas", (1, 2), "Does Texas regulate biometric data?",
+                         "Yes", self.records, self.embed_query)
+        self.embed_query.reset_mock()
+        cached = self.cache.lookup("Texas", (1, 2), "  does texas REGULATE biometric data?",
+                                   self.embed_query)
+        self.assertEqual(cached["Answer"], "Yes")
+        self.assertEqual(cached["Records"], self.records)
+        self.embed_query.assert_not_called()
+
+        cached = self.cache.lookup("Texas", (1, 2), "Is biometric data regulated in Texas?",
+                                   self.embed_query)
+        self.assertEqual(cached["Question"], "does texas regulate biometric data?")
+        self.assertIsNone(self.cache.lookup("Texas", (1, 2), "What are the penalties?",
+                                            self.embed_query))
+        self.assertIsNone(self.cache.lookup("Ohio", (1, 2), "Does Texas regulate biometric data?",
+                                            self.embed_query))
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    def test_expiry_invalidation_and_eviction(self):
+        """
+        Test answers expire, are dropped for a new index version and the least
+        recently used answer is evicted.
+        """
+        old_version = ((10, 100), (20, 100))
+        new_version = ((10, 200), (30, 200))
+        self.cache.store("Texas", old_version, "HB 1426", "Answer 1", [])
+        self.embed_query.assert_not_called()
+        self.cache.store("Texas", old_version, "What are the penalties?", "Answer 2", [],
+                         self.embed_query)
+        self.assertIsNotNone(self.cache.lookup("Texas", old_version, "HB 1426"))
+        self.cache.store("Texas", old_version, "Does Texas regulate biometric data?",
+                         "Answer 3", [], self.embed_query)
+        self.assertIsNone(self.cache.lookup("Texas", old_version, "What are the penalties?"))
+        self.assertIsNotNone(self.cache.lookup("Texas", old_version, "HB 1426"))
+
+        self.cache.store("Texas", new_version, "SB 5708", "New answer", [])
+        self.assertIsNone(self.cache.lookup("Texas", old_version, "HB 1426"))
+        # A process still on the older index does not drop the newer answers.
+        self.cache.store("Texas", old_version, "HB 1426", "Answer 1", [])
+        self.assertIsNotNone(self.cache.lookup("Texas", new_version, "SB 5708"))
+        self.cache.ttl_seconds = -1
+        self.assertIsNone(self.cache.lookup("Texas", new_version, "SB 5708"))
+
+
+class TestContextAssembly(unittest.TestCase):
+    """
+    Unittests for merging retrieved chunks into spans for the LLM.
+    """
+
+    def setUp(self):
+        """
+        Split one page into overlapping chunks the way the ingest does.
+        """
+        self.page_text = " ".join(f"Sentence {number} of the consumer privacy act."
+                                  for number in range(100))
+        chunk_texts, chunk_metadatas = chunk_pdf_pages(
+            [self.page_text], "./data/Texas/Act.pdf"
+        )
+        self.docs = []
+        for chunk_number, (text, metadata) in enumerate(zip(chunk_texts, chunk_metadatas)):
+            metadata["Chunk_id"] = f"Act_Page_1_ChunkNo_{chunk_number}"
+            self.docs.append(MagicMock(page_content=text, metadata=metadata))
+
+    def test_merge_texts(self):
+        """
+        Test whether neighbouring chunks are joined keeping their overlap once.
+        """
+        merged = merge_texts(self.docs[0].page_content, self.docs[1].page_content)
+        self.assertTrue(self.page_text.startswith(merged))
+        self.assertTrue(merged.endswith(self.docs[1].page_content))
+        self.assertEqual(merge_texts("First text.", "Second text."), "First text.\nSecond text.")
+
+    def test_assemble_context_merges_neighbouring_chunks(self):
+        """
+        Test whether chunks of one page are merged into spans without losing text.
+        """
+        other_page = MagicMock(page_content="Federal text.",
+                               metadata={"Path": "./data/Federal/Act.pdf", "Page": "2",
+                                         "Chunk_id": "Federal_Page_2_ChunkNo_0"})
+        filtered_results = [(self.docs[2], 0.9), (other_page, 0.8), (self.docs[0], 0.7),
+                            (self.docs[1], 0.6), (self.docs[4], 0.5), (self.docs[2], 0.4)]
+
+        spans = assemble_context(filtered_results)
+
+        self.assertEqual([span.metadata["Chunk_ids"] for span in spans], [
+            ["Act_Page_1_ChunkNo_0", "Act_Page_1_ChunkNo_1", "Act_Page_1_ChunkNo_2",
+             "Act_Page_1_ChunkNo_2"],
+            ["Federal_Page_2_ChunkNo_0"],
+            ["Act_Page_1_ChunkNo_4"],
+        ])
+        self.assertTrue(self.page_text.startswith(spans[0].page_content))
+        for doc in self.docs[:3]:
+            self.assertIn(doc.page_content, spans[0].page_content)
+        self.assertLess(len(spans[0].page_content),
+                        sum(len(doc.page_content) for doc in self.docs[:3]))
+        self.assertEqual(spans[2].page_content, self.docs[4].page_content)
+        self.assertEqual(assemble_context([]), [])
+        with self.assertRaises(TypeError):
+            assemble_context("not a list")
+
+
+class TestRetrievalBenchmark(unittest.TestCase):
+    """
+    Unittests for the offline retrieval benchmark.
+    """
+
+    def test_get_pdf_bill_info(self):
+        """
+        Test whether the State and Type of a PDF are taken from its path.
+        """
+        self.assertEqual(get_pdf_bill_info("./pdfs/Texas/HB 1426.pdf"),
+                         {"State": "Texas", "Type": "State level sectoral",
+                          "Title": "Texas: HB 1426"})
+        self.assertEqual(
+            get_pdf_bill_info("./pdfs/Comprehensive/OregonConsumerPrivacyAct.pdf")["State"],
+            "Oregon")
+
+    def test_run_retrieval_benchmark(self):
+        """
+        Test whether synthetic corpora are built and searched without the network.
+        """
+        texts = [f"Section {number} of HB 1426 covers personal data." for number in range(20)]
+        metadatas = [{"State": "Texas" if number % 2 else "Oregon", "Path": "./pdfs/Act.pdf",
+                      "Page": str(number), "Chunk_id": f"Act_Page_{number}_ChunkNo_0"}
+                     for number in range(20)]
+        synthetic_texts, synthetic_metadatas = make_synthetic_corpus(texts, metadatas, 3)
+        self.assertEqual(len(synthetic_texts), 60)
+        self.assertEqual(len({metadata["Chunk_id"] for metadata in synthetic_metadatas}), 60)
+        self.assertEqual(synthetic_metadatas[20]["State"], synthetic_metadatas[39]["State"])
+
+        report = run_retrieval_benchmark(texts, metadatas, scales=(1, 3), rounds=1, size=16)
+
+        self.assertEqual([row["Chunks"] for row in report], [20, 60])
+        for row in report:
+            self.assertLessEqual(row["P50 ms"], row["P99 ms"])
+            self.assertLessEqual(row["State P50 ms"], row["State P99 ms"])
+            self.assertLessEqual(row["Router P50 ms"], row["Router P99 ms"])
+            self.assertLessEqual(row["Router State P50 ms"], row["Router State P99 ms"])
+            self.assertGreater(row["Vectors MB"], 0)
+
+
+class TestMetadataIndex(unittest.TestCase):
+    """
+    General unittests for the metadata inverted index.
+    """
+
+    def setUp(self):
+        docs = {
+            "id1": MagicMock(metadata={"State": "Texas", "Type": "State level sectoral",
+                                       "Sector": "Health", "Topics": ["Health Data", "Minors"]}),
+            "id2": MagicMock(metadata={"State": "Texas", "Type": "State level sectoral",
+                                       "Sector": None, "Topics": ["health  data"]}),
+            "id3": MagicMock(metadata={"State": "Washington", "Topics": []}),
+        }
+        self.faiss_store = MagicMock()
+        setattr(self.faiss_store.docstore, "_dict", docs)
+
+    def test_metadata_index_lookup(self):
+        """
+        Test facet values map to the ids of the chunks that have them.
+        """
+        metadata_index = build_metadata_index(self.faiss_store)
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "State", "Texas"),
+                         ["id1", "id2"])
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "Topics", "HEALTH DATA"),
+                         ["id1", "id2"])
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "Sector", "Health"), ["id1"])
+        self.assertEqual(get_doc_ids_for_facet(metadata_index, "State", "Ohio"), [])
+        with self.assertRaises(ValueError):
+            get_doc_ids_for_facet(metadata_index, "Title", "x")
+
+    def test_metadata_index_bills(self):
+        """
+        Test the bills of a state are listed once per title without reading chunks.
+        """
+        metadata_index = create_metadata_index()
+        for doc_id, metadata in (
+            ("id1", {"Path": "./pdfs/Texas/a.pdf", "Title": "A", "Topics": ["Minors"],
+                     "State": "Texas"}),
+            ("id2", {"Path": "./pdfs/Texas/a.pdf", "Title": "A", "Topics": ["Minors"],
+                     "State": "Texas"}),
+            ("id3", {"Path": "./pdfs/Texas/b.pdf", "Title": "B", "State": "Texas"}),
+            ("id4", {"Path": "./pdfs/Ohio/c.pdf", "Title": "C", "State": "Ohio"}),
+        ):
+            add_to_metadata_index(metadata_index, doc_id, metadata)
+        self.assertEqual(get_bills_of_state(metadata_index, "Texas"), [
+            {"Title": "A", "Topics": ["Minors"]},
+            {"Title": "B", "Topics": "No Topics"},
+        ])
+        self.assertEqual(get_bills_of_state(metadata_index, "Utah"), [])
+
+    def test_metadata_index_persistence(self):
+        """
+        Test only the bills are saved in the file, and a store without a
+        docstore.sqlite gets its index built from the docstore.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            metadata_index = build_metadata_index(self.faiss_store)
+            save_metadata_index(metadata_index, temp_dir)
+            with open(os.path.join(temp_dir, "metadata_index.json"), encoding="utf-8") as file:
+                self.assertEqual(sorted(json.load(file)), ["Bills", "Count"])
+            loaded = load_metadata_index(self.faiss_store, temp_dir)
+            self.assertEqual(get_doc_ids_for_facet(loaded, "State", "Texas"), ["id1", "id2"])
+
+            getattr(self.faiss_store.docstore, "_dict")["id4"] = MagicMock(metadata={})
+            self.assertEqual(load_metadata_index(self.faiss_store, temp_dir)["Count"], 4)
+
+    def test_metadata_index_in_docstore(self):
+        """
+        Test a saved store reads its facets and Chunk_ids from docstore.sqlite
+        and finds the same chunks as an index built in memory.
+        """
+        embeddings = LocalFakeEmbeddings(size=8)
+        metadatas = [
+            {"Chunk_id": "TX_1", "State": "Texas", "Sector": "Health",
+             "Topics": ["Health Data", "Minors"], "Path": "a.pdf"},
+            {"Chunk_id": "TX_2", "State": "Texas", "Topics": ["health  data"], "Path": "a.pdf"},
+            {"Chunk_id": "WA_1", "State": "Washington", "Topics": [], "Path": "b.pdf"},
+        ]
+        faiss_store = FAISS.from_texts(["a", "b", "c"], embeddings, metadatas=metadatas)
+        built = build_metadata_index(faiss_store)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            save_faiss_store(faiss_store, temp_dir)
+            saved_store = load_faiss_store(temp_dir, embeddings)
+            loaded = load_metadata_index(saved_store, temp_dir)
+            self.assertEqual(loaded["Bills"], built["Bills"])
+            built["Bills"]["Saved"] = {"Title": "Saved", "State": "Ohio"}
+            save_metadata_index(built, temp_dir)
+            self.assertIn("Saved", load_metadata_index(saved_store, temp_dir)["Bills"])
+            for facet, value in (("State", "Texas"), ("Topics", "HEALTH DATA"),
+                                 ("Sector", "Health"), ("State", "Ohio")):
+                self.assertEqual(get_doc_ids_for_facet(loaded, facet, value),
+                                 get_doc_ids_for_facet(built, facet, value))
+            self.assertEqual(sorted(loaded["Facets"]["State"]), ["Texas", "Washington"])
+            self.assertEqual(get_doc_id_for_chunk(loaded, "WA_1"),
+                             get_doc_id_for_chunk(built, "WA_1"))
+            self.assertIsNone(get_doc_id_for_chunk(loaded, "Missing"))
+
+
+class TestPageStore(unittest.TestCase):
+    """
+    General unittests for the page store.
+    """
+
+    def test_page_store(self):
+        """
+        Test pages are stored by (Path, Page) and a missing store is not created.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, "pages.sqlite")
+            page_store = PageStore(db_path)
+            self.assertIsNone(page_store.get_page("./pdfs/Texas/a.pdf", 1))
+            self.assertFalse(page_store.has_pages("./pdfs/Texas/a.pdf"))
+            self.assertFalse(os.path.exists(db_path))
+
+            page_store.put_pages("./pdfs/Texas/a.pdf", ["page one", "page two"])
+            self.assertTrue(page_store.has_pages("pdfs/Texas/a.pdf"))
+            self.assertEqual(page_store.get_page("./pdfs/Texas/a.pdf", "2"), "page two")
+            self.assertIsNone(page_store.get_page("./pdfs/Texas/a.pdf", 3))
+
+            # Storing the PDF again replaces its pages
+            page_store.put_pages("./pdfs/Texas/a.pdf", ["new page one"])
+            self.assertEqual(page_store.get_page("./pdfs/Texas/a.pdf", 1), "new page one")
+            self.assertIsNone(page_store.get_page("./pdfs/Texas/a.pdf", 2))
+            page_store.close()
+
+
+class TestIngestManifest(unittest.TestCase):
+    """
+    General unittests for the ingest manifest.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.pdf_path = os.path.join(self.temp_dir.name, "bill.pdf")
+        with open(self.pdf_path, "wb") as pdf_file:
+            pdf_file.write(b"bill content")
+        self.manifest_path = os.path.join(self.temp_dir.name, "manifest.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_manifest_round_trip(self):
+        """
+        Test a recorded PDF is unchanged after saving and loading the manifest.
+        """
+        self.assertEqual(load_ingest_manifest(self.manifest_path), {})
+        manifest = {}
+        self.assertIsNone(get_unchanged_bill_info(manifest, self.pdf_path))
+        record_bill_in_manifest(manifest, self.pdf_path, {"Title": "Title1"})
+        save_ingest_manifest(manifest, self.manifest_path)
+
+        manifest = load_ingest_manifest(self.manifest_path)
+        self.assertEqual(get_unchanged_bill_info(manifest, self.pdf_path),
+                         {"Title": "Title1"})
+
+    def test_manifest_detects_changes(self):
+        """
+        Test a touched PDF with the same content is still unchanged,
+        and a PDF with different content is not.
+        """
+        manifest = {}
+        record_bill_in_manifest(manifest, self.pdf_path, {"Title": "Title1"})
+        os.utime(self.pdf_path, ns=(0, 0))
+        self.assertEqual(get_unchanged_bill_info(manifest, self.pdf_path),
+                         {"Title": "Title1"})
+
+        with open(self.pdf_path, "wb") as pdf_file:
+            pdf_file.write(b"bill CONTENT")
+        os.utime(self.pdf_path, ns=(1, 1))
+        self.assertIsNone(get_unchanged_bill_info(manifest, self.pdf_path))
+
+    @patch("db_manager.faiss_db_manager.add_chunk_to_faiss_index")
+    @patch("db_manager.faiss_db_manager.parse_bill_info")
+    @patch("db_manager.faiss_db_manager.extract_text_from_pdf")
+    def test_add_bills_skips_unchanged(self, mock_extract_text, mock_parse_bill, mock_add_chunk):
+        """
+        Test add_bills_to_faiss_index does no work for PDFs in the manifest.
+        """
+        with patch("sys.stdout", new_callable=StringIO):
+            manifest = {}
+            record_bill_in_manifest(manifest, self.pdf_path, {"Title": "Title1"})
+            bill_info_list = add_bills_to_faiss_index([self.pdf_path], manifest=manifest)
+            mock_extract_text.assert_not_called()
+            mock_parse_bill.assert_not_called()
+            mock_add_chunk.assert_not_called()
+            self.assertEqual(bill_info_list, [{"Title": "Title1"}])
+
 
 class TestWriteToCSV(unittest.TestCase):
     """
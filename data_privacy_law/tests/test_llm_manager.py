@@ -14,8 +14,14 @@ from llm_manager.llm_manager import (
     get_confirmation_result_chain,
     get_document_specific_summary,
     generate_page_summary,
-    parse_bill_variant_for_adding_docs
+    parse_bill_variant_for_adding_docs,
+    clear_chain_registry
     )
+from llm_manager.context_packer import (estimate_tokens,
+    pack_chain_context,
+    pack_context,
+    truncate_to_sentences)
+from langchain.docstore.document import Document
 
 
 class TestLLMResponse(unittest.TestCase):
@@ -23,6 +29,38 @@ class TestLLMResponse(unittest.TestCase):
     Test whether LLM Model related funcitons work properly
     """
 
+    def setUp(self):
+        """
+        Start every test with no chains built, so patched classes are used.
+        """
+        clear_chain_registry()
+
+    def tearDown(self):
+        clear_chain_registry()
+
+    @patch("llm_manager.llm_manager.create_stuff_documents_chain")
+    @patch("llm_manager.llm_manager.ChatGoogleGenerativeAI")
+    @patch("llm_manager.llm_manager.PromptTemplate")
+    def test_chain_registry(self, mock_prompt, mock_genai, mock_chain):
+        """
+        Test each chain is built once and chains with the same model share a client.
+
+        Args:
+            mock_prompt: mock patch for PromptTemplate
+            mock_genai: mock genai for ChatGoogleGenerativeAI
+            mock_chain: mock chain for create_stuff_documents_chain
+        """
+        mock_chain.side_effect = lambda llm, prompt: MagicMock()
+        first_chain = get_conversational_chain()
+        self.assertIs(get_conversational_chain(), first_chain)
+        self.assertEqual(mock_chain.call_count, 1)
+
+        self.assertIsNot(get_confirmation_result_chain(), first_chain)
+        self.assertEqual(mock_chain.call_count, 2)
+        self.assertEqual(mock_prompt.call_count, 2)
+        # Both chains use gemini-2.0-flash-001 at 0.2 but different system prompts
+        self.assertEqual(mock_genai.call_count, 2)
+
     @patch("llm_manager.llm_manager.create_stuff_documents_chain")
     @patch("llm_manager.llm_manager.ChatGoogleGenerativeAI")
     @patch("llm_manager.llm_manager.PromptTemplate")
@@ -102,9 +140,67 @@ class TestLLMResponse(unittest.TestCase):
         self.assertEqual(len(records), len(chunk_ids_with_metadata))
         for record in records:
             self.assertListEqual(
-                list(record.keys()), ["Document", "Page", "Relevant Information", "File Path"]
+                list(record.keys()),
+                ["Document", "Page", "Relevant Information", "File Path", "Failed"]
             )
+            self.assertFalse(record["Failed"])
+
+
+    @patch("llm_manager.llm_manager.Document")
+    @patch("llm_manager.llm_manager.extract_text_from_pdf")
+    @patch("llm_manager.llm_manager.get_document_specific_summary")
+    def test_generate_page_summary_page_store(self, mock_get_doc, mock_extract, mock_doc):
+        """
+        Test generate_page_summary reads pages from the page store instead of the PDF.
+        """
+        _ = mock_get_doc
+        page_store = MagicMock()
+        page_store.get_page.side_effect = lambda path, page: f"{path}_page{page}_text"
+        chunk_ids_with_metadata = [
+            ("path1", "title1", "1"),
+            ("path1", "title1", "3"),
+            ("path2", "title2", "2"),
+        ]
+        records = generate_page_summary(chunk_ids_with_metadata, "test question", page_store)
+        mock_extract.assert_not_called()
+        self.assertEqual(len(records), len(chunk_ids_with_metadata))
+        page_texts = [call.kwargs["page_content"] for call in mock_doc.call_args_list]
+        self.assertCountEqual(page_texts, ["path1_page1_text", "path1_page3_text",
+                                           "path2_page2_text"])
+
+    @patch("llm_manager.llm_manager.get_document_specific_summary")
+    def test_generate_page_summary_concurrent(self, mock_get_doc):
+        """
+        Test the summaries keep the input order and a failing page
+        does not cancel the others.
+        """
+        page_store = MagicMock()
+        page_store.get_page.side_effect = lambda path, page: f"{path}_page{page}_text"
+
+        def fake_summary(inputs):
+            page_text = inputs["context"][0].page_content
+            if page_text == "path2_page1_text":
+                raise RuntimeError("LLM error")
+            return f"summary of {page_text}"
 
+        mock_get_doc.return_value.invoke.side_effect = fake_summary
+        chunk_ids_with_metadata = [
+            ("path2", "title2", "1"),
+            ("path1", "title1", "2"),
+            ("path2", "title2", "3"),
+            ("path1", "title1", "1"),
+        ]
+        with patch("sys.stdout"):
+            records = generate_page_summary(chunk_ids_with_metadata, "test question",
+                                            page_store, max_concurrency=3)
+        self.assertEqual(
+            [(record["File Path"], record["Page"]) for record in records],
+            [("path2", "1"), ("path2", "3"), ("path1", "2"), ("path1", "1")],
+        )
+        self.assertEqual(records[0]["Relevant Information"], "")
+        self.assertEqual(records[1]["Relevant Information"], "summary of path2_page3_text")
+        self.assertEqual([record["Failed"] for record in records],
+                         [True, False, False, False])
 
     def test_llm_response_str(self):
         """
@@ -236,5 +332,72 @@ on TPLC's database"""
         self.assertEqual(result['Filename'], 'Title1')
 
 
+class TestContextPacker(unittest.TestCase):
+    """
+    Test whether the context of the chains is kept within its token budget.
+    """
+
+    def setUp(self):
+        """
+        Three documents of about 100 tokens each, most relevant first.
+        """
+        self.docs = [
+            Document(page_content=" ".join(f"Rule {number} of act {act} applies."
+                                           for number in range(20)),
+                     metadata={"Chunk_ids": [f"Act{act}_Page_1_ChunkNo_0"]})
+            for act in range(3)
+        ]
+
+    def test_estimate_tokens(self):
+        """
+        Test the local token estimate.
+        """
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(estimate_tokens("a, b."), 4)
+
+    def test_truncate_to_sentences(self):
+        """
+        Test whether texts are cut at the last sentence that fits.
+        """
+        text = "First sentence here. Second sentence here. Third sentence here."
+        self.assertEqual(truncate_to_sentences(text, 100), text)
+        self.assertEqual(truncate_to_sentences(text, 11),
+                         "First sentence here. Second sentence here.")
+        self.assertEqual(truncate_to_sentences(text, 2), "")
+
+    def test_pack_context(self):
+        """
+        Test whether documents are kept, truncated and dropped by relevance.
+        """
+        doc_tokens = estimate_tokens(self.docs[0].page_content)
+        packed_docs, report = pack_context(self.docs, doc_tokens + 60)
+
+        self.assertEqual(packed_docs[0], self.docs[0])
+        self.assertEqual(len(packed_docs), 2)
+        self.assertTrue(self.docs[1].page_content.startswith(packed_docs[1].page_content))
+        self.assertTrue(packed_docs[1].page_content.endswith("applies."))
+        self.assertLessEqual(report["Used"], doc_tokens + 60)
+        self.assertEqual(report["Kept"], ["Act0_Page_1_ChunkNo_0"])
+        self.assertEqual(report["Truncated"], ["Act1_Page_1_ChunkNo_0"])
+        self.assertEqual(report["Dropped"], ["Act2_Page_1_ChunkNo_0"])
+
+        packed_docs, report = pack_context(self.docs, 10 * doc_tokens)
+        self.assertEqual(packed_docs, self.docs)
+        self.assertEqual(report["Dropped"], [])
+
+    def test_pack_chain_context(self):
+        """
+        Test whether the question and previous answer count against the budget.
+        """
+        doc_tokens = estimate_tokens(self.docs[0].page_content)
+        answer = "abcd" * doc_tokens
+        packed_docs, report = pack_chain_context(
+            "confirmation", self.docs, "question", answer, token_budget=2 * doc_tokens + 2
+        )
+        self.assertEqual(packed_docs, [self.docs[0]])
+        self.assertEqual(report["Budget"], doc_tokens)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -11,6 +11,7 @@ This module provides unit tests to verify that the State Privacy Law app UI:
 
 import unittest
 import importlib.util
+from unittest.mock import patch, MagicMock
 
 from streamlit.testing.v1 import AppTest
 
@@ -145,6 +146,129 @@ class StatePrivacyLawAppTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             generate_llm_response(non_string_user_question)
 
+    def test_generate_llm_response_streams_answer(self):
+        """
+        Test the final answer is streamed from the confirmation chain to the page.
+        """
+        mock_st = MagicMock()
+        mock_st.session_state.__contains__.return_value = True
+        mock_st.session_state.selected_state = "Texas"
+        mock_st.session_state.answer_cache.lookup.return_value = None
+        mock_st.session_state.index.similarity_search_with_relevance_scores.return_value = [
+            (MagicMock(), 0.9)
+        ]
+        mock_st.write_stream.side_effect = "".join
+        confirmation_chain = MagicMock()
+        confirmation_chain.stream.return_value = iter(["Sorry, the database does not ",
+                                                       "have specific information about ",
+                                                       "your question"])
+        with patch.object(state_privacy, "st", mock_st), \
+            patch.object(state_privacy, "map_chunk_to_metadata",
+                         return_value=([], [])), \
+            patch.object(state_privacy, "assemble_context", return_value=[]), \
+            patch.object(state_privacy, "get_conversational_chain") as mock_chain, \
+            patch.object(state_privacy, "get_confirmation_result_chain",
+                         return_value=confirmation_chain), \
+            patch.object(state_privacy, "generate_page_summary") as mock_summary:
+            mock_chain.return_value.invoke.return_value = "First answer"
+            generate_llm_response("test question")
+
+        confirmation_chain.stream.assert_called_once()
+        self.assertEqual(
+            mock_st.session_state.llm_result,
+            "Sorry, the database does not have specific information about your question",
+        )
+        mock_summary.assert_not_called()
+        # Failed answers are not cached.
+        mock_st.session_state.answer_cache.store.assert_not_called()
+
+    def test_generate_llm_response_caches_good_answer(self):
+        """
+        Test a good answer is stored in the answer cache with its records.
+        """
+        mock_st = MagicMock()
+        mock_st.session_state.__contains__.return_value = True
+        mock_st.session_state.selected_state = "Texas"
+        mock_st.session_state.answer_cache.lookup.return_value = None
+        mock_st.session_state.index.similarity_search_with_relevance_scores.return_value = [
+            (MagicMock(), 0.9)
+        ]
+        mock_st.write_stream.side_effect = "".join
+        confirmation_chain = MagicMock()
+        confirmation_chain.stream.return_value = iter(["Texas regulates ", "biometric data."])
+        records = [{"Document": "Bill", "Page": "1", "Relevant Information": "Info",
+                    "File Path": "./pdfs/Texas/bill.pdf", "Failed": False}]
+        with patch.object(state_privacy, "st", mock_st), \
+            patch.object(state_privacy, "map_chunk_to_metadata",
+                         return_value=([], [])), \
+            patch.object(state_privacy, "assemble_context", return_value=[]), \
+            patch.object(state_privacy, "get_conversational_chain") as mock_chain, \
+            patch.object(state_privacy, "get_confirmation_result_chain",
+                         return_value=confirmation_chain), \
+            patch.object(state_privacy, "generate_page_summary", return_value=records):
+            mock_chain.return_value.invoke.return_value = "First answer"
+            generate_llm_response("test question")
+
+        mock_st.session_state.answer_cache.store.assert_called_once()
+        self.assertEqual(mock_st.session_state.answer_cache.store.call_args.args[3:5],
+                         ("Texas regulates biometric data.", records))
+
+    def test_generate_llm_response_skips_cache_for_failed_summary(self):
+        """
+        Test a good answer is not cached when one of its page summaries failed.
+        """
+        mock_st = MagicMock()
+        mock_st.session_state.__contains__.return_value = True
+        mock_st.session_state.selected_state = "Texas"
+        mock_st.session_state.answer_cache.lookup.return_value = None
+        mock_st.session_state.index.similarity_search_with_relevance_scores.return_value = [
+            (MagicMock(), 0.9)
+        ]
+        mock_st.write_stream.side_effect = "".join
+        confirmation_chain = MagicMock()
+        confirmation_chain.stream.return_value = iter(["Texas regulates ", "biometric data."])
+        records = [{"Document": "Bill", "Page": "1", "Relevant Information": "Info",
+                    "File Path": "./pdfs/Texas/bill.pdf", "Failed": False},
+                   {"Document": "Bill", "Page": "2", "Relevant Information": "",
+                    "File Path": "./pdfs/Texas/bill.pdf", "Failed": True}]
+        with patch.object(state_privacy, "st", mock_st), \
+            patch.object(state_privacy, "map_chunk_to_metadata",
+                         return_value=([], [])), \
+            patch.object(state_privacy, "assemble_context", return_value=[]), \
+            patch.object(state_privacy, "get_conversational_chain") as mock_chain, \
+            patch.object(state_privacy, "get_confirmation_result_chain",
+                         return_value=confirmation_chain), \
+            patch.object(state_privacy, "generate_page_summary", return_value=records):
+            mock_chain.return_value.invoke.return_value = "First answer"
+            generate_llm_response("test question")
+
+        self.assertEqual(mock_st.session_state.llm_result, "Texas regulates biometric data.")
+        mock_st.session_state.answer_cache.store.assert_not_called()
+
+    def test_generate_llm_response_cached_answer(self):
+        """
+        Test a cached answer is shown without retrieval or LLM calls.
+        """
+        mock_st = MagicMock()
+        mock_st.session_state.__contains__.return_value = True
+        mock_st.session_state.selected_state = "Texas"
+        mock_st.session_state.answer_cache.lookup.return_value = {
+            "Question": "test question",
+            "Answer": "Cached answer",
+            "Records": [{"Document": "Bill", "Page": "1", "Relevant Information": "Info",
+                         "File Path": "./pdfs/Texas/bill.pdf"}],
+        }
+        with patch.object(state_privacy, "st", mock_st), \
+            patch.object(state_privacy, "get_conversational_chain") as mock_chain:
+            generate_llm_response("Test question")
+
+        mock_st.session_state.index.similarity_search_with_relevance_scores.assert_not_called()
+        mock_chain.assert_not_called()
+        mock_st.write.assert_any_call("Cached answer")
+        self.assertEqual(mock_st.session_state.llm_result, "Cached answer")
+        self.assertEqual(list(mock_st.session_state.relevant_df.columns),
+                         ["Document", "Page", "Relevant Information"])
+
 
 if __name__ == "__main__":
     unittest.main()